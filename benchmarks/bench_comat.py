@@ -0,0 +1,79 @@
+"""  Co-occurrence matrix benchmarks
+
+"""
+
+from ctypes import c_int
+
+import gentex
+from .common import SHAPES, make_image, make_mask, throughput
+
+
+class CoMatMult:
+    """comat_mult over image dimension/size, grey levels, template size
+    and mask density"""
+    params = (list(SHAPES), [4, 256], [3, 5], [1.0, 0.1])
+    param_names = ['shape', 'levels', 'template', 'density']
+    timeout = 300
+
+    def setup(self, shape, levels, template, density):
+        shape = SHAPES[shape]
+        self.image = make_image(shape, levels).astype(c_int)
+        self.mask = make_mask(shape, density).astype(c_int)
+        self.offsets = gentex.template.Template('RectBox', [template] * len(shape), len(shape), False).offarray
+        self.levels = levels
+        self.voxels = int(self.mask.sum())
+
+    def time_comat_mult(self, *args):
+        gentex.comat.comat_mult(self.image, self.mask, self.offsets, levels=self.levels)
+
+    def peakmem_comat_mult(self, *args):
+        gentex.comat.comat_mult(self.image, self.mask, self.offsets, levels=self.levels)
+
+    def track_voxels_per_second(self, *args):
+        return throughput(lambda: gentex.comat.comat_mult(self.image, self.mask, self.offsets, levels=self.levels),
+                          self.voxels)
+    track_voxels_per_second.unit = 'voxels/s'
+
+
+class CoMatFamily:
+    """comat_family (one histogram per Haralick direction and distance)"""
+    params = (['2D', '3D'], [4, 64])
+    param_names = ['shape', 'levels']
+    timeout = 300
+
+    def setup(self, shape, levels):
+        shape = SHAPES[shape]
+        self.image = make_image(shape, levels).astype(c_int)
+        self.mask = make_mask(shape, 1.0).astype(c_int)
+        self.offsets = gentex.template.Template('Directions', [1, 2, 4], len(shape), False).offarray
+        self.levels = levels
+
+    def time_comat_family(self, *args):
+        gentex.comat.comat_family(self.image, self.mask, self.offsets, levels=self.levels)
+
+    def peakmem_comat_family(self, *args):
+        gentex.comat.comat_family(self.image, self.mask, self.offsets, levels=self.levels)
+
+
+class MeasureMap:
+    """comat_measure_map voxel-wise maps over window size and levels"""
+    params = ([1, 3, 5], [8, 64])
+    param_names = ['window', 'levels']
+    timeout = 300
+
+    def setup(self, window, levels):
+        shape = (256, 256)
+        self.image = make_image(shape, levels).astype(c_int)
+        self.mask = make_mask(shape, 1.0).astype(c_int)
+        self.offsets = gentex.template.Template('RectBox', [3, 3], 2, False).offarray
+        self.window = gentex.template.Template('RectBox', [window, window], 2, True).offarray
+        self.levels = levels
+        self.measures = list(gentex.comat.MAP_MEASURES)
+
+    def time_measure_map(self, *args):
+        gentex.comat.comat_measure_map(self.image, self.mask, self.offsets, window=self.window, levels=self.levels,
+                                       measures=self.measures, coordmom=2, probmom=2)
+
+    def track_voxels_per_second(self, *args):
+        return throughput(lambda: self.time_measure_map(), self.image.size)
+    track_voxels_per_second.unit = 'voxels/s'
@@ -0,0 +1,58 @@
+"""  Feature space and clustering benchmarks
+
+"""
+
+import numpy as np
+
+import gentex
+from .common import make_image, make_mask, throughput
+
+SHAPES = {'2D': (512, 512),
+          '3D': (64, 64, 64)}
+
+
+class FeatureSpace:
+    """Features construction over image size, template size, feature
+    space dtype and mask density"""
+    params = (list(SHAPES), [3, 5], ['float32', 'float16', 'uint8'], [1.0, 0.3])
+    param_names = ['shape', 'template', 'dtype', 'density']
+    timeout = 300
+
+    def setup(self, shape, template, dtype, density):
+        shape = SHAPES[shape]
+        self.images = [make_image(shape, 256, seed=0), make_image(shape, 256, seed=1).astype(float)]
+        self.mask = make_mask(shape, density)
+        self.template = gentex.template.Template('RectBox', [template] * len(shape), len(shape), False)
+        self.dtype = np.dtype(dtype).type
+        self.voxels = int(self.mask.sum())
+
+    def time_features(self, *args):
+        gentex.features.Features(self.images, self.mask, self.template.offsets, dtype=self.dtype)
+
+    def peakmem_features(self, *args):
+        gentex.features.Features(self.images, self.mask, self.template.offsets, dtype=self.dtype)
+
+    def track_voxels_per_second(self, *args):
+        return throughput(lambda: self.time_features(), self.voxels)
+    track_voxels_per_second.unit = 'voxels/s'
+
+
+class Clustering:
+    """clusfs with a fixed number of clusters and with the number picked
+    by BIC (numclus < 2)"""
+    params = ([4, 16, 0], [20000, 200000])
+    param_names = ['numclus', 'points']
+    timeout = 600
+    # picking the number of clusters runs kmeans clusmax - 1 times
+    number = 1
+    repeat = 1
+
+    def setup(self, numclus, points):
+        image = make_image((points,), 256).astype(float)
+        self.fe = gentex.features.Features([image], np.ones(points), [[-1], [1]])
+
+    def time_clusfs(self, numclus, points):
+        self.fe.clusfs(numclus=numclus, clusmax=8)
+
+    def peakmem_clusfs(self, numclus, points):
+        self.fe.clusfs(numclus=numclus, clusmax=8)
@@ -0,0 +1,71 @@
+"""  Texture measure benchmarks
+
+"""
+
+import numpy as np
+
+import gentex
+from .common import throughput
+
+PARAMS = dict(coordmom=2, probmom=2, rllen=0.1, clusmom=2)
+
+
+def make_comat(levels, seed=0):
+    """Diagonally dominant (i.e. textured) random co-occurrence counts"""
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 50, size=(levels, levels)) + np.diag(rng.randint(0, 50 * levels, size=levels))
+
+
+class Measure:
+    """Each Texmeas measure on its own over the number of grey levels
+    (epsilon machine cache cleared so nothing is reused)"""
+    params = (gentex.texmeas.MEASURES, [4, 16, 64, 256])
+    param_names = ['measure', 'levels']
+    timeout = 300
+
+    def setup(self, measure, levels):
+        self.comat = make_comat(levels)
+
+    def time_measure(self, measure, levels):
+        gentex.texmeas.em_cache.clear()
+        gentex.texmeas.Texmeas(self.comat, measure=measure, **PARAMS)
+
+
+class AllMeasures:
+    """calc_all on one matrix and the functional API on a stream of matrices"""
+    params = [4, 16, 64]
+    param_names = ['levels']
+    timeout = 300
+
+    def setup(self, levels):
+        self.comats = [make_comat(levels, seed) for seed in range(20)]
+
+    def time_calc_all(self, levels):
+        gentex.texmeas.em_cache.clear()
+        gentex.texmeas.Texmeas(self.comats[0], measure='CM Entropy', **PARAMS).calc_all()
+
+    def track_matrices_per_second(self, levels):
+        gentex.texmeas.em_cache.clear()
+        return throughput(lambda: [gentex.texmeas.measures(cm, params=PARAMS) for cm in self.comats],
+                          len(self.comats))
+    track_matrices_per_second.unit = 'matrices/s'
+
+
+class BatchMeasures:
+    """batch_measures over stack size and grey levels"""
+    params = ([1000, 100000], [4, 16])
+    param_names = ['matrices', 'levels']
+    timeout = 300
+
+    def setup(self, matrices, levels):
+        self.comats = np.random.RandomState(0).randint(0, 50, size=(matrices, levels, levels))
+
+    def time_batch_measures(self, *args):
+        gentex.texmeas.batch_measures(self.comats, **PARAMS)
+
+    def peakmem_batch_measures(self, *args):
+        gentex.texmeas.batch_measures(self.comats, **PARAMS)
+
+    def track_matrices_per_second(self, matrices, levels):
+        return throughput(lambda: self.time_batch_measures(), matrices)
+    track_matrices_per_second.unit = 'matrices/s'
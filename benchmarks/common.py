@@ -0,0 +1,32 @@
+"""  Shared helpers for the gentex benchmarks
+
+"""
+
+import time
+
+import numpy as np
+
+# image shapes from small to production sized volumes
+SHAPES = {'1D': (1000000,),
+          '2D': (1024, 1024),
+          '3D': (128, 128, 128),
+          '4D': (32, 32, 32, 32)}
+
+
+def make_image(shape, levels, seed=0):
+    """Random discrete level image of the given shape"""
+    return np.random.RandomState(seed).randint(0, levels, size=shape)
+
+
+def make_mask(shape, density, seed=1):
+    """Random 0,1 mask keeping roughly density of the voxels"""
+    if density >= 1.0:
+        return np.ones(shape, dtype=int)
+    return (np.random.RandomState(seed).random_sample(shape) < density).astype(int)
+
+
+def throughput(func, count):
+    """Items per second (count items) of one call to func"""
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
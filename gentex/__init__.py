@@ -1,4 +1,4 @@
-from . import comat, features, texmeas, template, sphere
+import importlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -6,3 +6,18 @@ logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
 __version__ = '0.1.2'
+
+# Submodules are imported on first access (gentex.comat, gentex.features...)
+# so that importing gentex doesn't pay for numpy and the native library
+# until they are used
+__all__ = ['comat', 'features', 'texmeas', 'template', 'sphere', 'pipeline', 'profiling', 'memory', 'shared', 'diskcache', 'aio', 'cli']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,250 @@
+"""  gentex.aio package
+
+asyncio versions of the main entry points, for embedding gentex in an
+asyncio service without blocking its event loop
+
+The coroutines below run the corresponding gentex function on the
+executor of a Runner: a thread pool by default (the kernels and most of
+numpy release the GIL) or any concurrent.futures executor, e.g. a process
+pool, in which case gentex.shared handles avoid pickling large images. A
+Runner bounds the number of jobs submitted at a time; cancelling a
+coroutine drops its job if it hasn't started yet (a running job finishes
+and its result is thrown away).
+
+ROIBatcher coalesces the co-occurrence requests for regions of the same
+image that arrive close together into single comat.comat_rois calls.
+
+Example
+-------
+
+    gentex.aio.configure(max_concurrency=4)
+
+    async def handle(image, mask):
+        cm = await gentex.aio.comat_mult(image, mask, offsets, levels=8)
+        return await gentex.aio.measures(cm, ['CM Entropy', 'Contrast'], {'coordmom': 2, 'probmom': 1})
+
+"""
+
+import asyncio
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import c_int
+
+import numpy as np
+
+from . import comat as _comat, features as _features, shared, texmeas as _texmeas
+
+# Runner used by the module level coroutines (see configure)
+_runner = None
+
+
+class Runner:
+    """Class runner: runs blocking gentex calls on an executor with bounded concurrency
+
+    Parameters
+    ----------
+
+    executor: concurrent.futures.Executor
+        Executor the calls run on (default = a thread pool with one
+        thread per CPU, shut down with the runner)
+
+    max_concurrency: int
+        Largest number of calls submitted to the executor at a time, per
+        event loop (default = no limit besides the executor's own)
+    """
+
+    def __init__(self, executor=None, max_concurrency=None):
+        assert max_concurrency is None or max_concurrency > 0
+        self._own = executor is None
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1) if executor is None else executor
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, loop):
+        # asyncio primitives belong to one event loop
+        sem = self._semaphores.get(loop)
+        if sem is None:
+            sem = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    async def run(self, func, *args, **kwargs):
+        """Awaits func(*args, **kwargs) run on the executor"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        if self.max_concurrency is None:
+            return await loop.run_in_executor(self.executor, call)
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self.executor, call)
+
+    def shutdown(self, wait=True):
+        """Shuts the executor down if the runner made it"""
+        if self._own:
+            self.executor.shutdown(wait=wait)
+
+
+def configure(executor=None, max_concurrency=None):
+    """Sets the Runner used by the coroutines of this module, returns it"""
+    global _runner
+    old, _runner = _runner, Runner(executor, max_concurrency)
+    if old is not None:
+        old.shutdown(wait=False)
+    return _runner
+
+
+def shutdown(wait=True):
+    """Shuts the module's Runner down; the next coroutine call makes a default one"""
+    global _runner
+    old, _runner = _runner, None
+    if old is not None:
+        old.shutdown(wait=wait)
+
+
+def get_runner():
+    """Runner used by the coroutines of this module (a default one is made on first use)"""
+    if _runner is None:
+        configure()
+    return _runner
+
+
+async def comat_mult(image, mask, coordset, levels=255, budget=None):
+    """comat.comat_mult run on the Runner"""
+    return await get_runner().run(_comat.comat_mult, image, mask, coordset, levels=levels, budget=budget)
+
+
+async def comat_family(image, mask, coordset, levels=255, budget=None):
+    """comat.comat_family run on the Runner"""
+    return await get_runner().run(_comat.comat_family, image, mask, coordset, levels=levels, budget=budget)
+
+
+async def comat_rois(image, labels, coordset, levels=255, nlabels=None):
+    """comat.comat_rois run on the Runner"""
+    return await get_runner().run(_comat.comat_rois, image, labels, coordset, levels=levels, nlabels=nlabels)
+
+
+async def comat_measure_map(image, mask, coordset, **kwargs):
+    """comat.comat_measure_map run on the Runner"""
+    return await get_runner().run(_comat.comat_measure_map, image, mask, coordset, **kwargs)
+
+
+async def features(images, mask, template, **kwargs):
+    """features.Features instance built on the Runner"""
+    return await get_runner().run(_features.Features, images, mask, template, **kwargs)
+
+
+async def measures(comat, names=None, params=None):
+    """texmeas.measures run on the Runner"""
+    return await get_runner().run(_texmeas.measures, comat, names, params)
+
+
+async def batch_measures(comats, measures=None, **kwargs):
+    """texmeas.batch_measures run on the Runner"""
+    return await get_runner().run(_texmeas.batch_measures, comats, measures, **kwargs)
+
+
+def _disjoint(masks):
+    """Groups the indices of masks so that the masks of a group don't overlap"""
+    groups, unions = [], []
+    for idx, mask in enumerate(masks):
+        for group, union in zip(groups, unions):
+            if not np.any(union & mask):
+                group.append(idx)
+                union |= mask
+                break
+        else:
+            groups.append([idx])
+            unions.append(mask.copy())
+    return groups
+
+
+class ROIBatcher:
+    """Class ROI batcher: coalesces co-occurrence requests for regions of an image
+
+    Requests made through comat() within delay seconds of each other (or
+    until maxbatch are waiting) are answered by one comat.comat_rois call
+    per set of non overlapping regions, i.e. one pass over the image and
+    one executor job instead of one per region; each gets the same counts
+    as comat.comat_mult(image, mask, coordset, levels).
+
+    Parameters
+    ----------
+
+    image: 1-4 dimensional ndarray of dtype int (or gentex.shared.SharedArray)
+        Image the regions are taken from
+
+    coordset: list of offsets
+        Offsets of the co-occurrence histograms
+
+    levels: int
+        Number of grey levels of image (default = 255)
+
+    delay: float
+        Seconds the first request of a batch waits for others (default = 0.002)
+
+    maxbatch: int
+        Number of waiting requests that starts a batch right away (default = 64)
+
+    runner: Runner
+        Runner the kernel calls are made on (default = the module's)
+    """
+
+    def __init__(self, image, coordset, levels=255, delay=0.002, maxbatch=64, runner=None):
+        self.image = image
+        self.shape = shared.asarray(image).shape
+        self.coordset = coordset
+        self.levels = levels
+        self.delay = delay
+        self.maxbatch = maxbatch
+        self.runner = runner
+        self._pending = []  # (mask, future) of the requests waiting
+        self._timer = None
+        self._tasks = set()  # batches running
+
+    async def comat(self, mask):
+        """Co-occurrence histogram of the region where mask == 1"""
+        mask = np.asarray(shared.asarray(mask)) == 1
+        assert mask.shape == self.shape
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((mask, future))
+        if len(self._pending) >= self.maxbatch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending = [(mask, future) for mask, future in self._pending if not future.done()]
+        self._pending = []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending):
+        runner = get_runner() if self.runner is None else self.runner
+        try:
+            for group in _disjoint([mask for mask, future in pending]):
+                # requests cancelled while earlier groups ran are left out
+                group = [idx for idx in group if not pending[idx][1].done()]
+                if not group:
+                    continue
+                labels = np.zeros(self.shape, dtype=c_int)
+                for label, idx in enumerate(group, 1):
+                    labels[pending[idx][0]] = label
+                out = await runner.run(_comat.comat_rois, self.image, labels, self.coordset, self.levels, len(group))
+                for label, idx in enumerate(group, 1):
+                    if not pending[idx][1].done():
+                        pending[idx][1].set_result(out[label - 1])
+        except asyncio.CancelledError:
+            for mask, future in pending:
+                future.cancel()
+            raise
+        except Exception as e:
+            for mask, future in pending:
+                if not future.done():
+                    future.set_exception(e)
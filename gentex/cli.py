@@ -0,0 +1,317 @@
+"""  gentex.cli package
+
+The gentex console command: runs the texture pipeline (see
+gentex.pipeline) over a batch of images on worker processes
+
+    gentex config.json 'scans/*.npy' --masks 'masks/*.npy' -o results.csv -j 4
+
+config.json holds the Pipeline settings, e.g.
+
+    {"template": {"type": "RectBox", "sizes": [3, 3], "dimension": 2, "inclusion": false},
+     "numclus": 4,
+     "measures": ["CM Entropy", "Energy Uniformity", "Contrast"],
+     "params": {"coordmom": 2, "probmom": 1}}
+
+where template is either the Template arguments or a list of offsets;
+coordset, clusmax, cluscrit and dtype can be given as well.
+
+Images are .npy files or anything imageio reads (colour images are
+averaged to grey). Masks are paired with the images in sorted order; by
+default the nonzero voxels of each image are used. With --rois each
+nonzero label of the mask is processed as its own region.
+
+Results are written as each image finishes: one row per image (or ROI)
+to a .csv file (image, roi, number of rois of the image, measures...), or to a .npz (images, rois, measures, values) or .npy
+(values only) file assembled at the end from per image parts kept next
+to it. --resume skips the images already in the output, so a crashed
+run picks up where it left off.
+
+"""
+
+import argparse
+import collections
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from . import pipeline, template
+
+# Pipeline of this (worker) process, built from the config once
+_pipe = None
+
+
+def load_config(path):
+    """Reads a JSON config into Pipeline keyword arguments"""
+    with open(path) as f:
+        config = json.load(f)
+    assert 'template' in config, 'config needs a template'
+    return config
+
+
+def make_pipeline(config):
+    """Pipeline for a config as read by load_config"""
+    kwargs = dict(config)
+    temp = kwargs.pop('template')
+    if isinstance(temp, dict):
+        temp = template.Template(**temp)
+    if 'dtype' in kwargs:
+        kwargs['dtype'] = np.dtype(kwargs['dtype'])
+    return pipeline.Pipeline(temp, **kwargs)
+
+
+def expand(patterns):
+    """Files matching a list of paths or glob patterns, each pattern sorted"""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError('No file matches %s' % pattern)
+        files.extend(matches)
+    return files
+
+
+def load_image(path):
+    """Image as an ndarray: np.load for .npy files, imageio otherwise"""
+    if str(path).endswith('.npy'):
+        return np.load(path)
+    import imageio
+    im = np.asarray(imageio.imread(path))
+    if im.ndim == 3 and im.shape[-1] in (3, 4):
+        im = np.rint(im[..., :3].mean(axis=-1)).astype(im.dtype)
+    return im
+
+
+def _init_worker(config):
+    global _pipe
+    _pipe = make_pipeline(config)
+
+
+def process(image, mask=None, rois=False):
+    """Runs the worker's pipeline on one image file
+
+    Returns (image, list of (roi, dict of measures)) with roi 0 for the
+    whole mask"""
+    im = load_image(image)
+    labels = (im != 0) if mask is None else load_image(mask)
+    assert labels.shape == im.shape, 'mask %s does not match image %s' % (mask, image)
+    if rois:
+        regions = [int(r) for r in np.unique(labels) if r != 0]
+    else:
+        regions = [0]
+    results = []
+    for roi in regions:
+        roimask = np.where(labels == roi if roi else labels != 0, 1, 0)
+        results.append((roi, _pipe.run([im], roimask)['measures']))
+    return image, results
+
+
+class CSVWriter:
+    """Appends result rows to a CSV file, one line per image/ROI; each row
+    carries the number of ROI rows of its image so that resuming can tell
+    the images whose rows all made it to disk"""
+
+    def __init__(self, path, measures, resume):
+        self.path = path
+        self.header = ['image', 'roi', 'rois'] + list(measures)
+        rows = []
+        if resume and os.path.exists(path):
+            with open(path, newline='') as f:
+                rows = list(csv.reader(f))
+            if rows and rows[0] != self.header:
+                raise ValueError('%s has columns %s, not %s' % (path, rows[0], self.header))
+            # drop a row cut short by a crash
+            rows = [row for row in rows[1:] if len(row) == len(self.header)]
+            # and the rows of images that didn't get all of theirs written
+            counts = collections.Counter(row[0] for row in rows)
+            rows = [row for row in rows if str(counts[row[0]]) == row[2]]
+        self.done = set(row[0] for row in rows)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            csv.writer(f).writerows([self.header] + rows)
+        os.replace(tmp, path)
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+
+    def write(self, image, results):
+        self._writer.writerows([[image, roi, len(results)] + [repr(float(vals[m])) for m in self.header[3:]]
+                                for roi, vals in results])
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ArrayWriter:
+    """Saves each image's results as a part file in <path>.parts and
+    gathers the parts into the .npz/.npy output on close"""
+
+    def __init__(self, path, measures, resume):
+        self.path = path
+        self.measures = list(measures)
+        self.parts = Path(path + '.parts')
+        self.parts.mkdir(exist_ok=True)
+        self.done = set()
+        for part in self.parts.glob('*.npz'):
+            if not resume:
+                part.unlink()
+                continue
+            with np.load(part) as data:
+                if list(data['measures']) != self.measures:
+                    raise ValueError('%s holds measures %s, not %s' % (part, list(data['measures']), self.measures))
+                self.done.add(str(data['image']))
+
+    def _part(self, image):
+        return self.parts / (hashlib.sha1(image.encode()).hexdigest() + '.npz')
+
+    def write(self, image, results):
+        values = np.array([[vals[m] for m in self.measures] for roi, vals in results], dtype=np.float64)
+        tmp = str(self._part(image)) + '.tmp.npz'
+        np.savez(tmp, image=image, rois=[roi for roi, vals in results], measures=self.measures, values=values)
+        os.replace(tmp, self._part(image))
+
+    def close(self, images=()):
+        """Gathers the parts of images (in that order) into the output"""
+        names, rois, values = [], [], []
+        for image in images:
+            if not self._part(image).exists():
+                continue
+            with np.load(self._part(image)) as data:
+                names += [image] * len(data['rois'])
+                rois += list(data['rois'])
+                values.append(data['values'])
+        values = np.concatenate(values) if values else np.zeros((0, len(self.measures)))
+        if self.path.endswith('.npz'):
+            np.savez(self.path, images=np.array(names, dtype=str), rois=np.array(rois, dtype=int),
+                     measures=np.array(self.measures, dtype=str), values=values)
+        else:
+            np.save(self.path, values)
+
+
+def run(config, images, masks=None, output='gentex.csv', workers=1, rois=False, resume=False, progress=sys.stderr):
+    """Runs the pipeline of config over images, writing to output
+
+    Parameters
+    ----------
+
+    config: dict
+        Pipeline settings (see load_config)
+
+    images: list of str
+        Image files
+
+    masks: list of str
+        Mask files, one per image (default = nonzero voxels of each image)
+
+    output: str
+        .csv, .npz or .npy file the results go to
+
+    workers: int
+        Number of worker processes (1 = run in this process)
+
+    rois: bool
+        Whether each nonzero label of the masks is a separate region
+
+    resume: bool
+        Whether to keep the results already in output and skip their images
+
+    progress: file
+        Where progress lines go (None = quiet)
+
+    Returns
+    -------
+
+    dict
+        image -> error message for the images that failed
+    """
+    measures = list(config.get('measures', ['CM Entropy']))
+    if masks is not None:
+        assert len(masks) == len(images), '%d masks for %d images' % (len(masks), len(images))
+    else:
+        masks = [None] * len(images)
+    if not resume and os.path.exists(output):
+        raise FileExistsError('%s exists, resume (--resume) to add to it' % output)
+    if output.endswith('.csv'):
+        writer = CSVWriter(output, measures, resume)
+    elif output.endswith(('.npz', '.npy')):
+        writer = ArrayWriter(output, measures, resume)
+    else:
+        raise ValueError('output must be a .csv, .npz or .npy file')
+
+    todo = [(im, mask) for im, mask in zip(images, masks) if im not in writer.done]
+    total, count, errors = len(images), len(images) - len(todo), {}
+    start = time.perf_counter()
+
+    def report(image, error=None):
+        if progress is not None:
+            elapsed = time.perf_counter() - start
+            status = 'failed: %s' % error if error else 'done'
+            print('[%d/%d] %s %s (%.1fs)' % (count, total, image, status, elapsed), file=progress, flush=True)
+
+    try:
+        if workers <= 1:
+            _init_worker(config)
+            for im, mask in todo:
+                count += 1
+                try:
+                    writer.write(*process(im, mask, rois))
+                    report(im)
+                except Exception as e:
+                    errors[im] = repr(e)
+                    report(im, errors[im])
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+                futures = {pool.submit(process, im, mask, rois): im for im, mask in todo}
+                for future in as_completed(futures):
+                    count += 1
+                    im = futures[future]
+                    try:
+                        writer.write(*future.result())
+                        report(im)
+                    except Exception as e:
+                        errors[im] = repr(e)
+                        report(im, errors[im])
+    finally:
+        if isinstance(writer, ArrayWriter):
+            writer.close(images)
+        else:
+            writer.close()
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='gentex', description='Batch texture measures of images')
+    parser.add_argument('config', help='JSON file with the pipeline settings')
+    parser.add_argument('images', nargs='+', help='image files or glob patterns (.npy, or read by imageio)')
+    parser.add_argument('-m', '--masks', nargs='+', help='mask files or glob patterns, paired with the images '
+                        'in sorted order (default = nonzero voxels of each image)')
+    parser.add_argument('-o', '--output', default='gentex.csv', help='.csv, .npz or .npy output (default gentex.csv)')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('--rois', action='store_true', help='compute the measures for each nonzero mask label')
+    parser.add_argument('--resume', action='store_true', help='skip the images already in the output')
+    parser.add_argument('-q', '--quiet', action='store_true', help="don't report progress")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+        images = expand(args.images)
+        masks = expand(args.masks) if args.masks else None
+        errors = run(config, images, masks, args.output, args.workers, args.rois, args.resume,
+                     None if args.quiet else sys.stderr)
+    except (AssertionError, OSError, ValueError) as e:
+        parser.error(str(e))
+    if errors:
+        print('%d of %d images failed' % (len(errors), len(images)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
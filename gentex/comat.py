@@ -39,23 +39,18 @@
 """
 
 import sys
+import threading
+from ctypes import c_int, c_uint8, c_double, c_char, Structure, POINTER
 from pathlib import Path
 import numpy as np
 
+from . import diskcache, memory, profiling, shared
 
-try:
-    from ctypes import c_int, c_uint8, c_double, c_char, Structure, POINTER
-except:
-    print('Requires ctypes > 1.0.1')
-    sys.exit(-1)
-
-try:
-    _comat = np.ctypeslib.load_library('_libmakecomat', Path(__file__).parents[1])
-except:
-    print(
-        'Failed to load _libmakecomat.so.  '
-        'Compile the library using python setup.py build_ext -i from the package root directory.')
-    sys.exit(-1)
+# _libmakecomat is only loaded by the first calculation that needs it (see
+# _lib()), so importing gentex stays cheap and a missing library only
+# matters to code that builds co-occurrence matrices
+_comat = None
+_loadlock = threading.Lock()
 
 array_1d_int = np.ctypeslib.ndpointer(dtype=np.intc, ndim=1,
                                       flags='CONTIGUOUS')
@@ -65,6 +60,16 @@ array_3d_int = np.ctypeslib.ndpointer(dtype=np.intc, ndim=3,
                                       flags='CONTIGUOUS')
 array_4d_int = np.ctypeslib.ndpointer(dtype=np.intc, ndim=4,
                                       flags='CONTIGUOUS')
+array_int = np.ctypeslib.ndpointer(dtype=np.intc, flags='CONTIGUOUS')
+array_float = np.ctypeslib.ndpointer(dtype=np.double, flags='CONTIGUOUS')
+
+# Measures computed by comat_measure_map -> kernel code
+MAP_MEASURES = {'CM Entropy': 0,
+                'Energy Uniformity': 1,
+                'Contrast': 2,
+                'Homogeneity': 3,
+                'Inverse Difference Moment': 4,
+                'Maximum Probability': 5}
 
 # Define API's
 
@@ -133,7 +138,46 @@ libmakecomat_api = {
                         array_1d_int,
                         c_int, c_int,
                         array_2d_int],
-    )
+    ),
+    'makecomat_mult': (None,
+                       [array_int, array_int,
+                        array_1d_int,
+                        array_2d_int,
+                        c_int,
+                        c_int,
+                        c_int,
+                        array_int],
+    ),
+    'makecomat_cross': (None,
+                        [array_int, array_int,
+                         c_int, c_int,
+                         array_1d_int,
+                         array_2d_int,
+                         c_int,
+                         c_int,
+                         array_1d_int,
+                         array_int],
+    ),
+    'makecomat_labels': (None,
+                         [array_int, array_int,
+                          array_1d_int,
+                          array_2d_int,
+                          c_int,
+                          c_int,
+                          c_int,
+                          array_int],
+    ),
+    'comat_measure_map': (None,
+                          [array_int, array_int, array_int,
+                           array_1d_int,
+                           array_2d_int, c_int,
+                           array_2d_int, c_int,
+                           c_int,
+                           array_1d_int, c_int,
+                           c_double, c_double,
+                           array_1d_int, array_1d_int,
+                           array_float],
+    ),
 }
 
 
@@ -144,11 +188,130 @@ def register_api(lib, api):
         func.argtypes = argtypes
 
 
-register_api(_comat, libmakecomat_api)
+def _lib():
+    """The _libmakecomat library with its API registered, loaded on first use"""
+    global _comat
+    if _comat is None:
+        with _loadlock:
+            if _comat is None:
+                try:
+                    lib = np.ctypeslib.load_library('_libmakecomat', Path(__file__).parents[1])
+                except OSError as e:
+                    raise ImportError(
+                        'Failed to load _libmakecomat.so.  '
+                        'Compile the library using python setup.py build_ext -i '
+                        'from the package root directory.') from e
+                register_api(lib, libmakecomat_api)
+                _comat = lib
+    return _comat
+
+
+def _check(image, mask, levels):
+    """Checks an image/mask pair for the kernels"""
+    assert 1 <= image.ndim <= 4
+    assert image.min() >= 0
+    assert image.max() < levels
+    assert mask.ndim == image.ndim
+
+
+def _prepare(image, mask, levels, labels=False):
+    """Checks an image/mask pair and returns them as C contiguous c_int
+    arrays for the kernels (no copy is made if they already are); with
+    labels the mask is a label image, every label > 0 is inside"""
+    with profiling.stage('comat.prepare') as st:
+        _check(image, mask, levels)
+        cimage, cmask = np.ascontiguousarray(image, dtype=c_int), np.ascontiguousarray(mask, dtype=c_int)
+        if st:
+            inside = int(np.count_nonzero(cmask > 0 if labels else cmask == 1))
+            st.count(voxels=cimage.size, masked=cimage.size - inside,
+                     bytes=(cimage.nbytes if cimage is not image else 0) + (cmask.nbytes if cmask is not mask else 0))
+    return cimage, cmask
+
+
+def _count_kernel(st, mask, noffsets):
+    """Reports the work of a co-occurrence kernel call to the profiling stage st"""
+    if st:
+        voxels = int(np.count_nonzero(mask == 1))
+        st.count(voxels=voxels, masked=mask.size - voxels, offsets=noffsets)
+
+
+def _accumulate(image, mask, coords, levels, out):
+    """Adds the co-occurrence counts at offset coords to out
+    (image and mask as returned by _prepare)"""
+    coords = np.asarray(coords, dtype=c_int)
+    assert len(coords) == image.ndim
+    kernel = getattr(_lib(), 'makecomat%dD' % image.ndim)
+    with profiling.stage('comat.kernel') as st:
+        kernel(image, mask, *image.shape, coords, levels, out)
+        _count_kernel(st, mask, 1)
+
+
+def _accumulate_2T(image1, mask1, image2, mask2, coords, levels1, levels2, out):
+    """Adds the 2 image co-occurrence counts at offset coords to out
+    (images and masks as returned by _prepare)"""
+    coords = np.asarray(coords, dtype=c_int)
+    assert len(coords) == image1.ndim
+    kernel = getattr(_lib(), 'makecomat%dD_2T' % image1.ndim)
+    with profiling.stage('comat.kernel') as st:
+        kernel(image1, mask1, *image1.shape, image2, mask2, *image2.shape, coords, levels1, levels2, out)
+        _count_kernel(st, mask1, 1)
+
+
+def _accumulate_mult(image, mask, coordset, levels, out, separate=False):
+    """Adds the co-occurrence counts of all offsets in coordset to out in a
+    single pass over the image, summed or (separate) one histogram per
+    offset (image and mask as returned by _prepare)"""
+    assert coordset.ndim == 2 and coordset.shape[1] == image.ndim
+    # pad shape and offsets to 4 dimensions for the kernel
+    shape = np.ones(4, dtype=c_int)
+    shape[:image.ndim] = image.shape
+    coords = np.zeros((len(coordset), 4), dtype=c_int)
+    coords[:, :image.ndim] = coordset
+    with profiling.stage('comat.kernel') as st:
+        _lib().makecomat_mult(image, mask, shape, coords, len(coords), levels, int(separate), out)
+        _count_kernel(st, mask, len(coords))
+
+
+def _slab_rows(image, mask, coordset, out, budget):
+    """Number of rows (along the first axis) per slab that keeps the c_int
+    copies of image and mask within the memory budget, None if the whole
+    image can be done at once"""
+    limit = memory.resolve(budget)
+    if limit is None:
+        return None
+    memory.check(out.nbytes, limit, 'The co-occurrence histograms')
+    copies = sum(a.size * np.dtype(c_int).itemsize for a in (image, mask)
+                 if not (a.dtype == c_int and a.flags.c_contiguous))
+    if copies + out.nbytes <= limit:
+        return None
+    # a slab holds image and mask copies plus its anchor mask, and the rows
+    # reached by the offsets on either side
+    rowbytes = 3 * np.dtype(c_int).itemsize * int(np.prod(image.shape[1:]))
+    halo = int(np.max(np.abs(coordset[:, 0])))
+    memory.check(out.nbytes + (2 * halo + 1) * rowbytes, limit, 'A single row slab of the image')
+    return (limit - out.nbytes) // rowbytes - 2 * halo
+
+
+def _accumulate_slabs(image, mask, coordset, levels, out, rows, separate=False):
+    """Adds the co-occurrence counts of all offsets in coordset to out (one
+    histogram per offset if separate), rows of the first axis at a time:
+    each slab is cast with the rows its offsets reach into and only the
+    voxels of the slab proper are used as anchors"""
+    halo = int(np.max(np.abs(coordset[:, 0])))
+    for start in range(0, image.shape[0], rows):
+        stop = min(start + rows, image.shape[0])
+        low, high = max(start - halo, 0), min(stop + halo, image.shape[0])
+        simage = np.ascontiguousarray(image[low:high], dtype=c_int)
+        smask = np.ascontiguousarray(mask[low:high], dtype=c_int)
+        anchors = smask.copy()
+        anchors[:start - low] = 0
+        anchors[stop - low:] = 0
+        for c, coords in enumerate(coordset):
+            _accumulate_2T(simage, anchors, simage, smask, coords, levels, levels, out[c] if separate else out)
 
 
 # "Overload" co-occurence matrix calculators
-def comat_mult(image, mask, coordset, levels=255):
+def comat_mult(image, mask, coordset, levels=255, budget=None):
     """
     Generates and sums co-occurrence histograms of an image given a
     set of offsets.
@@ -156,7 +319,8 @@ def comat_mult(image, mask, coordset, levels=255):
     Parameters
     ----------
         image: 1-4 dimensional ndarray of dtype int
-            Input image.
+            Input image; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask:  1-4 dimensional ndarray of dtype int
             Input mask (same size as image, 0,1 array)
@@ -165,7 +329,9 @@ def comat_mult(image, mask, coordset, levels=255):
 
         coordset : 1D ndarray of coordinate offset sets
             array of coordinate offset arrays with the appropriate
-            number of dimensions (1-4) for building cooccurence matrices.
+            number of dimensions (1-4) for building cooccurence matrices,
+            e.g. a (n_offsets, dims) c_int array such as Template.offarray
+            which is used as is.
 
         levels : int
             The input image should contain integers in [0, levels-1],
@@ -173,6 +339,12 @@ def comat_mult(image, mask, coordset, levels=255):
             grey levels counted (256 for an 8-bit image but any number
             of cluster values for general templated images)
 
+        budget : int
+            Memory budget in bytes (default = the one set with
+            gentex.memory); if the c_int copies of image and mask
+            don't fit the image is done in slabs along its first axis,
+            a MemoryBudgetError is raised if even a single row doesn't
+
     Returns
     -------
         2D ndarray
@@ -182,17 +354,231 @@ def comat_mult(image, mask, coordset, levels=255):
            all offsets passed to comat_mult.
 
     """
-    count = 0
-    for co in coordset:
-        if count == 0:
-            thisco = comat(image, mask, co, levels)
-        else:
-            thisco += comat(image, mask, co, levels)
-        count += 1
-    return thisco
+    image, mask = shared.asarray(image), shared.asarray(mask)
+    coordset = np.ascontiguousarray(coordset, dtype=c_int).reshape(-1, image.ndim)
+    key = diskcache.key('comat_mult', image, mask, coordset, levels)
+    out = diskcache.lookup(key)
+    if out is not None:
+        return out
+    out = np.zeros((levels, levels), dtype=c_int)
+    rows = _slab_rows(image, mask, coordset, out, budget)
+    if rows is not None:
+        _check(image, mask, levels)
+        _accumulate_slabs(image, mask, coordset, levels, out, rows)
+    else:
+        # check and cast image and mask once, then let the kernel
+        # accumulate every offset into the same output in one pass
+        image, mask = _prepare(image, mask, levels)
+        _accumulate_mult(image, mask, coordset, levels, out)
+    diskcache.store(key, out)
+    return out
+
+
+def comat_family(image, mask, coordset, levels=255, budget=None):
+    """
+    Generates the co-occurrence histograms of an image for each offset of
+    a family of offsets, e.g. the Haralick directions at a set of distances
+    of a 'Directions' Template, in a single pass over the image, and their
+    average (the usual rotation invariant co-occurrence matrix).
+
+    Parameters
+    ----------
+        image: 1-4 dimensional ndarray of dtype int
+            Input image; images and masks can also be
+            gentex.shared.SharedArray handles.
+
+        mask:  1-4 dimensional ndarray of dtype int
+            Input mask (same size as image, 0,1 array)
+            Determines which voxels to use for building
+            co-occurence matrix
+
+        coordset : 1D ndarray of coordinate offset sets
+            array of coordinate offset arrays with the appropriate
+            number of dimensions (1-4), e.g. Template.offsets or
+            Template.offarray.
+
+        levels : int
+            The input image should contain integers in [0, levels-1],
+            where levels indicate the number of discrete image or
+            grey levels counted (256 for an 8-bit image but any number
+            of cluster values for general templated images)
 
+        budget : int
+            Memory budget in bytes (default = the one set with
+            gentex.memory); if the c_int copies of image and mask
+            don't fit the image is done in slabs along its first axis,
+            a MemoryBudgetError is raised if even a single row doesn't
 
-def comat(image, mask, coords, levels=255):
+    Returns
+    -------
+        3D ndarray
+           (n_offsets, levels, levels) grey-level co-occurrence histograms,
+           one per offset in the order of coordset.
+
+        2D ndarray
+           The average of the histograms over the offsets (float).
+
+    """
+    image, mask = shared.asarray(image), shared.asarray(mask)
+    coordset = np.ascontiguousarray(coordset, dtype=c_int).reshape(-1, image.ndim)
+    key = diskcache.key('comat_family', image, mask, coordset, levels)
+    out = diskcache.lookup(key)
+    if out is not None:
+        return out, out.mean(axis=0)
+    out = np.zeros((len(coordset), levels, levels), dtype=c_int)
+    rows = _slab_rows(image, mask, coordset, out, budget)
+    if rows is not None:
+        _check(image, mask, levels)
+        _accumulate_slabs(image, mask, coordset, levels, out, rows, separate=True)
+    else:
+        image, mask = _prepare(image, mask, levels)
+        _accumulate_mult(image, mask, coordset, levels, out, separate=True)
+    diskcache.store(key, out)
+    return out, out.mean(axis=0)
+
+
+def comat_rois(image, labels, coordset, levels=255, nlabels=None):
+    """
+    Generates the summed co-occurrence histograms of several regions of an
+    image in a single pass, i.e. the same as comat_mult(image, labels == l,
+    coordset, levels) for each region l.
+
+    Parameters
+    ----------
+        image: 1-4 dimensional ndarray of dtype int
+            Input image; image and labels can also be
+            gentex.shared.SharedArray handles.
+
+        labels:  1-4 dimensional ndarray of dtype int
+            Region of each voxel (same size as image), 1 to nlabels;
+            voxels with other values are left out
+
+        coordset : 1D ndarray of coordinate offset sets
+            array of coordinate offset arrays with the appropriate
+            number of dimensions (1-4), e.g. Template.offsets or
+            Template.offarray.
+
+        levels : int
+            The input image should contain integers in [0, levels-1]
+
+        nlabels : int
+            Number of regions (default = largest label)
+
+    Returns
+    -------
+        3D ndarray
+           nlabels x levels x levels array, the co-occurrence histogram
+           of region l being at index l - 1
+
+    """
+    image, labels = shared.asarray(image), shared.asarray(labels)
+    image, labels = _prepare(image, labels, levels, labels=True)
+    if nlabels is None:
+        nlabels = max(int(labels.max()), 0) if labels.size else 0
+    coordset = np.ascontiguousarray(coordset, dtype=c_int).reshape(-1, image.ndim)
+    out = np.zeros((nlabels, levels, levels), dtype=c_int)
+    # pad shape and offsets to 4 dimensions for the kernel
+    shape = np.ones(4, dtype=c_int)
+    shape[:image.ndim] = image.shape
+    coords = np.zeros((len(coordset), 4), dtype=c_int)
+    coords[:, :image.ndim] = coordset
+    with profiling.stage('comat.kernel') as st:
+        _lib().makecomat_labels(image, labels, shape, coords, len(coords), levels, nlabels, out)
+        if st:
+            voxels = int(np.count_nonzero(labels))
+            st.count(voxels=voxels, masked=labels.size - voxels, offsets=len(coords))
+    return out
+
+
+def comat_measure_map(image, mask, coordset, window=None, levels=255, measures=None, anchors=None,
+                      coordmom=0, probmom=0):
+    """
+    Generates voxel-wise texture measure maps without building a
+    co-occurrence matrix per voxel: the co-occurrences around each anchor
+    voxel are counted into a scratch histogram and reduced to the
+    requested measures in the same (native) pass.
+
+    Parameters
+    ----------
+        image: 1-4 dimensional ndarray of dtype int
+            Input image; images and masks can also be
+            gentex.shared.SharedArray handles.
+
+        mask:  1-4 dimensional ndarray of dtype int
+            Input mask (same size as image, 0,1 array)
+            Determines which voxels to use for building
+            the co-occurrences
+
+        coordset : 1D ndarray of coordinate offset sets
+            array of coordinate offset arrays with the appropriate
+            number of dimensions (1-4), e.g. Template.offsets or
+            Template.offarray.
+
+        window : 1D ndarray of coordinate offset sets
+            Offsets of the voxels around each anchor whose co-occurrences
+            are counted, e.g. the offsets of a RectBox Template plus the
+            anchor (default = the anchor only, i.e. the co-occurrences of
+            the anchor with the voxels at the coordset offsets)
+
+        levels : int
+            The input image should contain integers in [0, levels-1]
+
+        measures : list of strings
+            Any of the keys of MAP_MEASURES (Texmeas names, default = ['CM Entropy'])
+
+        anchors : 1-4 dimensional ndarray of dtype int
+            Voxels (0,1 array) for which measures are computed (default = mask)
+
+        coordmom, probmom : float
+            Moments for 'Contrast' and 'Inverse Difference Moment' (see Texmeas);
+            they're only summed over the non zero co-occurrences
+
+    Returns
+    -------
+        dict
+           measure name -> float map of the image shape, nan outside anchors
+           and where there were no co-occurrences
+
+    """
+    image, mask = shared.asarray(image), shared.asarray(mask)
+    anchors = shared.asarray(anchors)
+    measures = ['CM Entropy'] if measures is None else list(measures)
+    image, mask = _prepare(image, mask, levels)
+    anchors = mask if anchors is None else np.ascontiguousarray(anchors, dtype=c_int)
+    assert anchors.shape == image.shape
+    for meas in measures:
+        assert meas in MAP_MEASURES, "Sorry don't know about texture measure map " + meas
+        if meas in ['Contrast', 'Inverse Difference Moment']:
+            assert coordmom != 0 and probmom != 0, \
+                "Nonzero coordinate and probability moments are required for calculating " + meas
+    coordset = np.asarray(coordset, dtype=c_int).reshape(-1, image.ndim)
+    window = np.zeros((1, image.ndim), dtype=c_int) if window is None else \
+        np.asarray(window, dtype=c_int).reshape(-1, image.ndim)
+    assert window.size > 0 and coordset.size > 0
+
+    # pad shape and offsets to 4 dimensions for the kernel
+    shape = np.ones(4, dtype=c_int)
+    shape[:image.ndim] = image.shape
+    coords = np.zeros((len(coordset), 4), dtype=c_int)
+    coords[:, :image.ndim] = coordset
+    wins = np.zeros((len(window), 4), dtype=c_int)
+    wins[:, :image.ndim] = window
+
+    codes = np.array([MAP_MEASURES[meas] for meas in measures], dtype=c_int)
+    out = np.full((len(measures),) + image.shape, np.nan)
+    scratch = np.zeros(levels * levels, dtype=c_int)
+    touched = np.zeros(min(len(wins) * len(coords), levels * levels), dtype=c_int)
+    with profiling.stage('comat.measure_map') as st:
+        _lib().comat_measure_map(image, mask, anchors, shape, wins, len(wins), coords, len(coords), levels,
+                                 codes, len(codes), coordmom, probmom, scratch, touched, out)
+        if st:
+            nanchors = int(np.count_nonzero(anchors == 1))
+            st.count(voxels=nanchors, masked=anchors.size - nanchors, offsets=len(wins) * len(coords),
+                     bytes=out.nbytes + scratch.nbytes + touched.nbytes)
+    return dict(zip(measures, out))
+
+
+def comat(image, mask, coords, levels=255, budget=None):
     """
     Calculates the co-occurrence histogram of an image given an offset.
 
@@ -200,7 +586,8 @@ def comat(image, mask, coords, levels=255):
     ----------
 
         image: 1-4 dimensional ndarray of dtype int
-            Input image.
+            Input image; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask:  1-4 dimensional ndarray of dtype int
             Input mask (same size as image, 0,1 array)
@@ -217,6 +604,12 @@ def comat(image, mask, coords, levels=255):
             grey levels counted (256 for an 8-bit image but any number
             of cluster values for general templated images)
 
+        budget : int
+            Memory budget in bytes (default = the one set with
+            gentex.memory); if the c_int copies of image and mask
+            don't fit the image is done in slabs along its first axis,
+            a MemoryBudgetError is raised if even a single row doesn't
+
     Returns
     -------
         2D ndarray
@@ -225,67 +618,22 @@ def comat(image, mask, coords, levels=255):
            occurs at offset coords from gray-level i.
 
     """
-    dims = len(image.shape)
+    image, mask = shared.asarray(image), shared.asarray(mask)
+    coordset = np.asarray(coords, dtype=c_int).reshape(1, -1)
+    # same counts as comat_mult with the one offset
+    key = diskcache.key('comat_mult', image, mask, coordset, levels)
+    out = diskcache.lookup(key)
+    if out is not None:
+        return out
     out = np.zeros((levels, levels), dtype=c_int)
-
-    if dims == 1:
-        assert image.ndim == 1
-        assert image.min() >= 0
-        assert image.max() < levels
-        assert mask.ndim == 1
-        image = image.astype(c_int)
-        mask = mask.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 1
-        _comat.makecomat1D(image, mask,
-                           image.shape[0],
-                           coords,
-                           levels, out)
-    if dims == 2:
-        assert image.ndim == 2
-        assert image.min() >= 0
-        assert image.max() < levels
-        assert mask.ndim == 2
-        image = image.astype(c_int)
-        mask = mask.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 2
-        _comat.makecomat2D(image, mask,
-                           image.shape[0],
-                           image.shape[1],
-                           coords,
-                           levels, out)
-    if dims == 3:
-        assert image.ndim == 3
-        assert image.min() >= 0
-        assert image.max() < levels
-        assert mask.ndim == 3
-        image = image.astype(c_int)
-        mask = mask.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 3
-        _comat.makecomat3D(image, mask,
-                           image.shape[0],
-                           image.shape[1],
-                           image.shape[2],
-                           coords,
-                           levels, out)
-    if dims == 4:
-        assert image.ndim == 4
-        assert image.min() >= 0
-        assert image.max() < levels
-        assert mask.ndim == 4
-        image = image.astype(c_int)
-        mask = mask.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 4
-        _comat.makecomat4D(image, mask,
-                           image.shape[0],
-                           image.shape[1],
-                           image.shape[2],
-                           image.shape[3],
-                           coords,
-                           levels, out)
+    rows = _slab_rows(image, mask, coordset, out, budget)
+    if rows is not None:
+        _check(image, mask, levels)
+        _accumulate_slabs(image, mask, coordset, levels, out, rows)
+    else:
+        image, mask = _prepare(image, mask, levels)
+        _accumulate(image, mask, coords, levels, out)
+    diskcache.store(key, out)
     return out
 
 
@@ -298,7 +646,8 @@ def comat_2T_mult(image1, mask1, image2, mask2, coordset, levels1=255, levels2=2
     Parameters
     ----------
         image1: 1-4 dimensional ndarray of dtype int
-            Input image 1.
+            Input image 1; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask1:  1-4 dimensional ndarray of dtype int
             Input mask 1 (same size as image, 0,1 array)
@@ -306,7 +655,8 @@ def comat_2T_mult(image1, mask1, image2, mask2, coordset, levels1=255, levels2=2
             co-occurence matrix
 
         image2: 1-4 dimensional ndarray of dtype int
-            Input image 2.
+            Input image 2; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask2:  1-4 dimensional ndarray of dtype int
             Input mask 2 (same size as image, 0,1 array)
@@ -331,14 +681,16 @@ def comat_2T_mult(image1, mask1, image2, mask2, coordset, levels1=255, levels2=2
            occurs at offset coords from gray-level i.
 
     """
-    count = 0
+    image1, mask1 = shared.asarray(image1), shared.asarray(mask1)
+    image2, mask2 = shared.asarray(image2), shared.asarray(mask2)
+    image1, mask1 = _prepare(image1, mask1, levels1)
+    image2, mask2 = _prepare(image2, mask2, levels2)
+    assert image1.ndim == image2.ndim
+    coordset = np.ascontiguousarray(coordset, dtype=c_int)
+    out = np.zeros((levels1, levels2), dtype=c_int)
     for co in coordset:
-        if count == 0:
-            thisco = comat_2T(image1, mask1, image2, mask2, co, levels1, levels2)
-        else:
-            thisco += comat_2T(image1, mask1, image2, mask2, co, levels1, levels2)
-        count += 1
-    return thisco
+        _accumulate_2T(image1, mask1, image2, mask2, co, levels1, levels2, out)
+    return out
 
 
 def comat_2T(image1, mask1, image2, mask2, coords, levels1=255, levels2=255):
@@ -348,7 +700,8 @@ def comat_2T(image1, mask1, image2, mask2, coords, levels1=255, levels2=255):
     Parameters
     ----------
         image1: 1-4 dimensional ndarray of dtype int
-            Input image 1.
+            Input image 1; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask1:  1-4 dimensional ndarray of dtype int
             Input mask 1 (same size as image, 0,1 array)
@@ -356,7 +709,8 @@ def comat_2T(image1, mask1, image2, mask2, coords, levels1=255, levels2=255):
             co-occurence matrix
 
         image2: 1-4 dimensional ndarray of dtype int
-            Input image 2.
+            Input image 2; images and masks can also be
+            gentex.shared.SharedArray handles.
 
         mask2:  1-4 dimensional ndarray of dtype int
             Input mask 2 (same size as image, 0,1 array)
@@ -381,109 +735,97 @@ def comat_2T(image1, mask1, image2, mask2, coords, levels1=255, levels2=255):
            occurs at offset coords from gray-level i.
 
     """
-    dims = len(image1.shape)
+    image1, mask1 = shared.asarray(image1), shared.asarray(mask1)
+    image2, mask2 = shared.asarray(image2), shared.asarray(mask2)
+    image1, mask1 = _prepare(image1, mask1, levels1)
+    image2, mask2 = _prepare(image2, mask2, levels2)
+    assert image1.ndim == image2.ndim
     out = np.zeros((levels1, levels2), dtype=c_int)
-    if dims == 1:
-        assert image1.ndim == 1
-        assert image1.min() >= 0
-        assert image1.max() < levels1
-        assert mask1.ndim == 1
-        assert image2.ndim == 1
-        assert image2.min() >= 0
-        assert image2.max() < levels2
-        assert mask2.ndim == 1
-        image1 = image1.astype(c_int)
-        mask1 = mask1.astype(c_int)
-        image2 = image2.astype(c_int)
-        mask2 = mask2.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 1
-        _comat.makecomat1D_2T(image1, mask1,
-                              image1.shape[0],
-                              image2, mask2,
-                              image2.shape[0],
-                              coords,
-                              levels1, levels2,
-                              out)
-    if dims == 2:
-        assert image1.ndim == 2
-        assert image1.min() >= 0
-        assert image1.max() < levels1
-        assert mask1.ndim == 2
-        assert image2.ndim == 2
-        assert image2.min() >= 0
-        assert image2.max() < levels2
-        assert mask2.ndim == 2
-        image1 = image1.astype(c_int)
-        mask1 = mask1.astype(c_int)
-        image2 = image2.astype(c_int)
-        mask2 = mask2.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 2
-        _comat.makecomat2D_2T(image1, mask1,
-                              image1.shape[0],
-                              image1.shape[1],
-                              image2, mask2,
-                              image2.shape[0],
-                              image2.shape[1],
-                              coords,
-                              levels1, levels2,
-                              out)
-    if dims == 3:
-        assert image1.ndim == 3
-        assert image1.min() >= 0
-        assert image1.max() < levels1
-        assert mask1.ndim == 3
-        assert image2.ndim == 3
-        assert image2.min() >= 0
-        assert image2.max() < levels2
-        assert mask2.ndim == 3
-        image1 = image1.astype(c_int)
-        mask1 = mask1.astype(c_int)
-        image2 = image2.astype(c_int)
-        mask2 = mask2.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 3
-        _comat.makecomat3D_2T(image1, mask1,
-                              image1.shape[0],
-                              image1.shape[1],
-                              image1.shape[2],
-                              image2, mask2,
-                              image2.shape[0],
-                              image2.shape[1],
-                              image2.shape[2],
-                              coords,
-                              levels1, levels2,
-                              out)
-    if dims == 4:
-        assert image1.ndim == 4
-        assert image1.min() >= 0
-        assert image1.max() < levels1
-        assert mask1.ndim == 4
-        assert image2.ndim == 4
-        assert image2.min() >= 0
-        assert image2.max() < levels2
-        assert mask2.ndim == 4
-        image1 = image1.astype(c_int)
-        mask1 = mask1.astype(c_int)
-        image2 = image2.astype(c_int)
-        mask2 = mask2.astype(c_int)
-        coords = np.asarray(coords, dtype=c_int)
-        assert len(coords) == 4
-        _comat.makecomat4D_2T(image1, mask1,
-                              image1.shape[0],
-                              image1.shape[1],
-                              image1.shape[2],
-                              image1.shape[3],
-                              image2, mask2,
-                              image2.shape[0],
-                              image2.shape[1],
-                              image2.shape[2],
-                              image2.shape[3],
-                              coords,
-                              levels1, levels2,
-                              out)
+    _accumulate_2T(image1, mask1, image2, mask2, coords, levels1, levels2, out)
+    return out
+
+
+def comat_cross(images, masks, coordset, levels=255, asdict=False):
+    """
+    Generates the summed cross co-occurrence histograms of every ordered
+    pair of N co-registered images (self pairs included) in a single pass
+    over the voxels, i.e. all the comat_2T_mult(images[a], masks[a],
+    images[b], masks[b], coordset) at once, the self pairs being
+    comat_mult(images[a], masks[a], coordset).
 
+    Parameters
+    ----------
+        images: list of N 1-4 dimensional ndarrays of dtype int
+            Input images, all the same shape; images and masks can also
+            be gentex.shared.SharedArray handles.
+
+        masks:  list of N 1-4 dimensional ndarrays of dtype int, or one
+            Input masks (0,1 arrays), one per image or one used for all
+            of them. Anchors are taken where the first image's mask is 1
+            and neighbours where the second image's is.
+
+        coordset : 1D ndarray of coordinate offset sets
+            array of coordinate offset arrays with the appropriate
+            number of dimensions (1-4), e.g. Template.offsets or
+            Template.offarray.
+
+        levels : int or list of N ints
+            Number of discrete levels of the images (one for all of them
+            or one per image)
+
+        asdict : bool
+            Whether to return a dict keyed by pair (default = False)
+
+    Returns
+    -------
+        4D ndarray or dict
+           N x N x L x L array, L being the largest number of levels, whose
+           [a, b, i, j] entry is the number of times level j of image b
+           occurs at an offset from level i of image a; or (asdict) a dict
+           (a, b) -> levels[a] x levels[b] histogram.
+
+    """
+    images = [shared.asarray(im) for im in images]
+    if isinstance(masks, (list, tuple)):
+        masks = [shared.asarray(mask) for mask in masks]
+        assert len(masks) == len(images)
+    else:
+        masks = [shared.asarray(masks)]
+    nimages = len(images)
+    levlist = list(levels) if np.ndim(levels) else [levels] * nimages
+    assert len(levlist) == nimages
+    for im, lev in zip(images, levlist):
+        assert im.shape == images[0].shape
+        _check(im, masks[0], lev)
+    for mask in masks:
+        assert mask.shape == images[0].shape
+    nlev = max(levlist)
+
+    with profiling.stage('comat.prepare') as st:
+        # cast the images (and masks) once, into one array each
+        inputs = np.empty((nimages,) + images[0].shape, dtype=c_int)
+        for a, im in enumerate(images):
+            inputs[a] = im
+        cmasks = np.empty((len(masks),) + images[0].shape, dtype=c_int)
+        for a, mask in enumerate(masks):
+            cmasks[a] = mask
+        if st:
+            st.count(voxels=inputs[0].size, bytes=inputs.nbytes + cmasks.nbytes)
+
+    ndim = images[0].ndim
+    coordset = np.ascontiguousarray(coordset, dtype=c_int).reshape(-1, ndim)
+    out = np.zeros((nimages, nimages, nlev, nlev), dtype=c_int)
+    # pad shape and offsets to 4 dimensions for the kernel
+    shape = np.ones(4, dtype=c_int)
+    shape[:ndim] = images[0].shape
+    coords = np.zeros((len(coordset), 4), dtype=c_int)
+    coords[:, :ndim] = coordset
+    anchor = np.zeros(nimages, dtype=c_int)
+    with profiling.stage('comat.kernel') as st:
+        _lib().makecomat_cross(inputs, cmasks, nimages, len(masks), shape, coords, len(coords), nlev, anchor, out)
+        _count_kernel(st, cmasks[0], len(coords))
+    if asdict:
+        return {(a, b): out[a, b, :levlist[a], :levlist[b]] for a in range(nimages) for b in range(nimages)}
     return out
 
 
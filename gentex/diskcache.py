@@ -0,0 +1,213 @@
+"""  gentex.diskcache package
+
+Optional persistent cache of co-occurrence matrices and feature spaces
+
+Parameter sweeps and repeated runs over the same data recompute the same
+comat_mult / comat_family results and Features spaces. Once enabled, those
+are looked up in a local directory, keyed by a hash of everything they
+depend on (image and mask bytes, dtypes and shapes, offsets, levels, and
+for Features the template, dtype and memory budget), and stored there as
+.npy / .npz files after being computed. The least recently used files are
+removed when the directory grows over maxsize bytes.
+
+    gentex.diskcache.enable('~/.cache/gentex', maxsize=2**30)
+    cm = gentex.comat.comat_mult(image, mask, offsets, levels=8)  # computed
+    cm = gentex.comat.comat_mult(image, mask, offsets, levels=8)  # read back
+
+Several processes can share a cache directory: files are written to a
+temporary name and moved into place.
+
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# bumped whenever the cached results change, so old entries are never used
+_VERSION = 1
+
+# cache in use (None = caching off)
+_cache = None
+
+
+def _unlink(f):
+    """Removes file f if it's still there (another process may have)"""
+    try:
+        f.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class DiskCache:
+    """Class disk cache: directory of .npy / .npz files with size based LRU eviction
+
+    Parameters
+    ----------
+
+    path: string
+        Cache directory (created if needed)
+
+    maxsize: int
+        Largest total size in bytes of the cached files (default = 1 GiB)
+
+    Attributes
+    ----------
+
+    hits, misses: int
+        Lookups answered from / missing in the cache
+    """
+
+    def __init__(self, path, maxsize=2**30):
+        assert maxsize > 0
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # bytes on disk, found on the first put
+        self._lock = threading.Lock()
+
+    def _file(self, key, ext):
+        return self.path / key[:2] / (key + ext)
+
+    def _files(self):
+        """(last use, size, path) of the cached files"""
+        entries = []
+        for sub in self.path.iterdir():
+            if sub.is_dir():
+                for f in sub.iterdir():
+                    if f.suffix in ('.npy', '.npz'):
+                        try:
+                            st = f.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, f))
+        return entries
+
+    def get(self, key):
+        """Cached ndarray (or dict of ndarrays) for key, None if there's none"""
+        for ext in ('.npy', '.npz'):
+            f = self._file(key, ext)
+            try:
+                if ext == '.npy':
+                    val = np.load(f)
+                else:
+                    with np.load(f) as data:
+                        val = {name: data[name] for name in data.files}
+                # the modification time keeps track of the last use
+                os.utime(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, EOFError):
+                # unreadable entry, drop it
+                _unlink(f)
+                continue
+            self.hits += 1
+            return val
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Stores an ndarray (as .npy) or a dict of ndarrays (as .npz) under key"""
+        isdict = isinstance(value, dict)
+        nbytes = sum(np.asarray(v).nbytes for v in value.values()) if isdict else value.nbytes
+        if nbytes > self.maxsize:
+            return
+        f = self._file(key, '.npz' if isdict else '.npy')
+        f.parent.mkdir(exist_ok=True)
+        tmp = f.with_name('%s.%d.%d.tmp' % (f.name, os.getpid(), threading.get_ident()))
+        with open(tmp, 'wb') as fh:
+            if isdict:
+                np.savez(fh, **value)
+            else:
+                np.save(fh, value)
+        size = tmp.stat().st_size
+        with self._lock:
+            # a rewritten entry replaces the old file's bytes
+            try:
+                size -= f.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, f)
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._files())
+            else:
+                self._size += size
+            if self._size > self.maxsize:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used files until the cache fits in maxsize"""
+        entries = sorted(self._files())
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, f in entries:
+            if total <= self.maxsize:
+                break
+            _unlink(f)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """Removes every cached file"""
+        with self._lock:
+            for mtime, size, f in self._files():
+                _unlink(f)
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Dict with the cache directory, number of files, size, maxsize, hits and misses"""
+        entries = self._files()
+        return {'path': str(self.path), 'files': len(entries), 'size': sum(entry[1] for entry in entries),
+                'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+def enable(path='~/.cache/gentex', maxsize=2**30):
+    """Turns caching on with the cache directory path, returns the DiskCache"""
+    global _cache
+    _cache = DiskCache(path, maxsize)
+    return _cache
+
+
+def disable():
+    """Turns caching off (the cached files are kept)"""
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """DiskCache in use, None if caching is off"""
+    return _cache
+
+
+def key(*parts):
+    """Cache key of parts (arrays and anything with a stable repr), None
+    if caching is off so that callers don't pay for hashing"""
+    if _cache is None:
+        return None
+    h = hashlib.blake2b(repr(_VERSION).encode(), digest_size=20)
+    for part in parts:
+        if isinstance(part, (np.ndarray, list, tuple)):
+            arr = np.ascontiguousarray(part)
+            h.update(repr((arr.dtype.str, arr.shape)).encode())
+            h.update(arr.data)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def lookup(key):
+    """Cached result for key (from key()), None on a miss or if caching is off"""
+    if key is None or _cache is None:
+        return None
+    return _cache.get(key)
+
+
+def store(key, value):
+    """Caches value under key (from key()) if caching is on"""
+    if key is not None and _cache is not None:
+        _cache.put(key, value)
@@ -5,8 +5,16 @@
 # to handle the possibility of being handed a variable number
 # of images and the mask to build the feature space with, using cytypes
 
+import warnings
+
 import numpy as np
 
+from . import diskcache, memory, profiling, shared
+
+
+# Voxels of the parse region handled at a time when finding the anchors
+_ANCHOR_BLOCK = 2**16
+
 
 class Features:
     """
@@ -15,11 +23,15 @@ class Features:
     Class Methods
     --------------
 
-    __init__(images,mask,template)
+    __init__(images,mask,template,dtype,budget,share)
 
     
     clusfs(method,numclus,clusmax)
 
+    fscoords()
+
+    fsvalues(rows)
+
     Class Variables
     ----------------
 
@@ -34,6 +46,27 @@ class Features:
     template: set of points relative to an anchor point
               used to build feature space
 
+    Optional constructor argument:
+
+    dtype:    storage type of the feature space, one of float32 (default),
+              float64, float16 or the quantized types uint8 and uint16.
+              For the quantized types each image is mapped linearly onto
+              the integer range (see fsscale, fsoffset); integer images
+              whose masked range fits are stored losslessly
+
+    budget:   memory budget in bytes (default = the one set with
+              gentex.memory). If the feature space and its temporaries
+              don't fit with dtype, the next smaller of float32, float16,
+              uint16 and uint8 that does is used instead (with a
+              UserWarning, the smaller types are lossy); a
+              MemoryBudgetError is raised if none does
+
+    share:    whether to build the feature space in shared memory
+              (default False), see fshandle
+
+    images and mask can also be gentex.shared.SharedArray handles; with
+    gentex.diskcache enabled feature spaces are read back from the cache
+
     Internal class variables:
 
     fs:       P x F ndarray constituing feature space. P is the number
@@ -42,11 +75,20 @@ class Features:
               point. F is the number of features (i.e. number of template
               points times number of images)
 
-    fsc:      P X D ndarray constituing array of coordinates associated with
-              the points in feature space where as for fs, P is the number
-              of points in the image(s) such that the template fell
-              within the mask, and D is the underlying dimension of the
-              image space.
+    fshandle: gentex.shared.SharedArray handle of fs when built with
+              share=True, for passing it to worker processes (call its
+              unlink() once done)
+
+    fsc:      P ndarray of flat (C order) indices into the image of the
+              anchor points associated with the points in feature space
+              where as for fs, P is the number of points in the image(s)
+              such that the template fell within the mask. Stored as int32
+              (int64 for images with more than 2**31 - 1 voxels); use
+              fscoords() to get the D coordinate arrays, D being the
+              underlying dimension of the image space.
+
+    fsscale,  length F arrays such that fs * fsscale + fsoffset gives the
+    fsoffset  feature values in image units (see fsvalues())
 
     fsmask    Image mask with 1's where the template coordinates were
               inside the image and mask (i.e. image coordinates for which
@@ -81,13 +123,19 @@ class Features:
     
     """
 
-    def __init__(self, images, mask, template):
+    @profiling.profiled('features.build')
+    def __init__(self, images, mask, template, dtype=np.float32, budget=None, share=False):
 
+        images = [shared.asarray(im) for im in images]
         self.images = images
-        self.mask = mask
+        self.mask = shared.asarray(mask)
         self.template = template
-        self.fs = np.array([], dtype=np.float32)
-        self.fsc = np.array([], dtype=np.int16)
+        self.dtype = np.dtype(dtype)
+        self.fs = np.array([], dtype=self.dtype)
+        self.fshandle = None
+        self.fsc = np.array([], dtype=np.int32)
+        self.fsscale = np.ones(0, dtype=np.float64)
+        self.fsoffset = np.zeros(0, dtype=np.float64)
         self.fsmask = np.zeros(self.images[0].shape, dtype=np.int16)
         self.foundfeat = 0
         self.clusim = np.zeros(self.images[0].shape, dtype=np.int16)
@@ -95,8 +143,7 @@ class Features:
         self.cluscrit = 'BIC'
         self.clusmax = 20
 
-        # Need to do conversion to numpy.int16 here (and back later)
-        # to squeeze as much memory as we can for big images
+        assert self.dtype in (np.float64, np.float32, np.float16, np.uint8, np.uint16)
 
         # Make sure images and mask have same dimension
         self.dims = images[0].shape
@@ -107,6 +154,14 @@ class Features:
         # Determine number of features
         self.numfeats = len(template) * len(images)
 
+        # Feature spaces built before (see gentex.diskcache)
+        key = diskcache.key('Features', *images, self.mask, np.asarray(template), self.dtype.str,
+                            memory.resolve(budget))
+        cached = diskcache.lookup(key)
+        if cached is not None:
+            self._restore(cached, share)
+            return
+
         # Get upper and lower bounds in image to grab
         # by getting max and min values from template
         # points
@@ -117,56 +172,177 @@ class Features:
         # for negative offsets need to move away from lower boundary
         # otherwise can start at zero
         lowlim = np.where(np.greater(-mins, 0), -mins, 0)
-        # Get feature space co-ordinate array, fsc;
-        # already determined by image parsing limits uplim,lowlim
-        ind = np.indices(uplim - lowlim)
 
-        self.fsc = np.array([np.ravel(ind[i] + lowlim[i]) for i in range(len(lowlim))], dtype=np.int16)
+        # Thanks to Robert Kern for the following bit of index magic
+        def window(temp):
+            return tuple([slice(down, up) for down, up in zip(lowlim + temp, uplim + temp)])
+
+        # An anchor point generates a feature space point only if every
+        # template point falls inside the mask - build that as a boolean
+        # map over the parsed region rather than np.inf filled copies of
+        # the images
+        limit = memory.resolve(budget)
+        region = tuple(int(n) for n in np.maximum(uplim - lowlim, 0))
+        memory.check(int(np.prod(self.dims)) + int(np.prod(region)), limit, 'The feature space mask')
+        inmask = self.mask == 1
+        valid = np.ones(region, dtype=bool)
+        for temp in template:
+            valid &= inmask[window(temp)]
+        del inmask
+        self.fsc = self._anchors(valid, lowlim, limit)
+        self.dtype = self._fit_dtype(valid, limit)
+
         # Now get feature space columns, i.e. each column is
-        # a combination of image + template element
+        # a combination of image + template element, written straight
+        # into the (compact) feature space array
         # This is REALLY parallelizable - i.e. each column can be done
         # independently
-        imcount = 0
+        if share:
+            self.fshandle = shared.empty((self.fsc.size, self.numfeats), self.dtype)
+            self.fs = self.fshandle.asarray()
+        else:
+            self.fs = np.empty((self.fsc.size, self.numfeats), dtype=self.dtype)
+        self.fsscale = np.ones(self.numfeats, dtype=np.float64)
+        self.fsoffset = np.zeros(self.numfeats, dtype=np.float64)
         colcount = 0
-        for im in images:  #
+        for im in images:
+            scale, offset = self._quantization(im)
             for temp in template:  # template points
-                upl = uplim + temp
-                downl = lowlim + temp
-                # Thanks to Robert Kern for the following bit of index magic
-                thiscol = np.ravel(
-                    (np.where(self.mask == 1, im, np.inf))[tuple([slice(down, up) for down, up in zip(downl, upl)])])
-                # Do some gymnastics for shortening feature space vectors
-                # as you go re. memory efficiency
-                if colcount == 0:
-                    badelts = np.array(np.where(thiscol == np.inf)[0])
-                    # oops !
-                    # self.fs = np.array(np.delete(thiscol,badelts,0),dtype=np.int16)
-                    self.fs = np.array(np.delete(thiscol, badelts, 0), dtype=np.float32)
-                else:
-                    badnew = np.array(np.where(thiscol == np.inf)[0])
-                    newstack = np.array(np.delete(thiscol, badelts, 0), dtype=np.float32)
-                    shortnew = np.where(newstack == np.inf)[0]
-                    badelts = np.array(np.unique(np.append(badelts, badnew)))
-                    if colcount == 1:
-                        if newstack.size != 0:
-                            self.fs = np.vstack((np.delete(self.fs, shortnew, 0), np.delete(newstack, shortnew, 0)))
-                    else:
-                        if newstack.size != 0:
-                            self.fs = np.vstack((np.delete(self.fs, shortnew, 1), np.delete(newstack, shortnew, 0)))
+                thiscol = im[window(temp)][valid]
+                if self.dtype.kind == 'u':
+                    thiscol = np.clip(np.rint((thiscol - offset) / scale), 0, np.iinfo(self.dtype).max)
+                self.fs[:, colcount] = thiscol
+                self.fsscale[colcount] = scale
+                self.fsoffset[colcount] = offset
                 colcount += 1
-            del (im)
-            imcount += 1
-        self.fs = np.transpose(self.fs)
-        # Delete bad elements from coordinate space
-        self.fsc = np.array(np.delete(self.fsc, badelts, 1), dtype=np.int16)
-        self.fsc = tuple(self.fsc)
-        self.fsmask[self.fsc] = 1
+        np.put(self.fsmask, self.fsc, 1)
+        diskcache.store(key, {'fs': self.fs, 'fsc': self.fsc, 'fsscale': self.fsscale, 'fsoffset': self.fsoffset})
+        profiling.count(voxels=self.fsc.size, masked=int(np.prod(self.dims)) - self.fsc.size, offsets=len(template),
+                        bytes=self.fs.nbytes + self.fsc.nbytes)
         # NOTE: The above could easily be generalized to handle
         # different templates in the different images.
         # The feature space would be more complicated, i.e. would have
         # to AND different masks but what the heck...
 
+    def _restore(self, cached, share):
+        """Sets the feature space from a diskcache entry"""
+        self.dtype = cached['fs'].dtype
+        if share:
+            self.fshandle = shared.share(cached['fs'])
+            self.fs = self.fshandle.asarray()
+        else:
+            self.fs = cached['fs']
+        self.fsc = cached['fsc']
+        self.fsscale = cached['fsscale']
+        self.fsoffset = cached['fsoffset']
+        np.put(self.fsmask, self.fsc, 1)
+
+    def _anchors(self, valid, lowlim, limit):
+        """Flat (C order) image indices of the anchor points, i.e. of the
+        True voxels of valid (the parse region starting at lowlim), found
+        a block of rows at a time so that the index arrays stay small"""
+        # int16 coordinates overflow on long axes
+        if np.prod(self.dims, dtype=np.int64) <= np.iinfo(np.int32).max:
+            idxtype = np.int32
+        else:
+            idxtype = np.int64
+        npts = int(np.count_nonzero(valid))
+        strides = [int(np.prod(self.dims[d + 1:], dtype=np.int64)) for d in range(len(self.dims))]
+        rowsize = max(int(np.prod(valid.shape[1:])), 1)
+        # (at least one, the parse region is empty when the template is larger than the image)
+        rows = max(min(_ANCHOR_BLOCK // rowsize, valid.shape[0] if valid.ndim else 1), 1)
+        # np.nonzero coordinates (int64) of a block and the indices summed from them
+        block = (len(self.dims) + 2) * 8 * rows * rowsize
+        memory.check(valid.nbytes + npts * np.dtype(idxtype).itemsize + block, limit, 'The feature space anchors')
+        fsc = np.empty(npts, dtype=idxtype)
+        pos = 0
+        for start in range(0, valid.shape[0] if valid.ndim else 0, rows):
+            coords = np.nonzero(valid[start:start + rows])
+            idx = (coords[0] + (start + int(lowlim[0]))) * strides[0]
+            for d in range(1, len(coords)):
+                idx += (coords[d] + int(lowlim[d])) * strides[d]
+            fsc[pos:pos + idx.size] = idx
+            pos += idx.size
+        return fsc
+
+    def _fit_dtype(self, valid, limit):
+        """Storage type for the feature space within the memory budget
+        limit: dtype if its peak fits, otherwise the next smaller type"""
+        if limit is None:
+            return self.dtype
+        npts = self.fsc.size
+        itemsize = max(np.asarray(im).itemsize for im in self.images)
+        need = {}
+        for dtype in [self.dtype] + [np.dtype(t) for t in (np.float32, np.float16, np.uint16, np.uint8)]:
+            if dtype.itemsize > self.dtype.itemsize or dtype in need:
+                continue
+            # feature space and anchors, the parse map and one column
+            # (quantizing works on a float64 copy of it and its result)
+            column = npts * (itemsize + (2 * 8 if dtype.kind == 'u' else 0))
+            need[dtype] = npts * self.numfeats * dtype.itemsize + self.fsc.nbytes + valid.nbytes + column
+            if need[dtype] <= limit:
+                if dtype != self.dtype:
+                    warnings.warn("The feature space doesn't fit in the memory budget as %s, it is stored "
+                                  "as %s instead (lossy)" % (self.dtype, dtype))
+                return dtype
+        memory.check(min(need.values()), limit, 'The feature space')
+
+    def _quantization(self, im):
+        """Scale and offset mapping image values onto the integer feature
+        space dtype, i.e. value = fs * scale + offset (1 and 0 for float
+        dtypes and for integer images whose masked range already fits)"""
+        if self.dtype.kind != 'u':
+            return 1.0, 0.0
+        vals = im[self.mask == 1]
+        if vals.size == 0:
+            return 1.0, 0.0
+        lo = float(vals.min())
+        span = float(vals.max()) - lo
+        qmax = np.iinfo(self.dtype).max
+        if span == 0.0 or (np.issubdtype(vals.dtype, np.integer) and span <= qmax):
+            return 1.0, lo
+        return span / qmax, lo
+
+    def fsvalues(self, rows=slice(None)):
+        """
+        method fsvalues - feature space in image units
 
+        Undoes the quantization of a compact (uint8/uint16) feature
+        space, i.e. returns fs * fsscale + fsoffset as float32 for the
+        requested rows (default all rows). For float dtypes this is just
+        a float32 view/copy of fs.
+        """
+        vals = np.asarray(self.fs[rows], dtype=np.float32)
+        if self.dtype.kind == 'u':
+            vals = vals * self.fsscale.astype(np.float32) + self.fsoffset.astype(np.float32)
+        return vals
+
+    @profiling.profiled('features.whiten')
+    def _whitefs(self, chunk=65536):
+        """Whitened (unit variance per feature) float32 copy of fs, as
+        scipy.cluster.vq.whiten but computed chunkwise from the compact
+        feature space so no full size float64 temporaries are made.
+        Quantization only shifts and scales the columns so the result
+        is the whitened feature space up to a translation, which k-means
+        doesn't care about."""
+        npts = self.fs.shape[0]
+        mean = np.zeros(self.fs.shape[1], dtype=np.float64)
+        for i in range(0, npts, chunk):
+            mean += np.sum(self.fs[i:i + chunk], axis=0, dtype=np.float64)
+        mean /= max(npts, 1)
+        var = np.zeros(self.fs.shape[1], dtype=np.float64)
+        for i in range(0, npts, chunk):
+            var += np.sum((self.fs[i:i + chunk] - mean) ** 2, axis=0)
+        std = np.sqrt(var / max(npts, 1))
+        # same convention as whiten for constant features
+        std[std == 0] = 1.0
+        white = np.empty(self.fs.shape, dtype=np.float32)
+        for i in range(0, npts, chunk):
+            white[i:i + chunk] = self.fs[i:i + chunk] / std
+        profiling.count(bytes=white.nbytes)
+        return white
+
+    @profiling.profiled('features.clusfs')
     def clusfs(self, method="Kmeans", numclus=3, clusmax=20, cluscrit='BIC'):
         """
         method clusfs - clusters feature space
@@ -215,7 +391,9 @@ class Features:
             import scipy.cluster as sc
             # set up array of optimization values
             opto = []
-            b = sc.vq.whiten(self.fs)
+            # whiten once, straight from the (possibly compact) feature space
+            b = self._whitefs()
+            profiling.count(voxels=b.shape[0])
             if self.cluscrit == "ICL":
                 print("Haven't implemented ICL yet, using BIC...")
             if numclus < 2:  # numclus < 2 means try to find "best" cluster size
@@ -244,17 +422,27 @@ class Features:
                             # Find where max cluster size is in opto and generate clus size
                 self.numclus = np.array(opto).argmax() + 2
                 # urk, do it again
-                z = sc.vq.kmeans(sc.vq.whiten(self.fs), self.numclus)
-                t = sc.vq.kmeans2(sc.vq.whiten(self.fs), z[0])
-                self.clusim[self.fsc] = t[1]
+                z = sc.vq.kmeans(b, self.numclus)
+                t = sc.vq.kmeans2(b, z[0])
+                np.put(self.clusim, self.fsc, t[1])
+                profiling.count(kmeans=len(opto) + 1, clusters=self.numclus)
                 print("Using", self.numclus, "clusters for feature space")
             else:  # just use self.numclus
-                z = sc.vq.kmeans(sc.vq.whiten(self.fs), self.numclus)
-                t = sc.vq.kmeans2(sc.vq.whiten(self.fs), z[0])
-                self.clusim[self.fsc] = t[1]
+                z = sc.vq.kmeans(b, self.numclus)
+                t = sc.vq.kmeans2(b, z[0])
+                np.put(self.clusim, self.fsc, t[1])
+                profiling.count(kmeans=1, clusters=self.numclus)
         else:
             print("Sorry Kmeans only clustering method currently supported")
-        
-            
-        
-        
+
+    def fscoords(self):
+        """
+        method fscoords - image coordinates of the feature space points
+
+        Converts the flat anchor point indices in fsc to image
+        coordinates on demand.
+
+        returns a tuple of D ndarrays (one per image dimension) of
+        length P, suitable for indexing fsmask, clusim or the images
+        """
+        return np.unravel_index(self.fsc, self.dims)
@@ -323,3 +323,323 @@ makecomat4D_2T(int* input1,
   }
 }
 
+/* Generate from a single Nd image for a whole set of offsets in one
+   pass over the image. shape and coords (ncoords x 4) are padded to
+   4 dimensions (shape with trailing 1's, coords with trailing 0's) so
+   the same kernel serves 1,2,3 and 4D images. If separate is nonzero
+   output holds one levels x levels histogram per offset, otherwise the
+   histograms of all offsets are summed into a single one */
+
+void
+makecomat_mult(int* input,
+	       int* mask,
+	       int* shape,
+	       int* coords,
+	       int ncoords,
+	       int levels,
+	       int separate,
+	       int* output) {
+  int x, y, z, t, c, xval, yval, zval, tval, i, j;
+  int xi = shape[0], yi = shape[1], zi = shape[2], ti = shape[3];
+  long ind, nind, plane = (long) levels * levels;
+  int* out;
+
+  for (x = 0; x < xi; x++) {
+    for (y = 0; y < yi; y++) {
+      for (z = 0; z < zi; z++) {
+	for (t = 0; t < ti; t++) {
+	  ind = (((long) x*yi + y)*zi + z)*ti + t;
+	  if (mask[ind] != 1)
+	    continue;
+	  i = input[ind];
+	  if (i < 0 || i >= levels)
+	    continue; // else raise a warning
+	  for (c = 0; c < ncoords; c++) {
+	    xval = x + coords[4*c];
+	    yval = y + coords[4*c + 1];
+	    zval = z + coords[4*c + 2];
+	    tval = t + coords[4*c + 3];
+
+	    if ((xval >= 0) && (xval < xi) &&
+		(yval >= 0) && (yval < yi) &&
+		(zval >= 0) && (zval < zi) &&
+		(tval >= 0) && (tval < ti))
+	      {
+		nind = (((long) xval*yi + yval)*zi + zval)*ti + tval;
+		if (mask[nind] == 1)
+		  {
+		    j = input[nind];
+		    if (j >= 0 && j < levels) {
+		      out = separate ? output + c*plane : output;
+		      out[i*levels + j]++;
+		    } // else raise a warning
+		  }
+	      }
+	  }
+	}
+      }
+    }
+  }
+}
+
+/* Co-occurrence histograms of several regions in a single pass: labels
+   holds the region (1..nlabels, 0 = none) of each voxel and only pairs
+   with both voxels in the same region are counted, summed over coords
+   into output[(label - 1)*levels*levels + i*levels + j]. Shape and
+   coords are padded to 4 dimensions as for makecomat_mult */
+
+void
+makecomat_labels(int* input,
+		 int* labels,
+		 int* shape,
+		 int* coords,
+		 int ncoords,
+		 int levels,
+		 int nlabels,
+		 int* output) {
+  int x, y, z, t, c, xval, yval, zval, tval, i, j, l;
+  int xi = shape[0], yi = shape[1], zi = shape[2], ti = shape[3];
+  long ind, nind, plane = (long) levels * levels;
+  int* out;
+
+  for (x = 0; x < xi; x++) {
+    for (y = 0; y < yi; y++) {
+      for (z = 0; z < zi; z++) {
+	for (t = 0; t < ti; t++) {
+	  ind = (((long) x*yi + y)*zi + z)*ti + t;
+	  l = labels[ind];
+	  if (l < 1 || l > nlabels)
+	    continue;
+	  i = input[ind];
+	  if (i < 0 || i >= levels)
+	    continue; // else raise a warning
+	  out = output + (l - 1)*plane;
+	  for (c = 0; c < ncoords; c++) {
+	    xval = x + coords[4*c];
+	    yval = y + coords[4*c + 1];
+	    zval = z + coords[4*c + 2];
+	    tval = t + coords[4*c + 3];
+
+	    if ((xval >= 0) && (xval < xi) &&
+		(yval >= 0) && (yval < yi) &&
+		(zval >= 0) && (zval < zi) &&
+		(tval >= 0) && (tval < ti))
+	      {
+		nind = (((long) xval*yi + yval)*zi + zval)*ti + tval;
+		if (labels[nind] == l)
+		  {
+		    j = input[nind];
+		    if (j >= 0 && j < levels)
+		      out[i*levels + j]++;
+		    // else raise a warning
+		  }
+	      }
+	  }
+	}
+      }
+    }
+  }
+}
+
+/* Cross co-occurrence histograms of every ordered pair of nimages
+   co-registered images in a single pass: inputs and masks hold the
+   images (and masks, or a single mask if nmasks == 1) one after the
+   other, the pairs (i in image a at an anchor with mask a == 1, j in
+   image b at anchor + coords[c] with mask b == 1) are summed over coords
+   into output[((a*nimages + b)*levels + i)*levels + j]. anchor is scratch
+   room for nimages ints. Shape and coords are padded to 4 dimensions as
+   for makecomat_mult */
+
+void
+makecomat_cross(int* inputs,
+		int* masks,
+		int nimages,
+		int nmasks,
+		int* shape,
+		int* coords,
+		int ncoords,
+		int levels,
+		int* anchor,
+		int* output) {
+  int x, y, z, t, c, a, b, xval, yval, zval, tval, i, j, found;
+  int xi = shape[0], yi = shape[1], zi = shape[2], ti = shape[3];
+  long ind, nind, nvox = (long) xi * yi * zi * ti, plane = (long) levels * levels;
+
+  for (x = 0; x < xi; x++) {
+    for (y = 0; y < yi; y++) {
+      for (z = 0; z < zi; z++) {
+	for (t = 0; t < ti; t++) {
+	  ind = (((long) x*yi + y)*zi + z)*ti + t;
+	  // levels of the images this voxel is an anchor of, -1 elsewhere
+	  found = 0;
+	  for (a = 0; a < nimages; a++) {
+	    i = inputs[a*nvox + ind];
+	    if (masks[(nmasks == 1 ? 0 : a)*nvox + ind] == 1 && i >= 0 && i < levels) {
+	      anchor[a] = i;
+	      found = 1;
+	    }
+	    else
+	      anchor[a] = -1;
+	  }
+	  if (!found)
+	    continue;
+	  for (c = 0; c < ncoords; c++) {
+	    xval = x + coords[4*c];
+	    yval = y + coords[4*c + 1];
+	    zval = z + coords[4*c + 2];
+	    tval = t + coords[4*c + 3];
+
+	    if ((xval < 0) || (xval >= xi) ||
+		(yval < 0) || (yval >= yi) ||
+		(zval < 0) || (zval >= zi) ||
+		(tval < 0) || (tval >= ti))
+	      continue;
+	    nind = (((long) xval*yi + yval)*zi + zval)*ti + tval;
+	    for (b = 0; b < nimages; b++) {
+	      if (masks[(nmasks == 1 ? 0 : b)*nvox + nind] != 1)
+		continue;
+	      j = inputs[b*nvox + nind];
+	      if (j < 0 || j >= levels)
+		continue; // else raise a warning
+	      for (a = 0; a < nimages; a++)
+		if (anchor[a] >= 0)
+		  output[(a*nimages + b)*plane + anchor[a]*levels + j]++;
+	    }
+	  }
+	}
+      }
+    }
+  }
+}
+
+/* Texture measure codes understood by comat_measure_map */
+
+#define MEAS_ENTROPY 0
+#define MEAS_ENERGY 1
+#define MEAS_CONTRAST 2
+#define MEAS_HOMOGENEITY 3
+#define MEAS_IDM 4
+#define MEAS_MAXPROB 5
+
+/* Generate a map of texture measures without building a co-occurrence
+   matrix per voxel. For each voxel with anchors == 1 the co-occurrences
+   (i at v, j at v + coords[c]) of every voxel v = anchor + window[w] are
+   counted into scratch (levels x levels, all zero on entry and on exit),
+   keeping the cells hit in touched (room for nwindow*ncoords entries), the
+   requested measures (codes above) of the normalized counts are written to
+   output[m*nvox + anchor] and only the touched cells are cleared again.
+   Shape, window and coords are padded to 4 dimensions as for
+   makecomat_mult. Anchors without any counts get NAN */
+
+void
+comat_measure_map(int* input,
+		  int* mask,
+		  int* anchors,
+		  int* shape,
+		  int* window,
+		  int nwindow,
+		  int* coords,
+		  int ncoords,
+		  int levels,
+		  int* measures,
+		  int nmeasures,
+		  double coordmom,
+		  double probmom,
+		  int* scratch,
+		  int* touched,
+		  double* output) {
+  int x, y, z, t, w, c, m, k, xv, yv, zv, tv, xn, yn, zn, tn, i, j, ntouched, cell;
+  int xi = shape[0], yi = shape[1], zi = shape[2], ti = shape[3];
+  long ind, vind, nind, total, nvox = (long) xi * yi * zi * ti;
+  double p, d, val, codiff;
+
+  for (x = 0; x < xi; x++) {
+    for (y = 0; y < yi; y++) {
+      for (z = 0; z < zi; z++) {
+	for (t = 0; t < ti; t++) {
+	  ind = (((long) x*yi + y)*zi + z)*ti + t;
+	  if (anchors[ind] != 1)
+	    continue;
+	  ntouched = 0;
+	  total = 0;
+	  for (w = 0; w < nwindow; w++) {
+	    xv = x + window[4*w];
+	    yv = y + window[4*w + 1];
+	    zv = z + window[4*w + 2];
+	    tv = t + window[4*w + 3];
+	    if ((xv < 0) || (xv >= xi) || (yv < 0) || (yv >= yi) ||
+		(zv < 0) || (zv >= zi) || (tv < 0) || (tv >= ti))
+	      continue;
+	    vind = (((long) xv*yi + yv)*zi + zv)*ti + tv;
+	    if (mask[vind] != 1)
+	      continue;
+	    i = input[vind];
+	    if (i < 0 || i >= levels)
+	      continue;
+	    for (c = 0; c < ncoords; c++) {
+	      xn = xv + coords[4*c];
+	      yn = yv + coords[4*c + 1];
+	      zn = zv + coords[4*c + 2];
+	      tn = tv + coords[4*c + 3];
+	      if ((xn < 0) || (xn >= xi) || (yn < 0) || (yn >= yi) ||
+		  (zn < 0) || (zn >= zi) || (tn < 0) || (tn >= ti))
+		continue;
+	      nind = (((long) xn*yi + yn)*zi + zn)*ti + tn;
+	      if (mask[nind] != 1)
+		continue;
+	      j = input[nind];
+	      if (j < 0 || j >= levels)
+		continue;
+	      cell = i*levels + j;
+	      if (scratch[cell] == 0)
+		touched[ntouched++] = cell;
+	      scratch[cell]++;
+	      total++;
+	    }
+	  }
+
+	  for (m = 0; m < nmeasures; m++) {
+	    if (total == 0) {
+	      output[m*nvox + ind] = NAN;
+	      continue;
+	    }
+	    val = 0.0;
+	    for (k = 0; k < ntouched; k++) {
+	      cell = touched[k];
+	      p = (double) scratch[cell] / total;
+	      d = fabs((double) (cell / levels - cell % levels));
+	      switch (measures[m]) {
+	      case MEAS_ENTROPY:
+		val -= p * log2(p);
+		break;
+	      case MEAS_ENERGY:
+		val += p * p;
+		break;
+	      case MEAS_CONTRAST:
+		val += pow(d, coordmom) * pow(p, probmom);
+		break;
+	      case MEAS_HOMOGENEITY:
+		val += p / (1.0 + d);
+		break;
+	      case MEAS_IDM:
+		codiff = pow(d, coordmom);
+		if (codiff > 0.0000001)
+		  val += pow(p, probmom) / codiff;
+		break;
+	      case MEAS_MAXPROB:
+		if (p > val)
+		  val = p;
+		break;
+	      }
+	    }
+	    output[m*nvox + ind] = val;
+	  }
+
+	  // clear only the cells this anchor used
+	  for (k = 0; k < ntouched; k++)
+	    scratch[touched[k]] = 0;
+	}
+      }
+    }
+  }
+}
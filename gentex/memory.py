@@ -0,0 +1,62 @@
+"""  gentex.memory package
+
+Memory budget used by Features and the co-occurrence matrix calculators
+to size their temporaries (cast copies, feature space)
+
+A budget can be set for the whole process (set_budget), for a block of
+code (with budget(...)) or per call (the budget argument of Features,
+comat.comat, comat.comat_mult and comat.comat_family, which wins over
+the others). Without a budget everything is done in one go as before.
+
+"""
+
+import threading
+from contextlib import contextmanager
+
+_budget = None
+# budgets set with the budget() context manager, per thread
+_local = threading.local()
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when a calculation can't be fitted into the memory budget"""
+
+
+def set_budget(nbytes):
+    """Sets the process wide memory budget in bytes (None = no budget)"""
+    global _budget
+    assert nbytes is None or nbytes > 0
+    _budget = nbytes
+
+
+def get_budget():
+    """Memory budget in effect in this thread (bytes, None = no budget)"""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    return _budget
+
+
+@contextmanager
+def budget(nbytes):
+    """Context manager setting the memory budget (bytes) for the code it wraps"""
+    assert nbytes is None or nbytes > 0
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    _local.stack.append(nbytes)
+    try:
+        yield
+    finally:
+        _local.stack.pop()
+
+
+def resolve(nbytes=None):
+    """Per call budget if given, otherwise the budget in effect"""
+    return get_budget() if nbytes is None else nbytes
+
+
+def check(need, limit, what):
+    """Raises MemoryBudgetError if need bytes don't fit in limit"""
+    if limit is not None and need > limit:
+        raise MemoryBudgetError('%s needs at least %d bytes, over the memory budget of %d bytes'
+                                % (what, need, limit))
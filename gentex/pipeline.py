@@ -0,0 +1,190 @@
+"""  gentex.pipeline package
+
+Runs the whole template -> feature space -> clustering -> co-occurrence
+matrix -> texture measure chain in one go
+
+"""
+
+import time
+import tracemalloc
+from ctypes import c_int
+
+import numpy as np
+
+from . import comat, features, texmeas
+
+
+class Pipeline:
+    """Class pipeline for computing texture measures from multimodal images in one call
+
+    Chains Features, Features.clusfs, comat.comat_mult and Texmeas with the
+    same configuration for every image set passed to run(). The label and
+    mask images handed to the co-occurrence kernel are kept in c_int buffers
+    that are reused from one run to the next (as long as the image shape
+    doesn't change) so no int16 -> c_int copies are made, and the feature
+    space is dropped as soon as it has been clustered.
+
+    Parameters
+    ----------
+
+    template: Template or list of offsets
+        Template used to build the feature space
+
+    numclus: int
+        Number of clusters (grey levels) for the feature space clustering;
+        values less than 2 let clusfs pick the number of clusters up to clusmax
+        (default = 4)
+
+    measures: list of strings
+        Texture measures to compute (see Texmeas, default = ['CM Entropy'])
+
+    coordset: list of offsets
+        Offsets used to build the co-occurrence matrix (default = the template offsets)
+
+    clusmax: int
+        Largest number of clusters tried when numclus < 2 (default = 20)
+
+    cluscrit: string
+        Penalty term used when numclus < 2 (default = 'BIC')
+
+    dtype: numpy dtype
+        Storage type of the feature space (see Features, default = float32)
+
+    params: dict
+        Keyword arguments passed on to Texmeas (coordmom, probmom, rllen, clusmom, clusp, samelev, betas)
+
+    keep: bool
+        Whether or not to return the intermediates (Features instance, label image,
+        co-occurrence matrix) along with the measures (default = False)
+
+    trackmem: bool
+        Whether or not to trace memory allocations (tracemalloc) to report the peak
+        memory allocated by each stage; this slows things down a bit (default = False).
+        Before Python 3.9 the peaks are only per stage if tracemalloc isn't already on
+
+
+    Attributes
+    ----------
+
+    timing: dict
+        Wall time in seconds of each stage ('features', 'clustering', 'comat', 'texmeas')
+        of the most recent run
+
+    memory: dict
+        Peak memory in bytes allocated by each stage of the most recent run
+        (empty unless trackmem is set)
+    """
+
+    def __init__(self, template, numclus=4, measures=['CM Entropy'], coordset=None, clusmax=20, cluscrit='BIC',
+                 dtype=np.float32, params=None, keep=False, trackmem=False):
+
+        self.template = template
+        self.offsets = getattr(template, 'offsets', template)
+        self.numclus = numclus
+        self.measures = list(measures)
+        self.coordset = self.offsets if coordset is None else coordset
+        self.clusmax = clusmax
+        self.cluscrit = cluscrit
+        self.dtype = dtype
+        self.params = {} if params is None else dict(params)
+        self.keep = keep
+        self.trackmem = trackmem
+
+        self.timing = {}
+        self.memory = {}
+
+        # reusable c_int buffers for the label image and mask
+        self._labels = None
+        self._mask = None
+        # whether run() started tracemalloc itself
+        self._tracing = False
+
+    def _buffers(self, shape):
+        """(Re)allocate the label and mask buffers if the image shape changed"""
+        if self._labels is None or self._labels.shape != shape:
+            self._labels = np.zeros(shape, dtype=c_int)
+            self._mask = np.zeros(shape, dtype=c_int)
+        else:
+            self._labels.fill(0)
+        return self._labels, self._mask
+
+    def _reset_peak(self):
+        """Start a new peak memory measurement"""
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        elif self._tracing:
+            # Python < 3.9: restarting the tracing we started clears the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+        # (otherwise the peak is the one since the caller started tracing)
+        self._membase = tracemalloc.get_traced_memory()[0]
+
+    def _stage(self, name, start):
+        """Record the time (and peak memory) of a stage started at start"""
+        self.timing[name] = time.perf_counter() - start
+        if self.trackmem:
+            self.memory[name] = tracemalloc.get_traced_memory()[1] - self._membase
+            self._reset_peak()
+        return time.perf_counter()
+
+    def run(self, images, mask):
+        """Runs the pipeline on a set of co-registered images
+
+        Parameters
+        ----------
+
+        images: list of 1-4 dimensional ndarrays
+            Images used to build the feature space
+
+        mask: 1-4 dimensional ndarray
+            Mask (0,1 array, same shape as the images)
+
+        Returns
+        -------
+
+        dict
+            'measures': dict of measure name -> value, 'timing' and 'memory': per stage
+            wall time and peak memory (see attributes), and if keep is set 'features'
+            (the Features instance, without its feature space), 'clusim' (label image)
+            and 'comat' (co-occurrence matrix)
+        """
+        self.timing = {}
+        self.memory = {}
+        tracing = self.trackmem and not tracemalloc.is_tracing()
+        self._tracing = tracing
+        if self.trackmem:
+            if tracing:
+                tracemalloc.start()
+            self._reset_peak()
+
+        try:
+            start = time.perf_counter()
+            fe = features.Features(images, mask, self.offsets, dtype=self.dtype)
+            start = self._stage('features', start)
+
+            # let clusfs write the labels straight into the kernel's buffer
+            labels, cmask = self._buffers(fe.dims)
+            fe.clusim = labels
+            fe.clusfs(numclus=self.numclus, clusmax=self.clusmax, cluscrit=self.cluscrit)
+            # the feature space isn't needed past this point
+            fe.fs = np.array([], dtype=fe.dtype)
+            np.copyto(cmask, fe.fsmask)
+            start = self._stage('clustering', start)
+
+            # only voxels that got a label (fsmask) take part in the co-occurrences
+            cm = comat.comat_mult(labels, cmask, self.coordset, levels=fe.numclus)
+            start = self._stage('comat', start)
+
+            tex = texmeas.Texmeas(cm, measure=self.measures[0], **self.params)
+            vals = tex.calc_many(self.measures)
+            self._stage('texmeas', start)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+        result = {'measures': vals, 'timing': dict(self.timing), 'memory': dict(self.memory)}
+        if self.keep:
+            # hand out a copy as the buffer is reused by the next run
+            fe.clusim = labels.copy()
+            result.update({'features': fe, 'clusim': fe.clusim, 'comat': cm})
+        return result
@@ -0,0 +1,201 @@
+"""  gentex.profiling package
+
+Opt-in timers and counters for the stages of the gentex pipeline
+(casting and kernels in comat, feature space construction and clustering
+in features, epsilon machine and spectrum estimation in texmeas)
+
+Nothing is recorded unless a Profile is active or a callback is
+registered; until then stage() hands back a shared do nothing stage and
+profiled functions are called straight away, so the instrumented code
+only pays for a function call. Counters that take work to find out are
+only worked out when enabled().
+
+Example
+-------
+
+    with gentex.profiling.Profile() as prof:
+        fe = gentex.features.Features([im], mask, offsets)
+        fe.clusfs(numclus=4)
+        cm = gentex.comat.comat_mult(fe.clusim, fe.fsmask, offsets, levels=4)
+    print(prof.to_json())
+
+"""
+
+import functools
+import json
+import threading
+import time
+
+# active Profile instances and callbacks, each called as
+# listener(name, record) at the end of every stage
+_listeners = []
+_lock = threading.Lock()
+# stages currently running in each thread (innermost last)
+_running = threading.local()
+
+
+class _NullStage:
+    """Stage handed out while profiling is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def count(self, **counters):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Times a stage and collects its counters, passing the record on to
+    the listeners when it ends"""
+
+    def __init__(self, name):
+        self.name = name
+        self.record = {}
+
+    def __enter__(self):
+        if not hasattr(_running, 'stages'):
+            _running.stages = []
+        _running.stages.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['time'] = time.perf_counter() - self._start
+        _running.stages.remove(self)
+        for listener in list(_listeners):
+            listener(self.name, self.record)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def count(self, **counters):
+        """Adds to the counters of the stage (voxels, masked, offsets, bytes...)"""
+        for key, val in counters.items():
+            self.record[key] = self.record.get(key, 0) + val
+
+
+def stage(name):
+    """Context manager timing the stage name, e.g.
+
+        with profiling.stage('comat.kernel') as st:
+            ...
+            if st:  # only work counters out when profiling
+                st.count(voxels=..., offsets=...)
+    """
+    if not _listeners:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def profiled(name):
+    """Decorator running the decorated function as the stage name"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _listeners:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(**counters):
+    """Adds to the counters of the innermost stage running in this thread"""
+    if _listeners and getattr(_running, 'stages', None):
+        _running.stages[-1].count(**counters)
+
+
+def enabled():
+    """Whether anything is listening to the stages"""
+    return bool(_listeners)
+
+
+def add_callback(callback):
+    """Registers callback(name, record) to be called at the end of every
+    stage, record being a dict with the stage 'time' and its counters"""
+    with _lock:
+        _listeners.append(callback)
+
+
+def remove_callback(callback):
+    """Unregisters a callback added with add_callback"""
+    with _lock:
+        _listeners.remove(callback)
+
+
+class Profile:
+    """Class profile collecting per stage statistics while active
+
+    Use as a context manager (or call start/stop). Every stage run while
+    the profile is active adds to stats[stage]: 'calls', 'time' (wall time
+    in seconds) and the counters reported by the stage, e.g.
+
+        - 'voxels': voxels visited
+        - 'masked': voxels masked out
+        - 'offsets': template offsets processed
+        - 'bytes': bytes allocated for the stage's arrays
+
+    Attributes
+    ----------
+
+    stats: dict
+        stage name -> dict of totals
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._statlock = threading.Lock()
+
+    def __call__(self, name, record):
+        with self._statlock:
+            totals = self.stats.setdefault(name, {'calls': 0, 'time': 0.0})
+            totals['calls'] += 1
+            for key, val in record.items():
+                totals[key] = totals.get(key, 0) + val
+
+    def start(self):
+        """Starts collecting"""
+        add_callback(self)
+        return self
+
+    def stop(self):
+        """Stops collecting (the stats are kept)"""
+        if self in _listeners:
+            remove_callback(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def reset(self):
+        """Drops the stats collected so far"""
+        with self._statlock:
+            self.stats = {}
+
+    def to_dict(self):
+        """Copy of the stats"""
+        with self._statlock:
+            return {name: dict(totals) for name, totals in self.stats.items()}
+
+    def to_json(self, path=None, **kwargs):
+        """Stats as a JSON string, also written to path if given
+        (kwargs are passed on to json.dumps)"""
+        text = json.dumps(self.to_dict(), **kwargs)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
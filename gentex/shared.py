@@ -0,0 +1,143 @@
+"""  gentex.shared package
+
+Arrays in shared memory (multiprocessing.shared_memory) for parallel runs
+
+Images, masks, feature spaces and co-occurrence matrices handed to
+multiprocessing or concurrent.futures workers are pickled for every
+task. share() copies an array into a shared memory segment once and
+returns a SharedArray handle that pickles as just its name, shape and
+dtype; asarray() gives back a zero-copy view in whichever process it is
+called. The comat calculators, Features, Texmeas and the texmeas.measures
+/ batch_measures functions accept handles wherever they take arrays.
+
+Example
+-------
+
+    with gentex.shared.share(image) as him, gentex.shared.share(mask) as hmask:
+        with ProcessPoolExecutor() as pool:
+            cms = list(pool.map(functools.partial(gentex.comat.comat_mult, him, hmask, levels=8), offsets))
+
+Each process maps a segment once, until close(); views keep their
+mapping alive, so they can outlive the handle. Shared memory segments
+need Python 3.8 or later (importing this module doesn't). The process that created
+a segment frees it with unlink(), which leaving the with block does.
+Workers must be started by multiprocessing (which shares the resource
+tracker) so that their exit doesn't free the segment.
+
+"""
+
+import ctypes
+import threading
+
+import numpy as np
+
+# segments mapped in this process, name -> SharedMemory
+_attached = {}
+_lock = threading.Lock()
+
+
+def _attach(name, size=None):
+    """SharedMemory for name, mapped once per process (created if size is given)"""
+    # only in Python >= 3.8, and keeps multiprocessing off the import path
+    from multiprocessing import shared_memory
+
+    with _lock:
+        shm = _attached.get(name)
+        if shm is None:
+            if size is None:
+                shm = shared_memory.SharedMemory(name=name)
+            else:
+                shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            _attached[shm.name] = shm
+        return shm
+
+
+class _Mapping:
+    """Base of the views of a segment: an array interface to its memory
+    that keeps the SharedMemory, and so the mapping, alive as long as a
+    view is around (SharedMemory closes itself when the last one goes)"""
+
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        # the address only, a buffer held on shm.buf would keep close() from unmapping it
+        address = ctypes.addressof(ctypes.c_char.from_buffer(shm.buf))
+        self.__array_interface__ = {'shape': shape, 'typestr': dtype.str, 'descr': dtype.descr,
+                                    'data': (address, False), 'version': 3}
+
+
+class SharedArray:
+    """Class shared array: picklable handle to an ndarray in shared memory
+
+    Parameters
+    ----------
+
+    name: string
+        Name of the shared memory segment
+
+    shape: tuple of ints
+        Shape of the array
+
+    dtype: numpy dtype
+        Data type of the array
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        assert not self.dtype.hasobject, 'Object arrays can not be shared'
+
+    def __reduce__(self):
+        return (SharedArray, (self.name, self.shape, self.dtype.str))
+
+    def __repr__(self):
+        return 'SharedArray(%r, %r, %r)' % (self.name, self.shape, self.dtype.str)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def asarray(self):
+        """Zero-copy ndarray view of the shared array"""
+        return np.asarray(_Mapping(_attach(self.name), self.shape, self.dtype))
+
+    def close(self):
+        """Releases the segment in this process (it stays mapped while
+        views of it are around)"""
+        with _lock:
+            _attached.pop(self.name, None)
+
+    def unlink(self):
+        """Frees the segment once every process has closed it; called by
+        the process that created it"""
+        _attach(self.name).unlink()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+        return False
+
+
+def empty(shape, dtype=np.float64):
+    """Handle to a new uninitialized shared array"""
+    dtype = np.dtype(dtype)
+    shm = _attach(None, int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+    return SharedArray(shm.name, shape, dtype)
+
+
+def share(array):
+    """Copies array into a new shared memory segment and returns its handle"""
+    array = np.asarray(array)
+    handle = empty(array.shape, array.dtype)
+    handle.asarray()[...] = array
+    return handle
+
+
+def asarray(obj):
+    """View of obj if it is a SharedArray, obj itself otherwise"""
+    if isinstance(obj, SharedArray):
+        return obj.asarray()
+    return obj
@@ -1,5 +1,8 @@
 # routines for generating a list of coordinate offsets for various circle or sphere
 
+import numpy as np
+
+
 
 def circle_in(xm, ym, r):
     circ = []
@@ -23,19 +26,15 @@ def circle_in(xm, ym, r):
     return circ
 
 
-def bres_circle(xm, ym, r):
-    # This is a version of Bresenhams circle algorithm via:
-    # http://free.pages.at/easyfilter/bresenham.html
-
-    circ = []
+def _bres_quadrant(r):
+    """(x, y) steps of Bresenhams circle algorithm of radius r
+    (the points of one quadrant, the other 3 follow by rotation)"""
+    steps = []
     x = -r
     y = 0
     err = 2 - 2 * r
     while x < 0:  # do octants
-        circ.append([xm - x, ym + y])
-        circ.append([xm - y, ym - x])
-        circ.append([xm + x, ym - y])
-        circ.append([xm + y, ym + x])
+        steps.append((x, y))
         r = err
         if r > x:
             x += 1
@@ -43,87 +42,103 @@ def bres_circle(xm, ym, r):
         if r <= y:
             y += 1
             err += y * 2 + 1  # e_xy+e_y < 0
-    return circ
+    return np.array(steps, dtype=int).reshape(-1, 2)
+
+
+def _bres_circle(r):
+    """Bresenham circle of radius r about the origin as an (n, 2) array,
+    in the same order as bres_circle"""
+    x, y = _bres_quadrant(r).T
+    # the 4 rotations of each step, interleaved
+    return np.stack([np.stack([-x, y], 1), np.stack([-y, -x], 1),
+                     np.stack([x, -y], 1), np.stack([y, x], 1)], 1).reshape(-1, 2)
+
+
+def bres_circle(xm, ym, r):
+    # This is a version of Bresenhams circle algorithm via:
+    # http://free.pages.at/easyfilter/bresenham.html
+    return (_bres_circle(r) + [xm, ym]).tolist()
+
+
+def _unique_rows(pts):
+    """Sorted unique rows of an (n, dim) array, as np.unique(pts, axis=0) but
+    for integer points done through a single int64 key per row, which is a
+    lot faster for large offset sets"""
+    pts = np.asarray(pts)
+    if pts.size == 0 or not np.issubdtype(pts.dtype, np.integer):
+        return np.unique(pts, axis=0)
+    low = pts.min(axis=0)
+    span = pts.max(axis=0) - low + 1
+    keys = np.unique(np.ravel_multi_index(tuple((pts - low).T), tuple(span)))
+    return (np.column_stack(np.unravel_index(keys, tuple(span))) + low).astype(pts.dtype)
 
 
 def rem_dup(mylist):
+    # sorts mylist and removes duplicate entries (in place)
     if mylist:
-        mylist.sort()
-        last = mylist[-1]
-        for i in range(len(mylist) - 2, -1, -1):
-            if last == mylist[i]:
-                del mylist[i]
-            else:
-                last = mylist[i]
+        if np.ndim(mylist) == 1:
+            mylist[:] = sorted(set(mylist))
+        else:
+            mylist[:] = _unique_rows(mylist).tolist()
     return mylist
 
 
+def _get_radii(r):
+    """Radii of the circular layers of a Bresenham sphere of radius r"""
+    if r <= 1:
+        return np.array([1, 0])
+    zc = _bres_circle(r)
+    keep = (zc[:, 0] >= 0) & (zc[:, 0] <= r) & (zc[:, 1] > 0)
+    # going through x = 0..r, points in circle order for each x
+    order = np.argsort(zc[keep, 0], kind='stable')
+    return zc[keep, 1][order]
+
+
 def get_radii(r):
-    zero_circle = bres_circle(0, 0, r)
-    radii = []
-    if r > 1:
-        for step in range(r + 1):
-            for zc in zero_circle:
-                if zc[0] == step and zc[1] > 0:
-                    radii.append(zc[1])
-    else:
-        radii = [1, 0]
-    return radii
+    return _get_radii(r).tolist()
+
+
+def _sphere_shell(r):
+    """Bresenham spherical shell of radius r about the origin as an
+    (n, 3) array, in the same order as sphere_shell"""
+    radii = _get_radii(r)
+    layers = []
+    for z in range(len(radii) - 1):
+        circ = _bres_circle(radii[z])
+        up = np.column_stack((circ, np.full(len(circ), z)))
+        if z > 0:
+            down = np.column_stack((circ, np.full(len(circ), -z)))
+            up = np.stack((up, down), 1).reshape(-1, 3)
+        layers.append(up)
+    # "caps"
+    cap = np.arange(-radii[r], radii[r] + 1)
+    x, y = np.meshgrid(cap, cap, indexing='ij')
+    x, y = np.ravel(x), np.ravel(y)
+    layers.append(np.stack([np.column_stack((x, y, np.full(len(x), r))),
+                            np.column_stack((x, y, np.full(len(x), -r)))], 1).reshape(-1, 3))
+    return np.vstack(layers)
 
 
 def sphere_shell(xm, ym, zm, r):
     # This builds a sperical shell layer by layer using
     # the version of Bresenhams circle algorithm at:
     # http://free.pages.at/easyfilter/bresenham.html
-    shell = []
-    radii = get_radii(r)
-    for z in range(len(radii) - 1):
-        circ = bres_circle(xm, ym, radii[z])
-        for ci in circ:
-            withzp = ci + [z + zm]
-            shell.append(withzp)
-            if z > 0:
-                withzm = ci + [zm - z]
-                shell.append(withzm)
-    for x in range(-radii[r], radii[r] + 1):  # do "caps"
-        for y in range(-radii[r], radii[r] + 1):
-            shell.append([x + xm, y + ym, r + zm])
-            shell.append([x + xm, y + ym, zm - r])
-    return shell
+    return (_sphere_shell(r) + [xm, ym, zm]).tolist()
+
+
+def _sphere(r):
+    """Voxels strictly inside the sphere of radius r about the origin as
+    an (n, 3) array, in the same order as sphere"""
+    octant = np.stack(np.meshgrid(*[np.arange(max(r, 0))] * 3, indexing='ij'), -1).reshape(-1, 3)
+    octant = octant[np.sum(octant * octant, axis=1) < r * r]
+    # each point of the positive octant followed by its reflections
+    # through the planes of its nonzero coordinates
+    signs = np.array([[1, 1, 1], [-1, 1, 1], [1, -1, 1], [-1, -1, 1],
+                      [1, 1, -1], [-1, 1, -1], [1, -1, -1], [-1, -1, -1]])
+    pts = octant[:, None, :] * signs
+    valid = np.all((signs > 0) | (octant[:, None, :] > 0), axis=2)
+    return pts[valid]
 
 
 def sphere(xm, ym, zm, r):
-    sphere = []
-    r2 = r * r
-    for x in range(r):
-        for y in range(r):
-            for z in range(r):
-                if x > 0:
-                    x2 = x * x
-                else:
-                    x2 = 0
-                if y > 0:
-                    y2 = y * y
-                else:
-                    y2 = 0
-                if z > 0:
-                    z2 = z * z
-                else:
-                    z2 = 0
-                if x2 + y2 + z2 < r2:
-                    sphere.append([x + xm, y + ym, z + zm])
-                    if x > 0:
-                        sphere.append([-x + xm, y + ym, z + zm])
-                    if y > 0:
-                        sphere.append([x + xm, -y + ym, z + zm])
-                        if x > 0:
-                            sphere.append([-x + xm, -y + ym, z + zm])
-                    if z > 0:
-                        sphere.append([x + xm, y + ym, -z + zm])
-                        if x > 0:
-                            sphere.append([-x + xm, y + ym, -z + zm])
-                        if y > 0:
-                            sphere.append([x + xm, -y + ym, -z + zm])
-                            if x > 0:
-                                sphere.append([-x + xm, -y + ym, -z + zm])
-    return sphere
+    return (_sphere(r) + [xm, ym, zm]).tolist()
@@ -1,7 +1,11 @@
 # routines for generating a list of coordinate offsets for various template structures
 
+import functools
+
 import numpy as np
 
+from .sphere import _bres_circle, _sphere_shell, _unique_rows
+
 
 class Template:
     """Class template for generating lists of template voxels
@@ -26,6 +30,18 @@ class Template:
 
             - 'Cone' - cone template template origin is start of half cone
 
+            - 'Sphere' - voxels strictly inside a (hyper)sphere of radius sizes[0] (any dimension) template origin
+              is center of sphere
+
+            - 'SphereShell' - Bresenham spherical shell of radius sizes[0] (3 dimensions) template origin is center
+              of shell
+
+            - 'Circle' - Bresenham circle of radius sizes[0] (2 dimensions) template origin is center of circle
+
+            - 'Directions' - the (3**dimension - 1)/2 unique directions to the neighbours of a voxel (the 4 2D
+              and 13 3D Haralick directions) at each of the distances given in sizes, for rotation invariant
+              co-occurrence matrices (see comat.comat_family)
+
     sizes:  1D int array (can be empty)
         Attributes of sizes required for constructing template
 
@@ -72,6 +88,19 @@ class Template:
         to the feature space cluster algorithm, then those
         to the cooccurence matrix builder, and that to the texture
         measure generator.
+
+
+    Attributes
+    ----------
+
+    offsets: list of lists
+        The template offsets as built (entries can be floats for the shells and ellipsoids)
+
+    offarray: ndarray
+        Read only, C contiguous (n_offsets, dimension) int32 array of the offsets as the
+        co-occurrence kernels use them (truncated to integers), deduplicated and sorted;
+        can be passed straight to comat.comat_mult and friends. Templates built with
+        identical parameters share the same array.
     """
 
     def __init__(self, type, sizes, dimension, inclusion, handedness=None, axbase=None, anchoff=None, shift=None):
@@ -88,429 +117,268 @@ class Template:
 
         # Set up default handedness
         if self.handedness is None:  # Nothing passed in to constructor
-            if self.dim == 1:
-                self.handedness = [1]
-            if self.dim == 2:
-                self.handedness = [1, 1]
-            if self.dim == 3:
-                self.handedness = [1, 1, 1]
-            if self.dim == 4:
-                self.handedness = [1, 1, 1, 1]
+            self.handedness = [1] * self.dim
 
         # Set up default axis directions
         if self.axbase is None:  # Nothing passed in to constructor
-            if self.dim == 1:
-                # pick convention for 1 dimension of positve = 1
-                # negative = -1
-                self.axbase = [1]
-            if self.dim == 2:
-                self.axbase = [1, 0]
-            if self.dim == 3:
-                self.axbase = [1, 0, 0]
-            if self.dim == 4:
-                self.axbase = [1, 0, 0, 0]
+            # pick convention for 1 dimension of positve = 1
+            # negative = -1
+            self.axbase = [1] + [0] * (self.dim - 1)
 
         # Set up anchor point offset
         if self.anchoff is None:  # Nothing passed in to constructor
-            if self.dim == 1:
-                self.anchoff = [0]
-            if self.dim == 2:
-                self.anchoff = [0, 0]
-            if self.dim == 3:
-                self.anchoff = [0, 0, 0]
-            if self.dim == 4:
-                self.anchoff = [0, 0, 0, 0]
+            self.anchoff = [0] * self.dim
 
         # Set up shift
         if self.shift is None:  # Nothing passed in to constructor
-            if self.dim == 1:
-                self.shift = [0]
-            if self.dim == 2:
-                self.shift = [0, 0]
-            if self.dim == 3:
-                self.shift = [0, 0, 0]
-            if self.dim == 4:
-                self.shift = [0, 0, 0, 0]
-
-        ################# RECTBOX  #######################
-        if type == "RectBox":
-            if len(self.sizes) != self.dim:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-
-            # Calculate box limits
-            lims = np.zeros((self.dim, 2), int)
-
-            for i in range(self.dim):
-                lims[i, 0] = -(self.sizes[0] / 2)
-                if self.sizes[0] % 2 == 0:
-                    lims[i, 1] = self.sizes[0] / 2
-                else:
-                    lims[i, 1] = (self.sizes[0] / 2) + 1
-
-            if self.dim == 1:
-                for i in range(lims[0, 0], lims[0, 1]):
-                    self.offsets.append([i])
-                if [0] in self.offsets:
-                    self.offsets.remove([0])  # might put back later
-
-            if self.dim == 2:
-                for i in range(lims[0, 0], lims[0, 1]):
-                    for j in range(lims[1, 0], lims[1, 1]):
-                        self.offsets.append([i, j])
-                if [0, 0] in self.offsets:
-                    self.offsets.remove([0, 0])  # might put back later
-
-            if self.dim == 3:
-                for i in range(lims[0, 0], lims[0, 1]):
-                    for j in range(lims[1, 0], lims[1, 1]):
-                        for k in range(lims[2, 0], lims[2, 1]):
-                            self.offsets.append([i, j, k])
-                if [0, 0, 0] in self.offsets:
-                    self.offsets.remove([0, 0, 0])  # might put back later
-            if self.dim == 4:
-                for i in range(lims[0, 0], lims[0, 1]):
-                    for j in range(lims[1, 0], lims[1, 1]):
-                        for k in range(lims[2, 0], lims[2, 1]):
-                            for t in range(lims[3, 0], lims[3, 1]):
-                                self.offsets.append([i, j, k, t])
-                if [0, 0, 0, 0] in self.offsets:
-                    self.offsets.remove([0, 0, 0, 0])  # might put back later
-
-        ################# RECTSHELL  #######################
-        elif type == "RectShell":
-
-            if len(self.sizes) != self.dim:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-
-            if self.dim == 1:
-                sub = self.sizes[0] / 2
-                for i in range(self.sizes[0]):
-                    if (i == 0 or i == self.sizes[0] - 1):
-                        self.offsets.append([i - sub])
-            if self.dim == 2:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        if (i == 0 or i == self.sizes[0] - 1 or j == 0 or j == self.sizes[1] - 1):
-                            self.offsets.append([i - sub0, j - sub1])
-
-            if self.dim == 3:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                sub2 = self.sizes[2] / 2
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        for k in range(self.sizes[2]):
-                            if (i == 0 or i == self.sizes[0] - 1 or j == 0 or j == self.sizes[1] - 1 or k == 0 or k ==
-                                    self.sizes[2] - 1):
-                                self.offsets.append([i - sub0, j - sub1, k - sub2])
-
-            if self.dim == 4:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                sub2 = self.sizes[2] / 2
-                sub3 = self.sizes[3] / 2
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        for k in range(self.sizes[2]):
-                            for t in range(self.sizes[3]):
-                                if (i == 0 or i == self.sizes[0] - 1 or j == 0 or j == self.sizes[1] - 1 or
-                                        k == 0 or k == self.sizes[2] - 1 or t == 0 or t == self.sizes[3] - 1):
-                                    self.offsets.append([i - sub0, j - sub1, k - sub2, t - sub3])
-
-        ################# ELLIPSOID  #######################
-        elif type == "Ellipsoid":
-
-            if len(self.sizes) != self.dim:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-                # sys.exit(-1)
-
-            if self.dim == 1:  # same as 1D rectangular box
-                sub = self.sizes[0] / 2
-                for i in range(self.sizes[0]):
-                    self.offsets.append([i - sub])
-            if self.dim == 2:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                s02 = self.sizes[0] * self.sizes[0]
-                s12 = self.sizes[1] * self.sizes[1]
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        bounder = ((i - sub0) * (i - sub0)) / s02 + ((j - sub1) * (j - sub1)) / s12
-                        if (bounder <= 1.0):
-                            self.offsets.append([i - sub0, j - sub1])
-            if self.dim == 3:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                sub2 = self.sizes[2] / 2
-                s02 = self.sizes[0] * self.sizes[0]
-                s12 = self.sizes[1] * self.sizes[1]
-                s22 = self.sizes[2] * self.sizes[2]
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        for k in range(self.sizes[2]):
-                            bounder = ((i - sub0) * (i - sub0)) / s02 + ((j - sub1) * (j - sub1)) / s12 + (
-                                                                                                          (k - sub2) * (
-                                                                                                          k - sub2)) / s22
-                            if (bounder <= 1.0):
-                                self.offsets.append([i - sub0, j - sub1, k - sub2])
-
-            if self.dim == 4:
-                print
-                "Sorry 4D ellipsoids not yet implemented"
-                # sys.exit(-1)
-
-        ################# ELLIPSOIDSHELL  #######################
-        elif type == "EllipsoidShell":
-
-            if len(self.sizes) != self.dim:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-                # sys.exit(-1)
-
-            if self.dim == 1:  # Same as 1D rectangular shell
-                sub = self.sizes[0] / 2
-                for i in range(self.sizes[0]):
-                    if (i == 0 or i == self.sizes[0] - 1):
-                        self.offsets.append([i - sub])
-
-            # FIX ME !!! - Haven't used or tested 2,3 dim ellipsoidal shells
-            if self.dim == 2:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                s02 = self.sizes[0] * self.sizes[0]
-                s12 = self.sizes[1] * self.sizes[1]
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        bounder = ((i - sub0) * (i - sub0)) / s02 + ((j - sub1) * (j - sub1)) / s12
-                        if (bounder > 0.9 and bounder < 1.1):  # Need to figure
-                            self.offsets.append([i - sub0, j - sub1])  # out these bounds
-            if self.dim == 3:
-                sub0 = self.sizes[0] / 2
-                sub1 = self.sizes[1] / 2
-                sub2 = self.sizes[2] / 2
-                s02 = self.sizes[0] * self.sizes[0]
-                s12 = self.sizes[1] * self.sizes[1]
-                s22 = self.sizes[2] * self.sizes[2]
-                for i in range(self.sizes[0]):
-                    for j in range(self.sizes[1]):
-                        for k in range(self.sizes[2]):
-                            bounder = ((i - sub0) * (i - sub0)) / s02 + ((j - sub1) * (j - sub1)) / s12 + (
-                                                                                                          (k - sub2) * (
-                                                                                                          k - sub2)) / s22
-                            if (bounder > 0.9 and bounder < 1.1):  # Need to figure
-                                self.offsets.append([i - sub0, j - sub1, k - sub2])  # out these bounds
-
-            if self.dim == 4:
-                print("Sorry 4D ellipsoidal shells not yet implemented")
-                # sys.exit(-1)
-
-        #################  LINE  #######################
-        elif type == "Line":
-
-            if len(self.sizes) != 1:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-
-            proto = np.sign(self.axbase)  # Generate axis (rely on dimension
-            # being correct re. above check)
-            for i in range(1, self.sizes[0] + 1):
-                self.offsets.append(list(i * proto))
-
-        ################  NOTCH  #######################
-        elif type == "Notch":
-
-            if len(self.sizes) != 1:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-
-            proto = list(np.sign(self.axbase))
-            if self.dim == 1:
-                print
-                "Sorry, no definition for 1 dimensional notches"
-                # sys.exit(-1)
-
-            if self.dim == 2:
-                # proto must be one of [1,0],[-1,0],[0,1],[0,-1]
-                # if not assume [1,0]
-                protoset = [[1, 0], [-1, 0], [0, 1], [0, -1]]
-                if proto not in protoset:
-                    proto = [1, 0]
-                if proto == [1, 0]:
-                    for i in range(self.sizes[0] + 1):
-                        for j in range(-self.sizes[0], self.sizes[0] + 1):
-                            if (i > 0 or j <= 0):
-                                self.offsets.append([i, j])
-                if proto == [-1, 0]:
-                    for i in range(-self.sizes[0], 1):
-                        for j in range(-self.sizes[0], self.sizes[0] + 1):
-                            if (i < 0 or j <= 0):
-                                self.offsets.append([i, j])
-                if proto == [0, 1]:
-                    for i in range(-self.sizes[0], self.sizes[0] + 1):
-                        for j in range(self.sizes[0] + 1):
-                            if (j > 0 or i >= 0):
-                                self.offsets.append([i, j])
-                if proto == [0, -1]:
-                    for i in range(-self.sizes[0], self.sizes[0] + 1):
-                        for j in range(-self.sizes[0], 1):
-                            if (j < 0 or i >= 0):
-                                self.offsets.append([i, j])
-
-            if self.dim == 3:
-                protoset = [[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]]
-                if proto not in protoset:
-                    proto = [1, 0, 0]
-                if proto == [1, 0, 0]:
-                    for i in range(self.sizes[0] + 1):
-                        for j in range(-self.sizes[0], self.sizes[0] + 1):
-                            for k in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (i > 0 or (i >= 0 and j > 0) or (j >= 0 and k > 0)):
-                                    self.offsets.append([i, j, k])
-
-                if proto == [-1, 0, 0]:
-                    for i in range(-self.sizes[0], self.sizes[0]):
-                        for j in range(-self.sizes[0], self.sizes[0] + 1):
-                            for k in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (i < 0 or (i <= 0 and j < 0) or (j <= 0 and k < 0)):
-                                    self.offsets.append([i, j, k])
-
-                if proto == [0, 1, 0]:
-                    for j in range(self.sizes[0] + 1):
-                        for k in range(-self.sizes[0], self.sizes[0] + 1):
-                            for i in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (j > 0 or (j >= 0 and i > 0) or (i >= 0 and k < 0)):
-                                    self.offsets.append([i, j, k])
-
-                if proto == [0, -1, 0]:
-                    for j in range(-self.sizes[0], self.sizes[0]):
-                        for k in range(-self.sizes[0], self.sizes[0] + 1):
-                            for i in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (j < 0 or (j <= 0 and i > 0) or (i >= 0 and k < 0)):
-                                    self.offsets.append([i, j, k])
-
-                if proto == [0, 0, 1]:
-                    for k in range(self.sizes[0] + 1):
-                        for i in range(-self.sizes[0], self.sizes[0] + 1):
-                            for j in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (k > 0 or (k >= 0 and j < 0) or (j <= 0 and i > 0)):
-                                    self.offsets.append([i, j, k])
-
-                if proto == [0, 0, -1]:
-                    for k in range(-self.sizes[0], self.sizes[0]):
-                        for i in range(-self.sizes[0], self.sizes[0] + 1):
-                            for j in range(-self.sizes[0], self.sizes[0] + 1):
-                                if (k < 0 or (k <= 0 and j > 0) or (j >= 0 and i < 0)):
-                                    self.offsets.append([i, j, k])
-
-            if self.dim == 4:
-                print
-                "Sorry 4D notches not yet implemented"
-                # sys.exit(-1)
-
-        #################  CONE #######################
-        elif type == "Cone":
-            # currently only cones along coordinate axis are supported
-
-            if len(self.sizes) != 1:
-                print(f"sizes array is of length {len(self.sizes)} but must be of length {self.dim} for type {type}")
-
-            proto = list(np.sign(self.axbase))
-
-            if self.dim == 1:
-                for i in range(self.sizes[0]):
-                    self.offsets.append([i])
-
-            if self.dim == 2:
-                protoset = [[1, 0], [-1, 0], [0, 1], [0, -1]]
-                if proto not in protoset:
-                    proto = [1, 0]
-                if proto == [1, 0]:
-                    for i in range(self.sizes[0]):
-                        for j in range(-i, i + 1):
-                            self.offsets.append([i, j])
-                if proto == [-1, 0]:
-                    for i in range(self.sizes[0]):
-                        for j in range(-i, i + 1):
-                            self.offsets.append([-i, j])
-                if proto == [0, 1]:
-                    for j in range(self.sizes[0]):
-                        for i in range(-j, j + 1):
-                            self.offsets.append([i, j])
-                if proto == [0, -1]:
-                    for j in range(self.sizes[0]):
-                        for i in range(-j, j + 1):
-                            self.offsets.append([i, -j])
-
-            if self.dim == 3:
-                protoset = [[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]]
-                if proto not in protoset:
-                    proto = [1, 0, 0]
-                if proto == [1, 0, 0]:
-                    for i in range(self.sizes[0]):
-                        for j in range(-i, i + 1):
-                            for k in range(-i, i + 1):
-                                self.offsets.append([i, j, k])
-                if proto == [-1, 0, 0]:
-                    for i in range(self.sizes[0]):
-                        for j in range(-i, i + 1):
-                            for k in range(-i, i + 1):
-                                self.offsets.append([-i, j, k])
-
-                if proto == [0, 1, 0]:
-                    for j in range(self.sizes[0]):
-                        for k in range(-j, j + 1):
-                            for i in range(-j, j + 1):
-                                self.offsets.append([i, j, k])
-
-                if proto == [0, -1, 0]:
-                    for j in range(self.sizes[0]):
-                        for k in range(-j, j + 1):
-                            for i in range(-j, j + 1):
-                                self.offsets.append([i, -j, k])
-
-                if proto == [0, 0, 1]:
-                    for k in range(self.sizes[0]):
-                        for i in range(-k, k + 1):
-                            for j in range(-k, k + 1):
-                                self.offsets.append([i, j, k])
-
-                if proto == [0, 0, -1]:
-                    for k in range(self.sizes[0]):
-                        for i in range(-k, k + 1):
-                            for j in range(-k, k + 1):
-                                self.offsets.append([i, j, -k])
-            if self.dim == 4:
-                # just do it in 4th dimension for now
-                protoset = [[0, 0, 0, 1], [0, 0, 0, -1]]
-                if proto not in protoset:
-                    proto = [0, 0, 0, 1]
-                if proto == [0, 0, 0, 1]:
-                    for t in range(self.sizes[0]):
-                        for i in range(-t, t + 1):
-                            for j in range(-t, t + 1):
-                                for k in range(-t, t + 1):
-                                    self.offsets.append([i, j, k, t])
-
-                if proto == [0, 0, 0, -1]:
-                    for t in range(self.sizes[0]):
-                        for i in range(-t, t + 1):
-                            for j in range(-t, t + 1):
-                                for k in range(-t, t + 1):
-                                    self.offsets.append([i, j, k, -t])
+            self.shift = [0] * self.dim
+
+        offsets, self.offarray = _build(self.type, tuple(self.sizes), self.dim, bool(inclusion),
+                                        tuple(self.handedness), tuple(self.axbase), tuple(self.anchoff),
+                                        tuple(self.shift))
+        self.offsets = offsets.tolist()
+
+
+@functools.lru_cache(maxsize=256)
+def _build(type, sizes, dim, inclusion, handedness, axbase, anchoff, shift):
+    """Builds the offsets of a template, memoised on the (hashable) template
+    parameters so repeated construction of identical templates is free.
+
+    Returns the (read only) offsets array as built and the offsets ready
+    for the co-occurrence kernels: truncated to int32 as the kernels have
+    always read them, deduplicated and sorted, C contiguous and read only.
+    """
+    # All generators below build an (n, dim) array of offsets from a
+    # grid and a mask and work for any dimension; where the original
+    # hand written 1-4D loops used a particular loop order it is kept
+    # so the offsets come out in the same order
+    offsets = None
+
+    if type in ("RectBox", "RectShell", "Ellipsoid", "EllipsoidShell"):
+        if len(sizes) != dim:
+            print(f"sizes array is of length {len(sizes)} but must be of length {dim} for type {type}")
+
+    if type in ("Line", "Notch", "Cone", "Sphere", "SphereShell", "Circle"):
+        if len(sizes) != 1:
+            print(f"sizes array is of length {len(sizes)} but must be of length {dim} for type {type}")
+
+    ################# RECTBOX  #######################
+    if type == "RectBox":
+        # box is a cube of side sizes[0] (the way it has always been built)
+        low = -(sizes[0] // 2)
+        up = sizes[0] // 2 + sizes[0] % 2
+        offsets = _grid([np.arange(low, up)] * dim)
+        offsets = _remove_first(offsets, np.zeros(dim))  # might put back later
+
+    ################# RECTSHELL  #######################
+    elif type == "RectShell":
+        inds = _grid([np.arange(sizes[i]) for i in range(dim)])
+        onface = np.zeros(len(inds), dtype=bool)
+        for i in range(dim):
+            onface |= (inds[:, i] == 0) | (inds[:, i] == sizes[i] - 1)
+        offsets = inds[onface] - np.asarray(sizes[:dim]) / 2
+
+    ################# ELLIPSOID  #######################
+    elif type == "Ellipsoid":
+        # in 1D same as 1D rectangular box
+        offsets, bounder = _ellipsoid(sizes, dim)
+        offsets = offsets[bounder <= 1.0]
+
+    ################# ELLIPSOIDSHELL  #######################
+    elif type == "EllipsoidShell":
+        offsets, bounder = _ellipsoid(sizes, dim)
+        if dim == 1:  # Same as 1D rectangular shell
+            offsets = offsets[[0, -1]] if sizes[0] > 1 else offsets
+        else:
+            # FIX ME !!! - Haven't used or tested 2,3,4 dim ellipsoidal shells
+            offsets = offsets[(bounder > 0.9) & (bounder < 1.1)]  # Need to figure out these bounds
+
+    #################  LINE  #######################
+    elif type == "Line":
+        proto = np.sign(axbase)  # Generate axis (rely on dimension
+        # being correct re. above check)
+        offsets = np.arange(1, sizes[0] + 1)[:, None] * proto
+
+    ################  NOTCH  #######################
+    elif type == "Notch":
+        if dim == 1:
+            print("Sorry, no definition for 1 dimensional notches")
+        else:
+            offsets = _notch(sizes[0], dim, list(np.sign(axbase)))
+
+    #################  CONE #######################
+    elif type == "Cone":
+        # currently only cones along coordinate axis are supported
+        if dim == 1:
+            offsets = np.arange(sizes[0])[:, None]
+        else:
+            offsets = _cone(sizes[0], dim, list(np.sign(axbase)))
+
+    ################# SPHERE #######################
+    elif type == "Sphere":
+        radius = sizes[0]
+        offsets = _grid([np.arange(-(radius - 1), radius)] * dim)
+        offsets = offsets[np.sum(offsets * offsets, axis=1) < radius * radius]
+
+    ################# SPHERESHELL #######################
+    elif type == "SphereShell":
+        if dim != 3:
+            print("Sorry, spherical shells are only defined in 3 dimensions")
+        else:
+            offsets = _unique_rows(_sphere_shell(sizes[0]))
 
+    ################# CIRCLE #######################
+    elif type == "Circle":
+        if dim != 2:
+            print("Sorry, circles are only defined in 2 dimensions")
         else:
-            print(f"Type {type} unknow")
-
-        for i in range(len(self.offsets)):
-            self.offsets[i] = list(np.array(self.offsets[i]) + np.array(self.shift))
-
-        # Add/Remove anchor point as requested
-        if inclusion and (self.anchoff not in self.offsets):
-            self.offsets.append(self.anchoff)
-        if (not inclusion) and (self.anchoff in self.offsets):
-            self.offsets.remove(self.anchoff)
-
-        # Apply handedness
-        tempoff = []
-        for off in self.offsets:
-            tempoff.append(list(np.array(off) * np.array(self.handedness)))
-        self.offsets = tempoff
+            offsets = _unique_rows(_bres_circle(sizes[0]))
+
+    ################# DIRECTIONS #######################
+    elif type == "Directions":
+        offsets = np.vstack([distance * _directions(dim) for distance in sizes])
+
+    else:
+        print(f"Type {type} unknow")
+
+    if offsets is None:
+        offsets = np.zeros((0, dim), dtype=int)
+
+    offsets = offsets + np.asarray(shift)
+
+    # Add/Remove anchor point as requested
+    if inclusion and not _contains(offsets, anchoff):
+        offsets = np.vstack((offsets, [anchoff]))
+    if not inclusion:
+        offsets = _remove_first(offsets, anchoff)
+
+    # Apply handedness
+    offsets = offsets * np.asarray(handedness)
+
+
+    offsets.flags.writeable = False
+    offarray = np.ascontiguousarray(_unique_rows(np.trunc(offsets).astype(np.int32)))
+    offarray.flags.writeable = False
+    return offsets, offarray
+
+
+def _grid(ranges, order=None):
+    """All points of the grid spanned by ranges (one 1D array per axis) as an
+    (n, dim) array, in the order of nested loops over the axes in order
+    (outermost first, default 0, 1, ...)"""
+    order = list(range(len(ranges))) if order is None else list(order)
+    mesh = np.meshgrid(*[ranges[a] for a in order], indexing='ij')
+    pts = np.empty((mesh[0].size, len(ranges)), dtype=np.result_type(*ranges))
+    for loop, axis in enumerate(order):
+        pts[:, axis] = np.ravel(mesh[loop])
+    return pts
+
+
+def _directions(dim):
+    """The (3**dim - 1)/2 unit steps to the neighbours of a voxel taken once
+    per direction, i.e. with their first nonzero component positive"""
+    steps = _grid([np.arange(-1, 2)] * dim)
+    first = steps[np.arange(len(steps)), np.argmax(steps != 0, axis=1)]
+    return steps[first > 0]
+
+
+def _contains(offsets, point):
+    """Whether point is one of the rows of offsets"""
+    return bool(np.any(np.all(offsets == np.asarray(point), axis=1)))
+
+
+def _remove_first(offsets, point):
+    """offsets without the first row equal to point (if any)"""
+    found = np.flatnonzero(np.all(offsets == np.asarray(point), axis=1))
+    if found.size:
+        offsets = np.delete(offsets, found[0], axis=0)
+    return offsets
+
+
+def _ellipsoid(sizes, dim):
+    """Grid of (float) offsets centred on the ellipsoid and the ellipsoid
+    'bounder' value sum((x/size)**2) at each of them"""
+    offsets = _grid([np.arange(sizes[i]) for i in range(dim)]) - np.asarray(sizes[:dim]) / 2
+    bounder = np.zeros(len(offsets))
+    for i in range(dim):  # sum in axis order as the loops did
+        bounder += (offsets[:, i] * offsets[:, i]) / (sizes[i] * sizes[i])
+    return offsets, bounder
+
+
+# Notch axis ranges in multiples of the notch size s: 0..s, -s..0, -s..s
+# and -s..s-1 (the latter as the negative 3D notches have always been built)
+_RANGES = {
+    '+': lambda s: np.arange(0, s + 1),
+    '-': lambda s: np.arange(-s, 1),
+    '*': lambda s: np.arange(-s, s + 1),
+    '<': lambda s: np.arange(-s, s),
+}
+
+# Hand built 2 and 3 dimensional notches: axis direction -> (loop order,
+# axis ranges, membership test)
+_NOTCHES = {
+    (1, 0): ((0, 1), '+*', lambda i, j: (i > 0) | (j <= 0)),
+    (-1, 0): ((0, 1), '-*', lambda i, j: (i < 0) | (j <= 0)),
+    (0, 1): ((0, 1), '*+', lambda i, j: (j > 0) | (i >= 0)),
+    (0, -1): ((0, 1), '*-', lambda i, j: (j < 0) | (i >= 0)),
+    (1, 0, 0): ((0, 1, 2), '+**', lambda i, j, k: (i > 0) | ((i >= 0) & (j > 0)) | ((j >= 0) & (k > 0))),
+    (-1, 0, 0): ((0, 1, 2), '<**', lambda i, j, k: (i < 0) | ((i <= 0) & (j < 0)) | ((j <= 0) & (k < 0))),
+    (0, 1, 0): ((1, 2, 0), '*+*', lambda i, j, k: (j > 0) | ((j >= 0) & (i > 0)) | ((i >= 0) & (k < 0))),
+    (0, -1, 0): ((1, 2, 0), '*<*', lambda i, j, k: (j < 0) | ((j <= 0) & (i > 0)) | ((i >= 0) & (k < 0))),
+    (0, 0, 1): ((2, 0, 1), '**+', lambda i, j, k: (k > 0) | ((k >= 0) & (j < 0)) | ((j <= 0) & (i > 0))),
+    (0, 0, -1): ((2, 0, 1), '**<', lambda i, j, k: (k < 0) | ((k <= 0) & (j > 0)) | ((j >= 0) & (i < 0))),
+}
+
+
+def _cardinal(proto):
+    """Axis and sign of proto if it is a cardinal direction, otherwise
+    the positive direction of the first axis"""
+    nonzero = np.flatnonzero(proto)
+    if len(nonzero) == 1 and abs(proto[nonzero[0]]) == 1:
+        return int(nonzero[0]), int(proto[nonzero[0]])
+    return 0, 1
+
+
+def _notch(size, dim, proto):
+    """Notch offsets of the given size along (cardinal) direction proto"""
+    if dim in (2, 3):
+        # proto must be one of the cardinal directions, if not assume [1,0,..]
+        key = tuple(int(p) for p in proto)
+        if key not in _NOTCHES:
+            key = tuple([1] + [0] * (dim - 1))
+        order, lims, test = _NOTCHES[key]
+        pts = _grid([_RANGES[lim](size) for lim in lims], order)
+        return pts[test(*pts.T)]
+
+    # Higher dimensions: half space on the side of the notch axis plus,
+    # within the bounding hyperplane, the points whose first nonzero
+    # coordinate (going through the remaining axes cyclically) is positive
+    axis, sign = _cardinal(proto)
+    order = [(axis + k) % dim for k in range(dim)]
+    ranges = [_RANGES['*'](size)] * dim
+    ranges[axis] = _RANGES['+' if sign > 0 else '-'](size)
+    pts = _grid(ranges, order)
+    keep = sign * pts[:, axis] > 0
+    undecided = pts[:, axis] == 0
+    for a in order[1:]:
+        keep |= undecided & (pts[:, a] > 0)
+        undecided &= pts[:, a] == 0
+    return pts[keep]
+
+
+def _cone(size, dim, proto):
+    """Cone offsets of the given size along (cardinal) direction proto,
+    the cone opening at 45 degrees from its apex at the origin"""
+    axis, sign = _cardinal(proto)
+    if dim == 4 and axis != 3:
+        # just do it in 4th dimension for now
+        axis, sign = 3, 1
+    # loops go along the cone axis first then cyclically through the others
+    order = [(axis + k) % dim for k in range(dim)]
+    ranges = [np.arange(-(size - 1), size)] * dim
+    ranges[axis] = np.arange(size)
+    pts = _grid(ranges, order)
+    others = np.delete(pts, axis, axis=1)
+    pts = pts[np.all(np.abs(others) <= pts[:, [axis]], axis=1)]
+    pts[:, axis] *= sign
+    return pts
@@ -2,8 +2,156 @@
 
 """
 
+import hashlib
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
+from . import profiling, shared
+
+MEASURES = ['CM Entropy',
+            'EM Entropy',
+            'Statistical Complexity',
+            'Energy Uniformity',
+            'Maximum Probability',
+            'Contrast',
+            'Inverse Difference Moment',
+            'Correlation',
+            'Probability of Run Length',
+            'Epsilon Machine Run Length',
+            'Run Length Asymmetry',
+            'Homogeneity',
+            'Cluster Tendency',
+            'Multifractal Spectrum Energy Range',
+            'Multifractal Spectrum Entropy Range',
+            'Sum Average',
+            'Sum Variance',
+            'Sum Entropy',
+            'Difference Variance',
+            'Difference Entropy',
+            'Information Measure of Correlation 1',
+            'Information Measure of Correlation 2']
+
+# measures calculated together from the sum and difference marginals
+# (see _sumdiff_measures) -> Texmeas attribute
+_SUMDIFF_MEASURES = OrderedDict([('Sum Average', 'sav'),
+                                 ('Sum Variance', 'sva'),
+                                 ('Sum Entropy', 'sen'),
+                                 ('Difference Variance', 'dva'),
+                                 ('Difference Entropy', 'den'),
+                                 ('Information Measure of Correlation 1', 'imc1'),
+                                 ('Information Measure of Correlation 2', 'imc2')])
+
+# cached measure values depending on each Texmeas parameter
+_EM_DEPENDENTS = ['eme', 'stc', 'erl', 'mfu', 'mfs']
+_PARAM_DEPENDENTS = {'coordmom': ['con', 'idm'],
+                     'probmom': ['con', 'idm'],
+                     'rllen': ['prl', 'erl', 'rla'],
+                     'clusmom': ['clt'],
+                     'clusp': _EM_DEPENDENTS,
+                     'samelev': _EM_DEPENDENTS,
+                     'betas': ['mfu', 'mfs']}
+
+# number of epsilon machine states from which the stationary distribution
+# falls back on a sparse eigen solver rather than a full decomposition
+_EIGS_MIN = 256
+
+# measures that batch_measures can calculate (no epsilon machine needed)
+BATCH_MEASURES = ['CM Entropy',
+                  'Energy Uniformity',
+                  'Maximum Probability',
+                  'Contrast',
+                  'Inverse Difference Moment',
+                  'Correlation',
+                  'Probability of Run Length',
+                  'Run Length Asymmetry',
+                  'Homogeneity',
+                  'Cluster Tendency'] + list(_SUMDIFF_MEASURES)
+
+
+class EMCache:
+    """Class emcache, least recently used cache of epsilon machine estimates
+
+    Texmeas instances look their epsilon machine (and the stationary
+    distribution and multifractal spectrum derived from it) up here before
+    estimating it, so windows or patches giving the same co-occurrence counts
+    only estimate it once. Entries are keyed on a hash of the normalized
+    co-occurrence matrix, its total count and the parameters the estimate
+    depends on (clusp, samelev and, for spectra, betas). Cached arrays are
+    read only.
+
+    Parameters
+    ----------
+
+    maxsize: int
+        Maximum number of entries kept, 0 disables the cache (default = 128)
+
+
+    Attributes
+    ----------
+
+    hits: int
+        Number of lookups answered from the cache
+
+    misses: int
+        Number of lookups that weren't
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the entry stored under key (None if there isn't one)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """Stores the dict entry under key, making its arrays read only, and returns it"""
+        for val in entry.values():
+            if isinstance(val, np.ndarray):
+                val.flags.writeable = False
+        with self._lock:
+            if self.maxsize > 0:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def resize(self, maxsize):
+        """Changes the maximum number of entries, dropping the oldest ones if needed"""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Empties the cache and resets the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Cache statistics as a dict (hits, misses, size, maxsize)"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+# epsilon machine cache shared by all Texmeas instances
+em_cache = EMCache()
+
 
 class Texmeas:
     """Class texmeas for generating texture measures from co-occurrence matrix
@@ -14,7 +162,7 @@ class Texmeas:
     comat: ndarray
         Non-normalized co-occurrence matrix - chi-squared conditional distribution
         comparisons require the actual number of counts so don't normalize this before
-        sending in
+        sending in (can be a gentex.shared.SharedArray handle)
 
     measure: string
         Texture measure (default = 'Statistical Complexity'). Choice of:
@@ -34,6 +182,13 @@ class Texmeas:
             * 'Cluster Tendency'
             * 'Multifractal Spectrum Energy Range'
             * 'Multifractal Spectrum Entropy Range'
+            * 'Sum Average'
+            * 'Sum Variance'
+            * 'Sum Entropy'
+            * 'Difference Variance'
+            * 'Difference Entropy'
+            * 'Information Measure of Correlation 1'
+            * 'Information Measure of Correlation 2'
 
     coordmo: int
         Moment of coordinate differences in co-occurrence matrix
@@ -113,8 +268,8 @@ class Texmeas:
     def __init__(self, comat, measure="Statistical Complexity", coordmom=0, probmom=0, rllen=0, clusmom=0, clusp=0.001,
                  samelev=True, betas=[-20, 20, 40]):
 
-        self.comat = comat
-        self.totcount = np.sum(comat)  # to get back histo after norm
+        self.comat = shared.asarray(comat)
+        self.totcount = np.sum(self.comat)  # to get back histo after norm
         self.measure = measure
         self.coordmom = coordmom
         self.probmom = probmom
@@ -166,6 +321,21 @@ class Texmeas:
         self.clt = np.nan  # Cluster Tendency
         self.mfu = np.nan  # Multifractal max,min energy diff.
         self.mfs = np.nan  # Multifractal max,min entropy diff.
+        self.sav = np.nan  # Sum Average
+        self.sva = np.nan  # Sum Variance
+        self.sen = np.nan  # Sum Entropy
+        self.dva = np.nan  # Difference Variance
+        self.den = np.nan  # Difference Entropy
+        self.imc1 = np.nan  # Information Measure of Correlation 1
+        self.imc2 = np.nan  # Information Measure of Correlation 2
+
+        # shared intermediates (see _grids, _marginals, _sumdiff, _nodep)
+        self._cgrids = None
+        self._cmargs = None
+        self._csumdiff = None
+        self._emnodep = None
+        self._ementry = {}  # em_cache entry of the epsilon machine
+        self._params = {}  # parameters the cached measures were calculated with
 
         # initial empty array for the multifractal spectrum
         # with size equla to the number of steps specified in self.betas
@@ -182,6 +352,7 @@ class Texmeas:
         # Calculate an initial texture measure
         self.calc_measure(self.measure)
 
+    @profiling.profiled('texmeas.calc_measure')
     def calc_measure(self, measure='Statistical Complexity', coordmom=0, probmom=0, rllen=0, clusmom=0, samelev=True):
         """Calculates the appropriate texture measure and puts the value in the class variable val and
         updates the class variable currval with the passed string
@@ -211,6 +382,13 @@ class Texmeas:
                  - 'Cluster Tendency'
                  - 'Multifractal Spectrum Energy Range'
                  - 'Multifractal Spectrum Entropy Range'
+                 - 'Sum Average'
+                 - 'Sum Variance'
+                 - 'Sum Entropy'
+                 - 'Difference Variance'
+                 - 'Difference Entropy'
+                 - 'Information Measure of Correlation 1'
+                 - 'Information Measure of Correlation 2'
 
         """
 
@@ -228,6 +406,7 @@ class Texmeas:
             self.clusmom = clusmom
         if samelev == False:
             self.samelev = False
+        self._check_params()
 
         if self.measure == "CM Entropy":
             if np.isnan(self.cme):
@@ -239,47 +418,19 @@ class Texmeas:
 
         elif self.measure == "EM Entropy":
             if np.isnan(self.eme):
-                import scipy.linalg as L
-
                 if not self.emest:
                     self.est_em()
-                # get left eigenvector associated with lambda = 1
-                # (largest eignevalue)
-                [e, v] = L.eig(np.nan_to_num(self.emmat), left=True, right=False)
-                # Node probabilities are elements of normalized left eigenvector
-                # associated with eigenvale 1 (assumes Scipy convention of
-                # returning sorted eignevalues so eignevalue 1 in this case is
-                # the first element of the returned eigenvalue array)
-                # nodep = v[:,0]/sum(v[:,0])
-                # ---- no longer make the above assumption
-                # found it was wrong - now specifically ask for eigenvector
-                # associated with eigenvalue 1 (greatest real part)
-                maxind = np.where(np.real(e) == np.max(np.real(e)))[0][0]
-                nodep = v[:, maxind] / sum(v[:, maxind])
-                self.eme = -np.sum(
-                    np.transpose(nodep * np.ones(self.emmat.shape)) * (self.emmat * np.nan_to_num(np.log2(self.emmat))))
+                self.eme = _metric_entropy(self.emmat, self._nodep())
 
             self.val = self.eme
             self.currval = "EM Entropy"
 
         elif self.measure == "Statistical Complexity":
             if np.isnan(self.stc):
-                import scipy.linalg as L
                 # estimate epsilon machine if it hasn't been made
                 if not self.emest:
                     self.est_em()
-                # get left eigenvector associated with lambda = 1
-                # (largest eignevalue)
-                [e, v] = L.eig(np.nan_to_num(self.emmat), left=True, right=False)
-                # Node probabilities are elements of normalized left eigenvector                # associated with eigenvale 1 (assumes Scipy convention of
-                # returning sorted eignevalues so eignevalue 1 in this case is
-                # the first element of the returned eigenvalue array)
-                # nodep = v[:,0]/sum(v[:,0])
-                # ---- no longer make the above assumption
-                # found it was wrong - now specifically ask for eigenvector
-                # associated with eigenvalue 1 (greatest real part)
-                maxind = np.where(np.real(e) == np.max(np.real(e)))[0][0]
-                nodep = v[:, maxind] / sum(v[:, maxind])
+                nodep = self._nodep()
                 self.stc = -np.sum(nodep * np.log2(nodep))
 
             self.val = self.stc
@@ -306,12 +457,7 @@ class Texmeas:
                     if self.probmom == 0:
                         print("Nonzero probability moment is required for calculating Contrast")
                 else:
-                    crows = np.zeros(self.comat.shape)
-                    ccols = np.zeros(self.comat.shape)
-                    for i in range(self.comat.shape[0]):
-                        crows[i, :] = i
-                        ccols[:, i] = i
-
+                    crows, ccols = self._grids()
                     self.con = np.sum((np.abs(crows - ccols) ** self.coordmom) * (self.comat ** self.probmom))
 
             self.val = self.con
@@ -325,11 +471,7 @@ class Texmeas:
                     if self.probmom == 0:
                         print("Nonzero probability moment is required for calculating Inverse Difference Moment")
                 else:
-                    crows = np.zeros(self.comat.shape)
-                    ccols = np.zeros(self.comat.shape)
-                    for i in range(self.comat.shape[0]):
-                        crows[i, :] = i
-                        ccols[:, i] = i
+                    crows, ccols = self._grids()
                     codiffs = np.abs(crows - ccols) ** self.coordmom
                     # Set minimum coordinate difference for which you allow
                     # probability to be calculated
@@ -344,13 +486,7 @@ class Texmeas:
 
         elif self.measure == "Correlation":
             if np.isnan(self.cor):
-                import scipy.stats as ss
-
-                crows = np.zeros(self.comat.shape)
-                ccols = np.zeros(self.comat.shape)
-                for i in range(self.comat.shape[0]):
-                    crows[i, :] = i + 1  # need to start at 1 for Correlation calcs.
-                    ccols[:, i] = i + 1
+                crows, ccols = self._grids(1)  # need to start at 1 for Correlation calcs.
                 rowmom = np.sum(crows * self.comat)
                 colmom = np.sum(ccols * self.comat)
                 comatvar = np.var(np.ravel(self.comat * crows))
@@ -363,14 +499,8 @@ class Texmeas:
                 if self.rllen == 0:
                     print("Nonzero run length is required for calculating Probability of Run Length")
                 else:
-                    colprobs = np.zeros(self.comat.shape[0])
-                    for i in range(self.comat.shape[0]):
-                        colprobs[i] = np.sum(self.comat[i, :])
-                    self.prl = 0.0
-                    for i in range(self.comat.shape[0]):
-                        if colprobs[i] != 0.0:
-                            self.prl += ((colprobs[i] - self.comat[i, i]) ** 2 * (
-                                    self.comat[i, i] ** (self.rllen - 1))) / (colprobs[i] ** self.rllen)
+                    colprobs, rowprobs = self._marginals()
+                    self.prl = _run_length(colprobs, np.diagonal(self.comat), self.rllen)
             self.val = self.prl
             self.currval = "Probability of Run Length"
 
@@ -381,13 +511,10 @@ class Texmeas:
                 else:
                     if not self.emest:
                         self.est_em()
-                    self.erl = 0.0
-                    colprobs = np.zeros(self.emmat.shape[0])
-                    for i in range(self.emmat.shape[0]):
-                        colprobs[i] = np.sum(self.emmat[i, :])
-                    for i in range(self.emmat.shape[0]):
-                        self.erl += ((colprobs[i] - self.emmat[i, i]) ** 2 * (self.emmat[i, i] ** (self.rllen - 1))) / (
-                                colprobs[i] ** self.rllen)
+                    emdiag = np.diagonal(self.emmat)
+                    colprobs = np.sum(self.emmat, axis=1)
+                    self.erl = np.sum(((colprobs - emdiag) ** 2 * (emdiag ** (self.rllen - 1))) / (
+                            colprobs ** self.rllen))
             self.val = self.erl
             self.currval = "Epsilon Machine Run Length"
 
@@ -396,31 +523,15 @@ class Texmeas:
                 if self.rllen == 0:
                     print("Nonzero run length is required for calculating Run Length Asymmetry")
                 else:
-                    colprobs = np.zeros(self.comat.shape[0])
-                    rowprobs = np.zeros(self.comat.shape[0])
-                    for i in range(self.comat.shape[0]):
-                        colprobs[i] = np.sum(self.comat[i, :])
-                        rowprobs[i] = np.sum(self.comat[:, i])
-                    colval = 0.0
-                    rowval = 0.0
-                    for i in range(self.comat.shape[0]):
-                        if colprobs[i] != 0.0:
-                            colval += ((colprobs[i] - self.comat[i, i]) ** 2 * (
-                                    self.comat[i, i] ** (self.rllen - 1))) / (colprobs[i] ** self.rllen)
-                        if rowprobs[i] != 0.0:
-                            rowval += ((rowprobs[i] - self.comat[i, i]) ** 2 * (
-                                    self.comat[i, i] ** (self.rllen - 1))) / (rowprobs[i] ** self.rllen)
-                    self.rla = np.abs(colval - rowval)
+                    colprobs, rowprobs = self._marginals()
+                    diag = np.diagonal(self.comat)
+                    self.rla = np.abs(_run_length(colprobs, diag, self.rllen) - _run_length(rowprobs, diag, self.rllen))
             self.val = self.rla
             self.currval = "Run Length Asymmetry"
 
         elif self.measure == "Homogeneity":
             if np.isnan(self.hom):
-                crows = np.zeros(self.comat.shape)
-                ccols = np.zeros(self.comat.shape)
-                for i in range(self.comat.shape[0]):
-                    crows[i, :] = i
-                    ccols[:, i] = i
+                crows, ccols = self._grids()
                 self.hom = np.sum((self.comat) / (1 + np.abs(crows - ccols)))
             self.val = self.hom
             self.currval = "Homogeneity"
@@ -430,11 +541,7 @@ class Texmeas:
                 if self.clusmom == 0:
                     print("Nonzero cluster moment is required for calculating Cluster Tendency")
                 else:
-                    crows = np.zeros(self.comat.shape)
-                    ccols = np.zeros(self.comat.shape)
-                    for i in range(self.comat.shape[0]):
-                        crows[i, :] = i + 1  # need to start at 1 for Correlation calcs.
-                        ccols[:, i] = i + 1
+                    crows, ccols = self._grids(1)  # need to start at 1 for Correlation calcs.
                     rowmom = np.sum(crows * self.comat)
                     colmom = np.sum(ccols * self.comat)
                     self.clt = np.sum(((crows + ccols - rowmom - colmom) ** self.clusmom) * self.comat)
@@ -465,14 +572,129 @@ class Texmeas:
             self.val = self.mfs
             self.currval = "Multifractal Spectrum Entropy Range"
 
+        elif self.measure in _SUMDIFF_MEASURES:
+            attr = _SUMDIFF_MEASURES[self.measure]
+            if np.isnan(getattr(self, attr)):
+                # the whole set comes from the same marginals
+                colprobs, rowprobs = self._marginals()
+                vals = _sumdiff_measures(self.comat[np.newaxis], *self._sumdiff(), colprobs[np.newaxis],
+                                         rowprobs[np.newaxis])
+                for meas, name in _SUMDIFF_MEASURES.items():
+                    setattr(self, name, vals[meas][0])
+            self.val = getattr(self, attr)
+            self.currval = self.measure
+
         else:
             "Sorry don't know about texture measure ", self.measure
 
-    def est_multi_frac_spec(self):
-        """TODO"""
-        import scipy.linalg as L
+    def calc_many(self, measures=None, **params):
+        """Calculates a set of texture measures in one go
+
+        The intermediates shared by the measures (coordinate grids, marginal
+        distributions, epsilon machine and its stationary distribution,
+        multifractal spectrum) are only computed once.
+
+        Parameters
+        ----------
+
+        measures: list of strings
+            Measures to calculate (see calc_measure, default = all of them)
+
+        params:
+            coordmom, probmom, rllen, clusmom, samelev as for calc_measure
 
-        self.mfsspec = []
+        Returns
+        -------
+
+        dict
+            measure name -> value (val and currval are left at the last measure)
+        """
+        if measures is None:
+            measures = MEASURES
+        vals = {}
+        for meas in measures:
+            self.calc_measure(meas, **params)
+            vals[meas] = self.val
+        return vals
+
+    def calc_all(self, **params):
+        """Calculates all texture measures (see calc_many)"""
+        return self.calc_many(MEASURES, **params)
+
+    def _grids(self, start=0):
+        """Row and column coordinate grids of the co-occurrence matrix
+        starting at start (0 or 1), computed once"""
+        if self._cgrids is None:
+            self._cgrids = np.indices(self.comat.shape, dtype=float)
+        crows, ccols = self._cgrids
+        if start:
+            return crows + start, ccols + start
+        return crows, ccols
+
+    def _marginals(self):
+        """Row sums ('colprobs') and column sums ('rowprobs') of the
+        co-occurrence matrix, computed once"""
+        if self._cmargs is None:
+            self._cmargs = (np.sum(self.comat, axis=1), np.sum(self.comat, axis=0))
+        return self._cmargs
+
+    def _check_params(self):
+        """Drops the cached measures (and epsilon machine or spectrum) calculated
+        with parameter values that have changed since"""
+        params = {'coordmom': self.coordmom, 'probmom': self.probmom, 'rllen': self.rllen, 'clusmom': self.clusmom,
+                  'clusp': self.clusp, 'samelev': self.samelev, 'betas': list(self.betas)}
+        for name, val in params.items():
+            if name in self._params and self._params[name] != val:
+                for attr in _PARAM_DEPENDENTS[name]:
+                    setattr(self, attr, np.nan)
+                if name in ['clusp', 'samelev']:
+                    self.emest = False
+                    self._emnodep = None
+                if name in ['clusp', 'samelev', 'betas']:
+                    self.mfsest = False
+        self._params = params
+
+    def _sumdiff(self):
+        """Sum (p_x+y) and difference (p_x-y) marginals of the co-occurrence
+        matrix, computed once"""
+        if self._csumdiff is None:
+            self._csumdiff = _sumdiff_marginals(self.comat[np.newaxis])
+        return self._csumdiff
+
+    def _nodep(self):
+        """Stationary node probabilities of the epsilon machine, computed
+        once per epsilon machine"""
+        if self._emnodep is None:
+            if 'nodep' not in self._ementry:
+                nodep = _stationary(self.emmat)
+                nodep.flags.writeable = False
+                self._ementry['nodep'] = nodep
+            self._emnodep = self._ementry['nodep']
+        return self._emnodep
+
+    def _em_key(self, *extra):
+        """Epsilon machine cache key of the (normalized) co-occurrence matrix
+        and the parameters in extra"""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(np.ascontiguousarray(self.comat, dtype=float).tobytes())
+        key.update(repr((self.comat.shape, float(self.totcount), self.clusp, self.samelev) + extra).encode())
+        return key.digest()
+
+    @profiling.profiled('texmeas.multifractal')
+    def est_multi_frac_spec(self, workers=1):
+        """Estimates the multifractal spectrum of the epsilon machine over the
+        range of 'inverse temperatures' in betas, putting the (energy, entropy)
+        pairs in mfsspec
+
+        The betafied machines of all the inverse temperatures are decomposed
+        together as stacks (see _multi_frac_spec).
+
+        Parameters
+        ----------
+
+        workers: int
+            Number of threads sharing the inverse temperatures (default = 1)
+        """
         if not self.emest:
             self.est_em()
             # print "Epsilon machine",self.emmat
@@ -481,59 +703,47 @@ class Texmeas:
                 "Only 1 step asked for re. calculating multifractal spectrum, using lower limit specified, i.e. betas[0]")
             step = 0
         else:
-            step = (np.float(self.betas[1]) - np.float(self.betas[0])) / (np.float(self.betas[2]) - 1)
-        for i in range(self.betas[2]):
-            if i == 0:  # in case self.betas[2] = 1 => step = 0
-                cb = np.float(self.betas[0])
+            step = (float(self.betas[1]) - float(self.betas[0])) / (float(self.betas[2]) - 1)
+        # in case self.betas[2] = 1 => step = 0
+        cbs = np.array([float(self.betas[0])] + [float(self.betas[0] + i * step) for i in range(1, self.betas[2])])
+
+        key = self._em_key('mfs', tuple(cbs))
+        entry = em_cache.get(key)
+        profiling.count(betas=cbs.size, cache_hits=int(entry is not None))
+        if entry is not None:
+            self.mfsspec = entry['mfsspec']
+            self.mfsest = True
+            return
+
+        # cb = 0 is skipped for now - need to re-figure out beta -> 0 limit
+        cbs = cbs[cbs != 0.0]
+        spec = np.zeros((cbs.size, 2), dtype=complex)
+        if np.any(cbs == 1.0):
+            # in this case just do standard metric entrop calc.
+            # ( e.g. see EM Entropy calculation)
+            # as both u and s(u) are equal to the metric entropy
+            # in this case
+            spec[cbs == 1.0] = _metric_entropy(self.emmat, self._nodep())
+        others = np.flatnonzero(cbs != 1.0)
+        if others.size:
+            if workers > 1 and others.size > 1:
+                from concurrent.futures import ThreadPoolExecutor
+
+                # the decompositions release the GIL
+                chunks = np.array_split(others, min(workers, others.size))
+                with ThreadPoolExecutor(len(chunks)) as pool:
+                    parts = pool.map(lambda chunk: _multi_frac_spec(self.emmat, cbs[chunk]), chunks)
+                    spec[others] = np.concatenate(list(parts))
             else:
-                cb = np.float(self.betas[0] + i * step)
-            if cb == 1.0:
-                # in this case just do standard metric entrop calc.
-                # ( e.g. see above EM Entropy calculation for comments)
-                # as both u and s(u) are equal to the metric entropy
-                # in this case
-                [e, v] = L.eig(np.nan_to_num(self.emmat), left=True, right=False)
-                maxind = np.where(np.real(e) == np.max(np.real(e)))[0][0]
-                nodep = v[:, maxind] / sum(v[:, maxind])
-                su = -np.sum(
-                    np.transpose(nodep * np.ones(self.emmat.shape)) * (self.emmat * np.nan_to_num(np.log2(self.emmat))))
-                self.mfsspec.append([su, su])
-                # print i,cb,su,su
-            elif cb == 0.0:
-                # skip it for now - need to re-figure out beta -> 0 limit
-                # need placeholder though
-                splat = 0
-            else:  # cb != 0,1
-                # get betafied epsilon machine
-                a = np.where(self.emmat > 0.0, np.exp(cb * np.log(self.emmat)), 0.0)
-                # get maximum eignvalue and take the log
-                # ("inv. temp." times "free energy")
-                [eb, vb] = L.eig(np.nan_to_num(a), left=False, right=True)
-                maxind = np.where(np.real(eb) == np.max(np.real(eb)))[0][0]
-                fe = np.log2(np.real(eb[maxind]))
-                # stochastisize betafied epsilon machine
-                b = np.dot((1 / eb[maxind]) * np.diag((1 / vb[:, maxind])), np.dot(a, (np.diag(vb[:, maxind]))))
-                # get metric entropy of stochasticized machine
-                # - same as "entropy" s(u) as func. of "energy" u
-                # - i.e. multifractal spectrum is analogue of
-                # - thermodynamic spectrum s(u) vs. u
-                [e, v] = L.eig(np.nan_to_num(b), left=True, right=False)
-                maxind = np.where(np.real(e) == np.max(np.real(e)))[0][0]
-                nodep = v[:, maxind] / sum(v[:, maxind])
-                # make sure they're real - sometimes linalg spits
-                # out complex values with 0 imaginary part
-                su = abs(-np.sum(np.transpose(nodep * np.ones(b.shape)) * (b * np.nan_to_num(np.log2(b)))))
-                # then get energy - i.e. "temperature" normalized
-                # difference between "entropy" and "free energy"
-                u = abs((su - fe) / cb)
-                self.mfsspec.append([u, su])
-                # print i,cb,u,su
-
-        self.mfsspec = np.array(np.real(self.mfsspec))
+                spec[others] = _multi_frac_spec(self.emmat, cbs[others])
+
+        self.mfsspec = np.real(spec)
         # waste the nan's - e.g. when the range wasn't quite right
         self.mfsspec = np.delete(self.mfsspec, np.where(np.isnan(self.mfsspec))[0], 0)
+        em_cache.put(key, {'mfsspec': self.mfsspec})
         self.mfsest = True
 
+    @profiling.profiled('texmeas.est_em')
     def est_em(self):
         """Estimate an epsilon machine from a co-occurrence matrix with #rows = #cols, done implicitly whenever one
         of the related complexity/entropy measures (EM Entropy, Statistical Complexity, Epsilon Machine Run Length)
@@ -556,101 +766,404 @@ class Texmeas:
             - C. R. Shalizi and J. P. Crutchfield, 'Computational Mechanics: Pattern and Prediction, Structure and \
             Simplicity', Journal of Statistical Physics 104 (2001) 819--881.
         """
-        import scipy.stats as ss
+        key = self._em_key()
+        self._ementry = em_cache.get(key)
+        profiling.count(levels=self.comat.shape[0], cache_hits=int(self._ementry is not None))
+        if self._ementry is not None:
+            for attr in ['condo', 'emclasses', 'emclus', 'emmat']:
+                setattr(self, attr, self._ementry[attr])
+            self._emnodep = None
+            self.emest = True
+            return
 
         # Make conditional distribution matrix, i.e. epsilon machine
         # (row probabilities)
         self.condo = np.transpose(np.transpose(self.comat) / np.sum(self.comat, axis=1))
-        # the following is n^2 - need to figure a better way
-        found = []
-        self.emclasses = np.zeros(self.condo.shape[0], int)
-        onclass = 0
-        for i in range(self.condo.shape[0]):
-            if i not in found:
-                found.append(i)
-                # if it's dinky just tack it on to class 0
-                # code below will just combine it in
-                if np.sum(self.condo[i, :]) < 0.00000001:
-                    self.emclasses[i] = 0
-                else:
-                    # it's a new one
-                    self.emclasses[i] = onclass
-                    for j in range(i + 1, self.condo.shape[0]):
-                        if j not in found:
-                            # check if rows ("distributions") are "close"
-                            # i.e. p value in chi squred test < self.clusp
-                            tester = ss.chisquare(self.totcount * self.condo[i, :], self.totcount * self.condo[j, :])[1]
-                            if tester < self.clusp:  # they're different
-                                found.append(j)
-                                onclass += 1
-                                self.emclasses[j] = onclass
-                            else:  # they're not
-                                found.append(j)
-                                self.emclasses[j] = onclass
-
-        self.emclus = onclass + 1
-
-        for i in range(self.emclus):
-            rowinds = tuple(np.where(self.emclasses == i)[0])
-            if i == 0:
-                a = np.add.reduce(self.comat[rowinds, :], axis=0)
-            else:
-                a = np.vstack((a, np.add.reduce(self.comat[rowinds, :], axis=0)))
+        self.emclasses = _em_classes(self.condo, self.totcount, self.clusp)
+        self.emclus = int(np.max(self.emclasses)) + 1
+
+        # one-hot class membership of the rows
+        members = np.zeros((self.condo.shape[0], self.emclus))
+        members[np.arange(self.condo.shape[0]), self.emclasses] = 1.0
+        if self.emclus == 1:
+            a = np.sum(self.comat, axis=0)
+        else:
+            a = np.dot(members.T, self.comat)
         # If initial/final states are the same need to also combine columns
         if self.samelev:
             if len(a.shape) > 1:
-                for i in range(self.emclus):
-                    colinds = tuple(np.where(self.emclasses == i)[0])
-                    # seems like it has to be done rowise first...
-                    if i == 0:
-                        b = np.add.reduce(a[:, colinds], axis=1)
-                    else:
-                        b = np.vstack((b, np.add.reduce(a[:, colinds], axis=1)))
-                        # ... then transposed
+                self.emmat = np.dot(a, members)
             else:
-                for i in range(a.shape[0]):
-                    if i == 0:
-                        b = a
-                    else:
-                        b = np.vstack([b, a])
-            self.emmat = np.transpose(b)
+                # a single class: every row of the machine is the
+                # (column) class sum
+                self.emmat = np.transpose(np.tile(a, (a.shape[0], 1)))
         else:  # do it all over again for columns
-            found = []
-            self.emclasses = np.zeros(self.condo.shape[1], int)
-            onclass = 0
-            for i in range(self.condo.shape[1]):
-                if i not in found:
-                    found.append(i)
-                    # if it's dinky just tack it on to class 0
-                    # code below will just combine it in
-                    if np.sum(self.condo[:, i]) < 0.00000001:
-                        self.emclasses[i] = 0
-                    else:
-                        # it's a new one
-                        self.emclasses[i] = onclass
-                        for j in range(self.condo.shape[1], i + 1):
-                            if j not in found:
-                                # check if rows ("distributions") are "close"
-                                # i.e. p value in chi squred test < self.clusp
-                                tester = \
-                                    ss.chisquare(self.totcount * self.condo[:, i], self.totcount * self.condo[:, j])[1]
-                                if tester < self.clusp:  # they're different
-                                    found.append(j)
-                                    onclass += 1
-                                    self.emclasses[j] = onclass
-                                else:  # they're not
-                                    found.append(j)
-                                    self.emclasses[j] = onclass
-
-            self.emclus = onclass + 1
-
-            for i in range(self.emclus):
-                colinds = tuple(np.where(self.emclasses == i)[1])
-                if i == 0:
-                    a = np.add.reduce(self.comat[:, colinds], axis=1)
-                else:
-                    a = np.vstack((a, np.add.reduce(self.comat[:, colinds], axis=1)))
-            self.emmat = np.transpose(a)
-            # and finally turned into a Markov matrix...
+            self.emclasses = _em_classes(np.transpose(self.condo), self.totcount, self.clusp)
+            self.emclus = int(np.max(self.emclasses)) + 1
+            colmembers = np.zeros((self.condo.shape[1], self.emclus))
+            colmembers[np.arange(self.condo.shape[1]), self.emclasses] = 1.0
+            # row classes by column classes
+            self.emmat = np.dot(np.dot(members.T, self.comat), colmembers)
+        # and finally turned into a Markov matrix...
         self.emmat = np.transpose(np.transpose(self.emmat) / np.sum(self.emmat, axis=1))
+        self._ementry = em_cache.put(key, {'condo': self.condo, 'emclasses': self.emclasses, 'emclus': self.emclus,
+                                           'emmat': self.emmat})
+        self._emnodep = None
         self.emest = True
+
+
+def measures(comat, names=None, params=None):
+    """Calculates texture measures of a co-occurrence matrix
+
+    Functional counterpart of Texmeas: nothing is kept between calls apart
+    from the (locked) epsilon machine cache, em_cache, so it can be called
+    from any number of threads at once.
+
+    Parameters
+    ----------
+
+    comat: ndarray
+        Non-normalized co-occurrence matrix (see Texmeas, or a
+        gentex.shared.SharedArray handle)
+
+    names: list of strings
+        Measures to calculate (default = MEASURES)
+
+    params: dict
+        Texture measure parameters (coordmom, probmom, rllen, clusmom, clusp,
+        samelev, betas) as for Texmeas (default = Texmeas defaults)
+
+    Returns
+    -------
+
+    dict
+        measure name -> value
+    """
+    names = MEASURES if names is None else list(names)
+    params = {} if params is None else dict(params)
+    if not names:
+        return {}
+    tex = Texmeas(np.array(shared.asarray(comat)), measure=names[0], **params)
+    return tex.calc_many(names)
+
+
+@profiling.profiled('texmeas.batch')
+def batch_measures(comats, measures=None, coordmom=0, probmom=0, rllen=0, clusmom=0, chunksize=4096):
+    """Calculates texture measures for a stack of co-occurrence matrices
+
+    Vectorized version of Texmeas.calc_measure for the measures that don't
+    need an epsilon machine (see BATCH_MEASURES), giving the same values as
+    one Texmeas instance per matrix without building any.
+
+    Parameters
+    ----------
+
+    comats: ndarray
+        N x L x L stack of (non-normalized) co-occurrence matrices, e.g. as
+        returned by comat.comat_family; each matrix is normalized separately
+        (all zero matrices give nan); can be a gentex.shared.SharedArray handle
+
+    measures: list of strings
+        Measures to calculate (default = BATCH_MEASURES)
+
+    coordmom, probmom, rllen, clusmom:
+        Texture measure parameters as for Texmeas (default=0)
+
+    chunksize: int
+        Number of matrices processed at a time, which bounds the size of the
+        temporary N x L x L arrays (default = 4096)
+
+    Returns
+    -------
+
+    dict
+        measure name -> length N array of values
+    """
+    comats = np.asarray(shared.asarray(comats))
+    assert comats.ndim == 3 and comats.shape[1] == comats.shape[2], \
+        "co-occurrence matrices must be passed as an N x L x L array"
+    if measures is None:
+        measures = BATCH_MEASURES
+    for meas in measures:
+        assert meas in BATCH_MEASURES, "Sorry don't know about batch texture measure " + meas
+
+    needs = {'Contrast': (coordmom, probmom), 'Inverse Difference Moment': (coordmom, probmom),
+             'Probability of Run Length': (rllen,), 'Run Length Asymmetry': (rllen,),
+             'Cluster Tendency': (clusmom,)}
+    for meas in measures:
+        if 0 in needs.get(meas, ()):
+            print("Nonzero moments/run length are required for calculating " + meas)
+
+    n = comats.shape[0]
+    out = {meas: np.full(n, np.nan) for meas in measures}
+    profiling.count(matrices=n, bytes=n * len(measures) * 8)
+
+    crows, ccols = np.indices(comats.shape[1:], dtype=float)
+    codiffs = np.abs(crows - ccols)
+    if coordmom != 0:
+        # Set minimum coordinate difference for which you allow
+        # probability to be calculated (see Inverse Difference Moment)
+        codiff_eps = 0.0000001
+        with np.errstate(divide='ignore'):
+            comoms = codiffs ** coordmom
+        idmweights = np.where(comoms > codiff_eps, 1.0 / np.where(comoms > codiff_eps, comoms, 1.0), 0.0)
+    # need to start at 1 for Correlation calcs.
+    crows1, ccols1 = crows + 1, ccols + 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, n, chunksize):
+            sl = slice(start, start + chunksize)
+            p = np.asarray(comats[sl], dtype=float)
+            p = p / np.sum(p, axis=(1, 2))[:, np.newaxis, np.newaxis]
+
+            if 'CM Entropy' in out:
+                out['CM Entropy'][sl] = -np.sum(np.where(p > 0.0, p * np.log2(np.where(p > 0.0, p, 1.0)), 0.0),
+                                                axis=(1, 2))
+            if 'Energy Uniformity' in out:
+                out['Energy Uniformity'][sl] = np.einsum('nij,nij->n', p, p)
+            if 'Maximum Probability' in out:
+                out['Maximum Probability'][sl] = np.max(p, axis=(1, 2))
+            if coordmom != 0 and probmom != 0:
+                pmom = p ** probmom
+                if 'Contrast' in out:
+                    out['Contrast'][sl] = np.einsum('nij,ij->n', pmom, comoms)
+                if 'Inverse Difference Moment' in out:
+                    out['Inverse Difference Moment'][sl] = np.einsum('nij,ij->n', pmom, idmweights)
+            if 'Homogeneity' in out:
+                out['Homogeneity'][sl] = np.einsum('nij,ij->n', p, 1.0 / (1.0 + codiffs))
+            if 'Correlation' in out or ('Cluster Tendency' in out and clusmom != 0):
+                rowmom = np.einsum('nij,ij->n', p, crows1)[:, np.newaxis, np.newaxis]
+                colmom = np.einsum('nij,ij->n', p, ccols1)[:, np.newaxis, np.newaxis]
+                if 'Correlation' in out:
+                    comatvar = np.var((p * crows1).reshape(p.shape[0], -1), axis=1)
+                    out['Correlation'][sl] = np.sum((crows1 - rowmom) * (ccols1 - colmom) * p, axis=(1, 2)) / comatvar
+                if 'Cluster Tendency' in out and clusmom != 0:
+                    out['Cluster Tendency'][sl] = np.sum(((crows1 + ccols1 - rowmom - colmom) ** clusmom) * p,
+                                                         axis=(1, 2))
+            if rllen != 0 and ('Probability of Run Length' in out or 'Run Length Asymmetry' in out):
+                diag = np.diagonal(p, axis1=1, axis2=2)
+                colrl = _run_length(np.sum(p, axis=2), diag, rllen)
+                if 'Probability of Run Length' in out:
+                    out['Probability of Run Length'][sl] = colrl
+                if 'Run Length Asymmetry' in out:
+                    out['Run Length Asymmetry'][sl] = np.abs(colrl - _run_length(np.sum(p, axis=1), diag, rllen))
+            if any(meas in out for meas in _SUMDIFF_MEASURES):
+                vals = _sumdiff_measures(p, *_sumdiff_marginals(p), np.sum(p, axis=2), np.sum(p, axis=1))
+                for meas in _SUMDIFF_MEASURES:
+                    if meas in out:
+                        out[meas][sl] = vals[meas]
+    # all zero matrices have no distribution (the entropies would give -0.0)
+    empty = ~np.any(comats.reshape(n, -1), axis=1)
+    for vals in out.values():
+        vals[empty] = np.nan
+    return out
+
+
+def _sumdiff_marginals(p):
+    """Sum (p_x+y, indexed by i + j) and difference (p_x-y, indexed by |i - j|)
+    marginals of a stack of co-occurrence matrices p"""
+    n, rows, cols = p.shape
+    crows, ccols = np.indices((rows, cols))
+    nsum = rows + cols - 1
+    ndiff = max(rows, cols)
+    # one bincount over the whole stack, each matrix offset to its own bins
+    offsets = np.arange(n)[:, np.newaxis]
+    weights = p.reshape(n, -1)
+    psum = np.bincount((offsets * nsum + (crows + ccols).ravel()).ravel(), weights=weights.ravel(),
+                       minlength=n * nsum).reshape(n, nsum)
+    pdiff = np.bincount((offsets * ndiff + np.abs(crows - ccols).ravel()).ravel(), weights=weights.ravel(),
+                        minlength=n * ndiff).reshape(n, ndiff)
+    return psum, pdiff
+
+
+def _entropy(p, axis=-1):
+    """Entropy (bits) of the distributions in p along axis"""
+    return -np.sum(np.where(p > 0.0, p * np.log2(np.where(p > 0.0, p, 1.0)), 0.0), axis=axis)
+
+
+def _sumdiff_measures(p, psum, pdiff, colprobs, rowprobs):
+    """Haralick sum/difference and information measure of correlation texture
+    measures of a stack of normalized co-occurrence matrices p, given their
+    sum and difference marginals (see _sumdiff_marginals) and row and column
+    sums; returns a dict of measure name -> array
+
+    Grey levels start at 1 (so sums start at 2) and entropies are in bits,
+    hence IMC2 = sqrt(1 - 2**(-2 (HXY2 - HXY))).
+    """
+    sums = np.arange(2, psum.shape[1] + 2)
+    diffs = np.arange(pdiff.shape[1])
+    vals = {}
+    vals['Sum Average'] = np.dot(psum, sums)
+    vals['Sum Variance'] = np.sum((sums - vals['Sum Average'][:, np.newaxis]) ** 2 * psum, axis=1)
+    vals['Sum Entropy'] = _entropy(psum)
+    diffmean = np.dot(pdiff, diffs)
+    vals['Difference Variance'] = np.sum((diffs - diffmean[:, np.newaxis]) ** 2 * pdiff, axis=1)
+    vals['Difference Entropy'] = _entropy(pdiff)
+
+    hxy = _entropy(p.reshape(p.shape[0], -1))
+    hx = _entropy(colprobs)
+    hy = _entropy(rowprobs)
+    pxpy = colprobs[:, :, np.newaxis] * rowprobs[:, np.newaxis, :]
+    logpxpy = np.log2(np.where(pxpy > 0.0, pxpy, 1.0))
+    hxy1 = -np.sum(np.where(p > 0.0, p * logpxpy, 0.0), axis=(1, 2))
+    hxy2 = -np.sum(pxpy * logpxpy, axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals['Information Measure of Correlation 1'] = (hxy - hxy1) / np.maximum(hx, hy)
+    vals['Information Measure of Correlation 2'] = np.sqrt(np.maximum(1.0 - 2.0 ** (-2.0 * (hxy2 - hxy)), 0.0))
+    return vals
+
+
+def _em_classes(condo, totcount, clusp):
+    """Epsilon machine class of each row of the conditional distribution
+    matrix condo
+
+    The first row that isn't dinky starts class 0 and every later row is
+    compared to it with a chi squared test: a p value below clusp starts a
+    new class, otherwise the row joins the current one. Dinky rows before it
+    go to class 0.
+    """
+    classes = np.zeros(condo.shape[0], int)
+    # if it's dinky just tack it on to class 0
+    # (rows of nan - no counts - aren't dinky)
+    ok = np.flatnonzero(~(np.sum(condo, axis=1) < 0.00000001))
+    if ok.size:
+        first = ok[0]
+        # check if rows ("distributions") are "close"
+        # i.e. p value in chi squred test < clusp
+        pvals = _chisquare_pvalues(totcount * condo[first], totcount * condo[first + 1:])
+        classes[first + 1:] = np.cumsum(pvals < clusp)
+    return classes
+
+
+def _chisquare_pvalues(obs, exps):
+    """Chi squared test p values of the observed frequencies obs against each
+    row of expected frequencies exps (as scipy.stats.chisquare)"""
+    import scipy.stats as ss
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = np.sum((obs - exps) ** 2 / exps, axis=-1)
+    return ss.chi2.sf(stats, obs.shape[-1] - 1)
+
+
+def _run_length(probs, diag, rllen):
+    """Probability of run length from the marginal probabilities and the
+    diagonal of the co-occurrence matrix (zero marginals skipped), along
+    the last axis"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = ((probs - diag) ** 2 * (diag ** (rllen - 1))) / (probs ** rllen)
+    return np.sum(np.where(probs != 0.0, terms, 0.0), axis=-1)
+
+
+@profiling.profiled('texmeas.stationary')
+def _stationary(mat, tol=1e-12, maxiter=2000):
+    """Node probabilities of a Markov matrix, i.e. the normalized left
+    eigenvector associated with eigenvalue 1
+
+    Found by power iteration on the lazy chain (mat + I) / 2, which has the
+    same stationary distribution but can't be periodic, starting from the
+    uniform distribution. If that doesn't settle (or mat isn't a proper
+    Markov matrix, e.g. rows of nan) large matrices go to a sparse solver
+    for the single eigenvector and the rest to a full eigen decomposition.
+    """
+    mat = np.nan_to_num(mat)
+    k = mat.shape[0]
+    if np.allclose(np.sum(mat, axis=1), 1.0):
+        lazy = 0.5 * (mat + np.eye(k))
+        nodep = np.full(k, 1.0 / k)
+        for it in range(maxiter):
+            prev = nodep
+            nodep = np.dot(nodep, lazy)
+            if np.sum(np.abs(nodep - prev)) < tol:
+                return nodep / np.sum(nodep)
+
+        if k >= _EIGS_MIN:
+            import scipy.sparse.linalg as SL
+
+            try:
+                e, v = SL.eigs(mat.T, k=1, which='LR', v0=nodep)
+                nodep = np.real(v[:, 0]) / np.real(np.sum(v[:, 0]))
+                if np.sum(np.abs(np.dot(nodep, mat) - nodep)) < k * tol:
+                    return nodep
+            except SL.ArpackError:
+                pass
+
+    import scipy.linalg as L
+
+    # get left eigenvector associated with lambda = 1
+    # (largest eignevalue)
+    [e, v] = L.eig(mat, left=True, right=False)
+    # Node probabilities are elements of normalized left eigenvector
+    # associated with eigenvale 1 (assumes Scipy convention of
+    # returning sorted eignevalues so eignevalue 1 in this case is
+    # the first element of the returned eigenvalue array)
+    # nodep = v[:,0]/sum(v[:,0])
+    # ---- no longer make the above assumption
+    # found it was wrong - now specifically ask for eigenvector
+    # associated with eigenvalue 1 (greatest real part)
+    maxind = np.where(np.real(e) == np.max(np.real(e)))[0][0]
+    return v[:, maxind] / sum(v[:, maxind])
+
+
+def _multi_frac_spec(emmat, cbs):
+    """(energy, entropy) points of the multifractal spectrum of the epsilon
+    machine emmat at the inverse temperatures cbs (none of them 0 or 1), as
+    an n x 2 array; the points of the betas that can't be worked out (e.g.
+    overflowing machines) are nan"""
+    cbs = np.asarray(cbs, dtype=float)[:, np.newaxis, np.newaxis]
+    # get betafied epsilon machines
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        a = np.where(emmat > 0.0, np.exp(cbs * np.log(emmat)), 0.0)
+    # only the betas whose machine overflows are lost, not the whole stack
+    bad = ~np.all(np.isfinite(a), axis=(1, 2))
+    a[bad] = 0.0
+    # get maximum eignvalues and take the log
+    # ("inv. temp." times "free energy")
+    eb, vb = _eig(a)
+    maxind = np.argmax(np.real(eb), axis=1)
+    rows = np.arange(cbs.shape[0])
+    lead = eb[rows, maxind]
+    vlead = vb[rows, :, maxind]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fe = np.log2(np.real(lead))
+    # stochastisize betafied epsilon machines, b = diag(1/v) a diag(v) / lambda
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b = (a / lead[:, np.newaxis, np.newaxis]) * (vlead[:, np.newaxis, :] / vlead[:, :, np.newaxis])
+    # get metric entropy of stochasticized machines (left eigenvectors)
+    # - same as "entropy" s(u) as func. of "energy" u
+    # - i.e. multifractal spectrum is analogue of
+    # - thermodynamic spectrum s(u) vs. u
+    e, v = _eig(np.swapaxes(np.nan_to_num(b), 1, 2))
+    maxind = np.argmax(np.real(e), axis=1)
+    nodep = v[rows, :, maxind]
+    nodep = nodep / np.sum(nodep, axis=1)[:, np.newaxis]
+    # make sure they're real - sometimes linalg spits
+    # out complex values with 0 imaginary part
+    with np.errstate(divide='ignore', invalid='ignore'):
+        su = np.abs(-np.sum(nodep[:, :, np.newaxis] * (b * np.nan_to_num(np.log2(b))), axis=(1, 2)))
+    # then get energy - i.e. "temperature" normalized
+    # difference between "entropy" and "free energy"
+    u = np.abs((su - fe) / cbs[:, 0, 0])
+    spec = np.stack([u, su], axis=1)
+    spec[bad] = np.nan
+    return spec
+
+
+def _eig(mats):
+    """np.linalg.eig of a stack of matrices, matrix by matrix if that fails
+    so that only the ones it fails for (left nan) are lost"""
+    try:
+        return np.linalg.eig(mats)
+    except np.linalg.LinAlgError:
+        e = np.full(mats.shape[:-1], np.nan, dtype=complex)
+        v = np.full(mats.shape, np.nan, dtype=complex)
+        for k in range(mats.shape[0]):
+            try:
+                e[k], v[k] = np.linalg.eig(mats[k])
+            except np.linalg.LinAlgError:
+                pass
+        return e, v
+
+
+def _metric_entropy(mat, nodep):
+    """Metric entropy of a Markov matrix given its node probabilities"""
+    return -np.sum(nodep[:, np.newaxis] * (mat * np.nan_to_num(np.log2(mat))))
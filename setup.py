@@ -55,7 +55,7 @@ setup(
     long_description_content_type='text/markdown',
     author='GenTex contributors',
     url='https://github.com/NPann/GenTex',
-    packages=find_packages(exclude=('tests')),
+    packages=find_packages(exclude=['benchmarks*', 'tests*']),
     classifiers=[
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3 :: Only',
@@ -71,6 +71,9 @@ setup(
         'scipy>=1.3',
     ],
     ext_modules=[comat],
+    entry_points={
+        'console_scripts': ['gentex = gentex.cli:main'],
+    },
     python_requires='>=3.7',
     cmdclass={
         'verify': VerifyVersionCommand,
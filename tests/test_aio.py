@@ -0,0 +1,52 @@
+import asyncio
+
+import gentex
+import numpy as np
+
+im = np.random.randint(0, 4, size=[24, 20])
+mask = np.ones([24, 20], dtype=int)
+box = gentex.template.Template("RectBox", [3, 3], 2, False).offsets
+
+
+def test_async_entry_points():
+    async def main():
+        cm = await gentex.aio.comat_mult(im, mask, box, levels=4)
+        vals = await gentex.aio.measures(cm, ['CM Entropy'])
+        return cm, vals
+
+    gentex.aio.configure(max_concurrency=2)
+    try:
+        cm, vals = asyncio.run(main())
+        assert np.array_equal(cm, gentex.comat.comat_mult(im, mask, box, levels=4))
+        assert vals == gentex.texmeas.measures(cm, ['CM Entropy'])
+    finally:
+        gentex.aio.shutdown()
+
+
+def test_roi_batcher_coalesces_requests(monkeypatch):
+    rois = [np.zeros([24, 20], dtype=int) for i in range(4)]
+    rois[0][:10] = 1
+    rois[1][10:] = 1
+    rois[2][5:15, 5:15] = 1  # overlaps both, needs a second kernel call
+    rois[3][:, :3] = 1
+
+    calls = []
+    comat_rois = gentex.comat.comat_rois
+
+    def counted(*args, **kwargs):
+        calls.append(args[4])
+        return comat_rois(*args, **kwargs)
+
+    monkeypatch.setattr(gentex.comat, 'comat_rois', counted)
+
+    async def main():
+        batcher = gentex.aio.ROIBatcher(im, box, levels=4, delay=0.05)
+        cancelled = asyncio.ensure_future(batcher.comat(rois[3]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await asyncio.gather(*[batcher.comat(roi) for roi in rois[:3]])
+
+    cms = asyncio.run(main())
+    assert sorted(calls) == [1, 2]
+    for cm, roi in zip(cms, rois):
+        assert np.array_equal(cm, gentex.comat.comat_mult(im, roi, box, levels=4))
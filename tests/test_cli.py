@@ -0,0 +1,94 @@
+import csv
+import json
+
+import gentex
+import imageio
+import numpy as np
+from pathlib import Path
+
+FIXTURE_DIR = Path(__file__).parents[0]/'fixtures'
+
+CONFIG = {'template': {'type': 'RectBox', 'sizes': [3, 3], 'dimension': 2, 'inclusion': False},
+          'numclus': 3,
+          'measures': ['CM Entropy', 'Contrast'],
+          'params': {'coordmom': 2, 'probmom': 1}}
+
+
+def _setup(tmp_path):
+    im = imageio.imread(FIXTURE_DIR/'test_image.png')[::8, ::8]
+    for i in range(3):
+        np.save(tmp_path/('im%d.npy' % i), np.roll(im, 3 * i, axis=0))
+    config = tmp_path/'config.json'
+    config.write_text(json.dumps(CONFIG))
+    return str(config), str(tmp_path/'im*.npy')
+
+
+def test_cli_csv_matches_pipeline_and_resumes(tmp_path):
+    config, images = _setup(tmp_path)
+    out = str(tmp_path/'out.csv')
+    np.random.seed(0)
+    assert gentex.cli.main([config, images, '-o', out, '-q']) == 0
+    with open(out, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['image', 'roi', 'rois', 'CM Entropy', 'Contrast']
+    assert len(rows) == 4
+
+    # same kmeans initialisation as the first image got
+    np.random.seed(0)
+    im = np.load(rows[1][0])
+    res = gentex.cli.make_pipeline(CONFIG).run([im], np.where(im != 0, 1, 0))['measures']
+    assert np.allclose([float(v) for v in rows[1][3:]], [res['CM Entropy'], res['Contrast']])
+
+    # crash in the middle of the last row: resuming only redoes that image
+    with open(out, 'w', newline='') as f:
+        f.write(''.join(','.join(row) + '\r\n' for row in rows[:3]) + rows[3][0] + ',0,1,1.')
+    gentex.cli.run(CONFIG, sorted(str(p) for p in tmp_path.glob('im*.npy')), output=out, resume=True,
+                   progress=None)
+    with open(out, newline='') as f:
+        resumed = list(csv.reader(f))
+    assert resumed[:3] == rows[:3]
+    assert len(resumed) == 4 and resumed[3][:2] == rows[3][:2]
+
+
+def _rois(tmp_path):
+    for i in range(3):
+        im = np.load(tmp_path/('im%d.npy' % i))
+        labels = np.zeros(im.shape, dtype=int)
+        labels[:, :im.shape[1] // 2] = 1
+        labels[:, im.shape[1] // 2:] = 2
+        np.save(tmp_path/('roi%d.npy' % i), np.where(im != 0, labels, 0))
+    return str(tmp_path/'roi*.npy')
+
+
+def test_cli_csv_resume_redoes_partly_written_image(tmp_path):
+    config, images = _setup(tmp_path)
+    masks = _rois(tmp_path)
+    out = str(tmp_path/'out.csv')
+    assert gentex.cli.main([config, images, '-m', masks, '--rois', '-o', out, '-q']) == 0
+    with open(out, newline='') as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == 7 and [row[1:3] for row in rows[1:]] == [['1', '2'], ['2', '2']] * 3
+
+    # killed after the first of the last image's two rows: both are redone
+    with open(out, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:6])
+    gentex.cli.run(CONFIG, sorted(str(p) for p in tmp_path.glob('im*.npy')),
+                   sorted(str(p) for p in tmp_path.glob('roi*.npy')), output=out, rois=True, resume=True,
+                   progress=None)
+    with open(out, newline='') as f:
+        resumed = list(csv.reader(f))
+    assert resumed[:5] == rows[:5]
+    assert [row[:3] for row in resumed[5:]] == [row[:3] for row in rows[5:]]
+
+
+def test_cli_npz_rois_on_workers(tmp_path):
+    config, images = _setup(tmp_path)
+    _rois(tmp_path)
+    out = str(tmp_path/'out.npz')
+    assert gentex.cli.main([config, images, '-m', str(tmp_path/'roi*.npy'), '--rois', '-j', '2',
+                            '-o', out, '-q']) == 0
+    with np.load(out) as data:
+        assert list(data['rois']) == [1, 2] * 3
+        assert list(data['measures']) == CONFIG['measures']
+        assert data['values'].shape == (6, 2)
+        assert data['images'][0].endswith('im0.npy')
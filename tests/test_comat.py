@@ -97,3 +97,93 @@ def test_cooccurrence_with_multiple_offsets_between_2_images():
     offset2 = [[0, 1], [1, 1]]
     cm = gentex.comat.comat_2T_mult(B, maskB, B, maskB, offset2, levels1=3, levels2=3)
     assert cm.shape == (3, 3)
+
+
+def test_cooccurrence_with_template_offset_array():
+    box = gentex.template.Template("RectBox", [3, 3, 3], 3, False)
+    cm = gentex.comat.comat_mult(C, maskC, box.offarray, levels=3)
+    assert np.array_equal(cm, gentex.comat.comat_mult(C, maskC, box.offsets, levels=3))
+
+
+def test_cooccurrence_direction_family():
+    dirs = gentex.template.Template("Directions", [1, 2], 3, False)
+    assert len(dirs.offsets) == 2 * 13
+    cms, cmavg = gentex.comat.comat_family(C, maskC, dirs.offsets, levels=3)
+    assert cms.shape == (26, 3, 3)
+    for off, cm in zip(dirs.offsets, cms):
+        assert np.array_equal(cm, gentex.comat.comat(C, maskC, off, levels=3))
+    assert np.allclose(cmavg, cms.mean(axis=0))
+    assert np.array_equal(cms.sum(axis=0), gentex.comat.comat_mult(C, maskC, dirs.offsets, levels=3))
+
+
+def test_cooccurrence_with_multiple_offsets_all_dims():
+    for im, mask in [(A, maskA), (B, maskB), (C, maskC), (D, maskD)]:
+        offsets = gentex.template.Template("RectBox", [3] * im.ndim, im.ndim, False).offsets
+        cm = gentex.comat.comat_mult(im, mask, offsets, levels=3)
+        expected = sum(gentex.comat.comat(im, mask, off, levels=3) for off in offsets)
+        assert np.array_equal(cm, expected)
+
+
+def test_measure_map_matches_per_voxel_comat():
+    box = gentex.template.Template("RectBox", [3, 3], 2, False).offsets
+    window = gentex.template.Template("RectBox", [3, 3], 2, True).offsets
+    names = list(gentex.comat.MAP_MEASURES)
+    params = dict(coordmom=2, probmom=1)
+    maskE = np.ones([10, 10], dtype=int)
+    maskE[0, :3] = 0
+    for win in [None, window]:
+        maps = gentex.comat.comat_measure_map(B, maskE, box, window=win, levels=3, measures=names, **params)
+        assert np.all(np.isnan(maps['CM Entropy'][maskE == 0]))
+        for x, y in [(0, 5), (4, 4), (9, 9)]:
+            # co-occurrences of the window voxels with the whole masked image
+            anchor = np.zeros([10, 10], dtype=int)
+            for w in ([[0, 0]] if win is None else win):
+                if 0 <= x + w[0] < 10 and 0 <= y + w[1] < 10:
+                    anchor[x + w[0], y + w[1]] = 1
+            cm = gentex.comat.comat_2T_mult(B, anchor * maskE, B, maskE, box, levels1=3, levels2=3)
+            ref = gentex.texmeas.measures(cm, names, params)
+            for meas in names:
+                assert np.isclose(maps[meas][x, y], ref[meas])
+
+
+def test_cooccurrence_within_memory_budget():
+    im = np.random.randint(0, 8, size=[40, 30, 20])
+    mask = (np.random.rand(40, 30, 20) > 0.2).astype(int)
+    offsets = np.array([[1, 0, 0], [-2, 1, 0], [0, 0, 1], [3, -1, 2]])
+    # too small for the int copies, so done in slabs along the first axis
+    assert np.array_equal(gentex.comat.comat_mult(im, mask, offsets, levels=8, budget=60000),
+                          gentex.comat.comat_mult(im, mask, offsets, levels=8))
+    with gentex.memory.budget(60000):
+        assert np.array_equal(gentex.comat.comat_family(im, mask, offsets, levels=8)[0],
+                              gentex.comat.comat_family(im, mask, offsets, levels=8, budget=10**9)[0])
+    try:
+        gentex.comat.comat_mult(im, mask, offsets, levels=8, budget=2000)
+        assert False
+    except gentex.memory.MemoryBudgetError:
+        pass
+
+
+def test_missing_library_raises_at_call_time(monkeypatch):
+    def fail(*args):
+        raise OSError('no such library')
+    monkeypatch.setattr(gentex.comat, '_comat', None)
+    monkeypatch.setattr(np.ctypeslib, 'load_library', fail)
+    try:
+        gentex.comat.comat(A, maskA, [1], levels=4)
+        assert False
+    except ImportError:
+        pass
+
+
+def test_cross_cooccurrence_of_all_pairs():
+    images = [np.random.randint(levels, size=[12, 10, 6]) for levels in (3, 5, 4)]
+    masks = [(np.random.rand(12, 10, 6) > 0.2).astype(int) for i in range(3)]
+    offsets = [[1, 0, 0], [0, 1, -1], [-2, 0, 1]]
+    pairs = gentex.comat.comat_cross(images, masks, offsets, levels=[3, 5, 4], asdict=True)
+    for (a, b), cm in pairs.items():
+        assert np.array_equal(cm, gentex.comat.comat_2T_mult(images[a], masks[a], images[b], masks[b], offsets,
+                                                             levels1=[3, 5, 4][a], levels2=[3, 5, 4][b]))
+    # one mask for all the images
+    cross = gentex.comat.comat_cross(images, masks[0], offsets, levels=5)
+    assert cross.shape == (3, 3, 5, 5)
+    assert np.array_equal(cross[2, 2], gentex.comat.comat_mult(images[2], masks[0], offsets, levels=5))
@@ -0,0 +1,54 @@
+import gentex
+import numpy as np
+
+im = np.random.randint(0, 4, size=[20, 16])
+mask = np.ones([20, 16])
+box = gentex.template.Template("RectBox", [3, 3], 2, False).offsets
+
+
+def test_diskcache_comat_and_features(tmp_path):
+    cache = gentex.diskcache.enable(tmp_path)
+    try:
+        cm = gentex.comat.comat_mult(im, mask, box, levels=4)
+        fam, mean = gentex.comat.comat_family(im, mask, box, levels=4)
+        fe = gentex.features.Features([im], mask, box)
+        assert cache.info()['files'] == 3 and cache.hits == 0
+
+        assert np.array_equal(gentex.comat.comat_mult(im, mask, box, levels=4), cm)
+        assert np.array_equal(gentex.comat.comat_family(im, mask, box, levels=4)[1], mean)
+        again = gentex.features.Features([im], mask, box)
+        assert cache.hits == 3
+        for attr in ['fs', 'fsc', 'fsscale', 'fsoffset', 'fsmask']:
+            assert np.array_equal(getattr(again, attr), getattr(fe, attr))
+        assert again.fs.dtype == fe.fs.dtype
+
+        # anything the result depends on gives a new entry
+        gentex.comat.comat_mult(im, mask, box, levels=5)
+        gentex.features.Features([im], mask, box, dtype=np.uint8)
+        assert cache.info()['files'] == 5 and cache.hits == 3
+    finally:
+        gentex.diskcache.disable()
+
+
+def test_diskcache_evicts_least_recently_used(tmp_path):
+    cache = gentex.diskcache.DiskCache(tmp_path, maxsize=3000)
+    for i in range(3):
+        cache.put(str(i) * 8, np.full(200, i, dtype=np.int32))
+    # 3 files of ~900 bytes fit, reading the first makes the second the oldest
+    assert cache.get('0' * 8) is not None
+    cache.put('3' * 8, np.zeros(200, dtype=np.int32))
+    assert cache.info()['size'] <= 3000
+    assert cache.get('1' * 8) is None
+    assert cache.get('0' * 8) is not None and cache.get('3' * 8) is not None
+
+
+def test_diskcache_rewrite_keeps_size(tmp_path):
+    cache = gentex.diskcache.DiskCache(tmp_path, maxsize=3000)
+    cache.put('a' * 8, np.zeros(200, dtype=np.int32))
+    cache.put('b' * 8, np.zeros(200, dtype=np.int32))
+    # rewriting an entry doesn't count its bytes twice, so nothing is evicted
+    for i in range(5):
+        cache.put('a' * 8, np.full(200, i, dtype=np.int32))
+    assert cache._size == cache.info()['size']
+    assert cache.info()['files'] == 2
+    assert cache.get('b' * 8) is not None and cache.get('a' * 8)[0] == 4
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import gentex
+
+# 2D dummy data
+B = np.random.rand(12, 10)
+maskB = np.ones([12, 10])
+maskB[0, :] = 0
+
+box_indices = gentex.template.Template("RectBox", [3, 3], 2, False).offsets
+
+
+def test_features_anchor_indices():
+    fe = gentex.features.Features([B], maskB, box_indices)
+    assert fe.fsc.ndim == 1
+    assert fe.fsc.dtype == np.int32
+    assert fe.fs.shape == (len(fe.fsc), len(box_indices))
+    coords = fe.fscoords()
+    assert len(coords) == 2
+    # Every feature space point must hold the image values around its anchor
+    for p in [0, len(fe.fsc) // 2, len(fe.fsc) - 1]:
+        x, y = coords[0][p], coords[1][p]
+        assert np.allclose(fe.fs[p], [B[x + o[0], y + o[1]] for o in box_indices])
+    assert np.array_equal(np.flatnonzero(fe.fsmask), np.sort(fe.fsc))
+
+
+def test_features_template_larger_than_image():
+    # no anchor point fits: an empty feature space rather than an error
+    offsets = gentex.template.Template("RectBox", [5, 5], 2, False).offsets
+    fe = gentex.features.Features([np.random.rand(2, 10)], np.ones((2, 10)), offsets)
+    assert fe.fsc.size == 0
+    assert fe.fs.shape == (0, len(offsets))
+    assert not fe.fsmask.any()
+
+
+def test_features_long_axis():
+    # Coordinates along axes longer than 32767 used to overflow int16
+    A = np.random.rand(40000)
+    fe = gentex.features.Features([A], np.ones(40000), [[-1], [1]])
+    assert fe.fscoords()[0].max() == 39998
+    fe.clusfs(numclus=2)
+    assert fe.clusim[0] == 0 and fe.clusim[-1] == 0
+    assert set(np.unique(fe.clusim[fe.fscoords()])) <= {0, 1}
+
+
+def test_features_compact_dtypes():
+    im = np.random.randint(0, 256, size=[12, 10])
+    ref = gentex.features.Features([im, B], maskB, box_indices)
+    for dtype in [np.float16, np.uint8, np.uint16]:
+        fe = gentex.features.Features([im, B], maskB, box_indices, dtype=dtype)
+        assert fe.fs.dtype == dtype
+        assert np.array_equal(fe.fsc, ref.fsc)
+        # 8-bit image columns fit exactly, float image columns are quantized
+        n = len(box_indices)
+        assert np.array_equal(fe.fsvalues()[:, :n], ref.fs[:, :n])
+        assert np.allclose(fe.fsvalues()[:, n:], ref.fs[:, n:], atol=fe.fsscale.max())
+        fe.clusfs(numclus=3)
+        assert set(np.unique(fe.clusim[fe.fscoords()])) <= {0, 1, 2}
+
+
+def test_features_memory_budget(monkeypatch):
+    ref = gentex.features.Features([B], maskB, box_indices)
+    # anchors found two rows at a time
+    monkeypatch.setattr(gentex.features, '_ANCHOR_BLOCK', 16)
+    need = ref.fs.nbytes + ref.fsc.nbytes
+    with pytest.warns(UserWarning, match='float16'):
+        fe = gentex.features.Features([B], maskB, box_indices, budget=need)
+    assert fe.dtype == np.float16
+    assert np.array_equal(fe.fsc, ref.fsc)
+    assert np.allclose(fe.fsvalues(), ref.fs, atol=1e-2)
+    try:
+        gentex.features.Features([B], maskB, box_indices, budget=64)
+        assert False
+    except gentex.memory.MemoryBudgetError:
+        pass
+    # the parse map and anchors count against the budget before the feature space
+    region = ref.dims[0] * ref.dims[1]
+    for budget in [region, 2 * region]:
+        try:
+            gentex.features.Features([B], maskB, box_indices, budget=budget)
+            assert False
+        except gentex.memory.MemoryBudgetError:
+            pass
@@ -0,0 +1,45 @@
+import gentex
+import numpy as np
+import imageio
+import tracemalloc
+from pathlib import Path
+
+FIXTURE_DIR = Path(__file__).parents[0]/'fixtures'
+
+
+def test_pipeline_matches_chained_stages():
+    im = imageio.imread(FIXTURE_DIR/'test_image.png')[::4, ::4]
+    mask = np.where(im > 0, 1, 0)
+    box = gentex.template.Template("RectBox", [3, 3], 2, False)
+    measures = ['CM Entropy', 'Energy Uniformity', 'Contrast']
+
+    pipe = gentex.pipeline.Pipeline(box, numclus=4, measures=measures, params={'coordmom': 2, 'probmom': 1},
+                                    keep=True, trackmem=True)
+    res = pipe.run([im], mask)
+    assert set(res['timing']) == {'features', 'clustering', 'comat', 'texmeas'}
+    assert set(res['memory']) == set(res['timing'])
+
+    # Same thing stage by stage from the returned labels
+    fe = res['features']
+    cm = gentex.comat.comat_mult(res['clusim'], fe.fsmask, box.offsets, levels=4)
+    assert np.array_equal(cm, res['comat'])
+    tex = gentex.texmeas.Texmeas(cm, coordmom=2, probmom=1)
+    for meas in measures:
+        tex.calc_measure(meas)
+        assert np.isclose(res['measures'][meas], tex.val)
+
+    # Buffers are reused on the next run without touching returned results
+    labels = res['clusim'].copy()
+    pipe.run([im], mask)
+    assert np.array_equal(labels, res['clusim'])
+
+
+def test_pipeline_trackmem_without_reset_peak(monkeypatch):
+    # tracemalloc.reset_peak is new in Python 3.9
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    im = imageio.imread(FIXTURE_DIR/'test_image.png')[::8, ::8]
+    box = gentex.template.Template("RectBox", [3, 3], 2, False)
+    res = gentex.pipeline.Pipeline(box, numclus=3, trackmem=True).run([im], np.where(im > 0, 1, 0))
+    assert set(res['memory']) == {'features', 'clustering', 'comat', 'texmeas'}
+    assert min(res['memory'].values()) >= 0
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import gentex
+
+# 2D dummy data
+B = np.random.rand(12, 10)
+maskB = np.ones([12, 10])
+maskB[0, :] = 0
+
+box_indices = gentex.template.Template("RectBox", [3, 3], 2, False).offsets
+
+
+def test_profile_stages():
+    with gentex.profiling.Profile() as prof:
+        fe = gentex.features.Features([B], maskB, box_indices)
+        fe.clusfs(numclus=3)
+        cm = gentex.comat.comat_mult(fe.clusim, fe.fsmask, box_indices, levels=3)
+        gentex.texmeas.Texmeas(cm, measure='EM Entropy')
+    stats = prof.to_dict()
+    assert stats['features.build']['calls'] == 1
+    assert stats['features.build']['voxels'] == len(fe.fsc)
+    assert stats['features.build']['masked'] == B.size - len(fe.fsc)
+    assert stats['features.clusfs']['clusters'] == 3
+    assert stats['comat.kernel']['offsets'] == len(box_indices)
+    assert stats['comat.kernel']['voxels'] == len(fe.fsc)
+    assert stats['comat.prepare']['bytes'] > 0
+    assert stats['texmeas.est_em']['levels'] == 3
+    assert all(stage['time'] >= 0 for stage in stats.values())
+    assert json.loads(prof.to_json()) == stats
+
+    # nothing is recorded once the profile is stopped
+    gentex.comat.comat_mult(fe.clusim, fe.fsmask, box_indices, levels=3)
+    assert prof.to_dict() == stats
+    assert not gentex.profiling.enabled()
+    assert not gentex.profiling.stage('comat.kernel')
+
+
+def test_profile_rois_counts_every_label():
+    image = np.random.randint(0, 4, size=[12, 10])
+    labels = np.zeros([12, 10], dtype=int)
+    labels[2:6] = 1
+    labels[6:11] = 2
+    with gentex.profiling.Profile() as prof:
+        gentex.comat.comat_rois(image, labels, box_indices, levels=4)
+    stats = prof.to_dict()
+    assert stats['comat.prepare']['masked'] == labels.size - 90
+    assert stats['comat.kernel']['voxels'] == 90
+
+
+def test_profile_callbacks():
+    seen = []
+
+    def callback(name, record):
+        seen.append((name, record))
+
+    gentex.profiling.add_callback(callback)
+    try:
+        gentex.comat.comat(np.zeros([5, 5], dtype=int), np.ones([5, 5]), [1, 0], levels=2)
+    finally:
+        gentex.profiling.remove_callback(callback)
+    assert [name for name, record in seen] == ['comat.prepare', 'comat.kernel']
+    assert seen[1][1]['voxels'] == 25
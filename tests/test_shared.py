@@ -0,0 +1,49 @@
+import functools
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import gentex
+import numpy as np
+
+im = np.random.randint(0, 4, size=[20, 16, 12])
+mask = (np.random.rand(20, 16, 12) > 0.1).astype(int)
+offsets = [[[1, 0, 0]], [[0, 1, 0]], [[0, 0, 1], [1, 1, 1]]]
+
+
+def test_shared_array_is_zero_copy():
+    with gentex.shared.share(im) as handle:
+        clone = pickle.loads(pickle.dumps(handle))
+        assert len(pickle.dumps(handle)) < 200
+        view = clone.asarray()
+        assert np.array_equal(view, im)
+        handle.asarray()[0, 0, 0] = 7
+        assert view[0, 0, 0] == 7
+
+
+def test_shared_entry_points_in_workers():
+    with gentex.shared.share(im) as him, gentex.shared.share(mask) as hmask:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            cms = list(pool.map(functools.partial(gentex.comat.comat_mult, him, hmask, levels=4), offsets))
+        for cm, coordset in zip(cms, offsets):
+            assert np.array_equal(cm, gentex.comat.comat_mult(im, mask, coordset, levels=4))
+
+        fe = gentex.features.Features([him], hmask, offsets[2], share=True)
+        ref = gentex.features.Features([im], mask, offsets[2])
+        assert np.array_equal(fe.fshandle.asarray(), ref.fs)
+        fe.fshandle.unlink()
+
+    with gentex.shared.share(np.stack(cms)) as hcms:
+        assert np.allclose(gentex.texmeas.batch_measures(hcms)['CM Entropy'],
+                           gentex.texmeas.batch_measures(np.stack(cms))['CM Entropy'])
+        assert gentex.texmeas.measures(hcms.asarray()[0], ['CM Entropy']) == \
+            gentex.texmeas.measures(cms[0], ['CM Entropy'])
+
+
+def test_shared_view_outlives_handle():
+    with gentex.shared.share(im) as handle:
+        view = handle.asarray()[2:]
+    # unlinked and closed here, the view keeps the segment mapped
+    assert gentex.shared._attached.get(handle.name) is None
+    assert np.array_equal(view, im[2:])
+    view[...] = 0
+    assert not view.any()
@@ -1 +1,30 @@
-#TODO
\ No newline at end of file
+import numpy as np
+import gentex
+
+
+def test_bres_circle():
+    circ = gentex.sphere.bres_circle(0, 0, 3)
+    assert all(abs(np.hypot(x, y) - 3) < 0.75 for x, y in circ)
+    assert len(gentex.sphere.rem_dup(circ)) == len(circ)
+
+
+def test_rem_dup():
+    assert gentex.sphere.rem_dup([[1, 0], [0, 1], [1, 0], [0, 0]]) == [[0, 0], [0, 1], [1, 0]]
+    assert gentex.sphere.rem_dup([3, 1, 3]) == [1, 3]
+
+
+def test_sphere_templates():
+    r = 4
+    ball = gentex.template.Template("Sphere", [r], 3, True).offsets
+    assert sorted(ball) == sorted(gentex.sphere.sphere(0, 0, 0, r))
+
+    shell = gentex.template.Template("SphereShell", [r], 3, False)
+    expected = gentex.sphere.rem_dup(gentex.sphere.sphere_shell(0, 0, 0, r))
+    assert shell.offsets == expected
+    assert np.array_equal(shell.offarray, expected)
+
+    circle = gentex.template.Template("Circle", [r], 2, False).offsets
+    assert circle == gentex.sphere.rem_dup(gentex.sphere.bres_circle(0, 0, r))
+
+    disc = gentex.template.Template("Sphere", [2], 2, False).offsets
+    assert disc == [[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]]
@@ -1 +1,65 @@
-#TODO
\ No newline at end of file
+import numpy as np
+import gentex
+
+Template = gentex.template.Template
+
+
+def test_rectbox():
+    box = Template("RectBox", [3, 3], 2, False).offsets
+    assert box == [[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]]
+    box = Template("RectBox", [3, 3], 2, True).offsets
+    assert box[-1] == [0, 0] and len(box) == 9
+
+
+def test_rectshell():
+    shell = Template("RectShell", [3, 4, 5], 3, False).offsets
+    assert len(shell) == 3 * 4 * 5 - 1 * 2 * 3
+    assert shell[0] == [-1.5, -2.0, -2.5]
+
+
+def test_line_and_handedness():
+    line = Template("Line", [3], 2, False, axbase=[0, 5], handedness=[1, -1]).offsets
+    assert line == [[0, -1], [0, -2], [0, -3]]
+
+
+def test_cone():
+    cone = Template("Cone", [3], 2, False, axbase=[0, -1]).offsets
+    assert cone == [[-1, -1], [0, -1], [1, -1], [-2, -2], [-1, -2], [0, -2], [1, -2], [2, -2]]
+    cone4 = Template("Cone", [3], 4, False).offsets
+    assert len(cone4) == 1 + 27 + 125 - 1
+    assert all(off[3] >= 0 for off in cone4)
+
+
+def test_notch():
+    notch = Template("Notch", [1], 2, False).offsets
+    assert notch == [[0, -1], [1, -1], [1, 0], [1, 1]]
+    notch3 = np.array(Template("Notch", [2], 3, False).offsets)
+    assert len(notch3) == (5 ** 3 - 1) // 2
+
+
+def test_4d_notch_is_half_neighbourhood():
+    for axbase in [[1, 0, 0, 0], [0, 0, -1, 0]]:
+        notch = {tuple(off) for off in Template("Notch", [1], 4, False, axbase=axbase).offsets}
+        assert len(notch) == (3 ** 4 - 1) // 2
+        assert all(tuple(-np.array(off)) not in notch for off in notch)
+
+
+def test_4d_ellipsoid():
+    ell = Template("Ellipsoid", [2, 2, 2, 2], 4, False).offsets
+    assert len(ell) == 2 ** 4 - 1
+    assert [-1.0, -1.0, -1.0, -1.0] in ell
+
+
+def test_offarray():
+    ell = Template("Ellipsoid", [3, 3], 2, False)
+    arr = ell.offarray
+    assert arr.dtype == np.int32 and arr.flags.c_contiguous and not arr.flags.writeable
+    # the float offsets are truncated as the kernels read them, duplicates removed
+    expected = np.unique(np.trunc(np.array(ell.offsets)).astype(np.int32), axis=0)
+    assert np.array_equal(arr, expected)
+    assert len(arr) < len(ell.offsets)
+    # identical parameters are memoised, offsets stay private to each instance
+    other = Template("Ellipsoid", [3, 3], 2, False)
+    assert other.offarray is arr
+    other.offsets.append([9, 9])
+    assert [9, 9] not in Template("Ellipsoid", [3, 3], 2, False).offsets
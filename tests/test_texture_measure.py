@@ -104,3 +104,193 @@ def test_texture_measure_voxel_wise():
 
         # restore mask
         mask1[a, b] = 0
+
+
+def test_texture_measure_calc_all():
+    comat = np.random.RandomState(33).randint(1, 50, size=[5, 5])
+    params = dict(coordmom=2, probmom=2, rllen=0.1, clusmom=2)
+    vals = gentex.texmeas.Texmeas(comat, **params).calc_all()
+    assert list(vals) == gentex.texmeas.MEASURES
+
+    # Same values as one measure per call on a fresh instance
+    for meas in ['EM Entropy', 'Correlation', 'Run Length Asymmetry', 'Cluster Tendency']:
+        mytex = gentex.texmeas.Texmeas(comat, **params)
+        mytex.calc_measure(meas)
+        assert np.isclose(mytex.val, vals[meas])
+
+    sub = gentex.texmeas.Texmeas(comat, **params).calc_many(['Contrast', 'Homogeneity'])
+    assert sub == {'Contrast': vals['Contrast'], 'Homogeneity': vals['Homogeneity']}
+
+
+def test_texture_measure_batch():
+    comats = np.random.randint(1, 50, size=[20, 5, 5])
+    params = dict(coordmom=2, probmom=2, rllen=0.1, clusmom=2)
+    # small chunks to go through the chunking
+    vals = gentex.texmeas.batch_measures(comats, chunksize=6, **params)
+    assert set(vals) == set(gentex.texmeas.BATCH_MEASURES)
+    for k in [0, 7, 19]:
+        ref = gentex.texmeas.Texmeas(comats[k], **params).calc_many(gentex.texmeas.BATCH_MEASURES)
+        for meas in gentex.texmeas.BATCH_MEASURES:
+            assert vals[meas].shape == (20,)
+            assert np.isclose(vals[meas][k], ref[meas])
+
+
+def test_texture_measure_batch_all_zero_matrix():
+    comats = np.random.RandomState(34).randint(1, 50, size=[3, 5, 5])
+    comats[1] = 0
+    params = dict(coordmom=2, probmom=2, rllen=0.1, clusmom=2)
+    vals = gentex.texmeas.batch_measures(comats, **params)
+    for meas in gentex.texmeas.BATCH_MEASURES:
+        assert np.isnan(vals[meas][1])
+        assert not np.isnan(vals[meas][[0, 2]]).any()
+
+
+def test_texture_measure_em_classes():
+    import scipy.stats as ss
+
+    comat = np.random.randint(1, 20, size=[8, 8]) + np.diag(np.random.randint(0, 200, 8))
+    mytex = gentex.texmeas.Texmeas(comat, measure='CM Entropy', clusp=0.01)
+    mytex.est_em()
+
+    # Reference: every row after the first is tested against the first one
+    # and a significant difference starts a new class
+    classes = [0]
+    for j in range(1, 8):
+        pval = ss.chisquare(mytex.totcount * mytex.condo[0], mytex.totcount * mytex.condo[j])[1]
+        classes.append(classes[-1] + int(pval < 0.01))
+    assert np.array_equal(mytex.emclasses, classes)
+    assert mytex.emclus == classes[-1] + 1
+    assert mytex.emmat.shape == (mytex.emclus, mytex.emclus)
+    assert np.allclose(np.sum(mytex.emmat, axis=1), 1.0)
+
+
+def test_texture_measure_em_classes_not_samelev():
+    # rows 0, 1 and columns 0, 1 have the same distributions, row 2 and
+    # column 2 are far from them
+    comat = np.array([[10, 10, 100], [10, 10, 100], [100, 100, 10]])
+    mytex = gentex.texmeas.Texmeas(comat, measure='CM Entropy', clusp=0.01, samelev=False)
+    mytex.est_em()
+    assert np.array_equal(mytex.emclasses, [0, 0, 1])
+    assert mytex.emclus == 2
+    # rows and columns of each class summed: [[40, 200], [200, 10]]
+    assert np.allclose(mytex.emmat, [[40 / 240, 200 / 240], [200 / 210, 10 / 210]])
+
+
+def test_texture_measure_stationary():
+    # periodic chain: plain power iteration would oscillate
+    assert np.allclose(gentex.texmeas._stationary(np.array([[0.0, 1.0], [1.0, 0.0]])), [0.5, 0.5])
+    mat = np.random.rand(300, 300)
+    mat = mat / np.sum(mat, axis=1)[:, np.newaxis]
+    nodep = gentex.texmeas._stationary(mat)
+    assert np.isclose(np.sum(nodep), 1.0)
+    assert np.allclose(np.dot(nodep, mat), nodep)
+
+
+def test_texture_measure_multi_frac_spec():
+    comat = np.random.randint(1, 20, size=[6, 6]) + np.diag(np.random.randint(0, 200, 6))
+    # beta = 0 is skipped, beta = 1 is the metric entropy
+    mytex = gentex.texmeas.Texmeas(comat, measure='EM Entropy', clusp=0.01, betas=[-2, 2, 5])
+    mytex.est_multi_frac_spec()
+    assert mytex.mfsspec.shape[1] == 2 and mytex.mfsspec.shape[0] <= 4
+    assert np.any(np.all(np.isclose(mytex.mfsspec, mytex.val), axis=1))
+    spec = mytex.mfsspec
+    mytex.est_multi_frac_spec(workers=3)
+    assert np.allclose(mytex.mfsspec, spec)
+
+
+def test_texture_measure_multi_frac_spec_lost_betas(monkeypatch):
+    from gentex.texmeas import _multi_frac_spec
+
+    # beta = -20 overflows on the tiny entry: only that point is lost
+    emmat = np.array([[0.5, 0.5 - 1e-20, 1e-20], [0.2, 0.3, 0.5], [0.4, 0.4, 0.2]])
+    spec = _multi_frac_spec(emmat, [-20, 2, 5])
+    assert np.isnan(spec[0]).all()
+    assert np.allclose(spec[1:], np.concatenate([_multi_frac_spec(emmat, [2]), _multi_frac_spec(emmat, [5])]))
+
+    # a zero row gives nan points rather than an error
+    spec = _multi_frac_spec(np.array([[0.5, 0.5, 0.0], [0.2, 0.3, 0.5], [0.0, 0.0, 0.0]]), [-2, 2])
+    assert spec.shape == (2, 2) and np.isnan(spec).all()
+
+    # the stacked eigen decomposition failing falls back to one beta at a time
+    eig = np.linalg.eig
+
+    def failing(mats):
+        if mats.ndim > 2:
+            raise np.linalg.LinAlgError('Eigenvalues did not converge')
+        return eig(mats)
+
+    ref = _multi_frac_spec(emmat, [-2, 2, 5])
+    monkeypatch.setattr(np.linalg, 'eig', failing)
+    assert np.allclose(_multi_frac_spec(emmat, [-2, 2, 5]), ref)
+
+
+def test_texture_measure_em_cache():
+    cache = gentex.texmeas.em_cache
+    cache.clear()
+    comat = np.random.randint(1, 20, size=[6, 6]) + np.diag(np.random.randint(0, 200, 6))
+    first = gentex.texmeas.Texmeas(comat, measure='Multifractal Spectrum Energy Range')
+    assert cache.info()['misses'] == 2 and cache.info()['size'] == 2
+    # the same counts (in a different dtype) reuse the epsilon machine and spectrum
+    second = gentex.texmeas.Texmeas(comat.astype(np.float32), measure='Multifractal Spectrum Energy Range')
+    assert cache.info()['hits'] == 2
+    assert second.emmat is first.emmat and not second.emmat.flags.writeable
+    assert second.val == first.val
+    # a different clusp is a different epsilon machine
+    gentex.texmeas.Texmeas(comat, measure='EM Entropy', clusp=0.01)
+    assert cache.info()['size'] == 3
+    cache.resize(1)
+    assert cache.info()['size'] == 1
+    cache.resize(128)
+    cache.clear()
+
+
+def test_texture_measure_functional():
+    from concurrent.futures import ThreadPoolExecutor
+
+    params = dict(coordmom=2, probmom=2, rllen=0.1, clusmom=2)
+    comats = [np.random.randint(1, 20, size=[5, 5]) for _ in range(12)]
+    serial = [gentex.texmeas.measures(cm, params=params) for cm in comats]
+    gentex.texmeas.em_cache.clear()
+    with ThreadPoolExecutor(4) as pool:
+        threaded = list(pool.map(lambda cm: gentex.texmeas.measures(cm, params=params), comats))
+    for ref, vals in zip(serial, threaded):
+        assert list(vals) == gentex.texmeas.MEASURES
+        assert all(np.isclose(ref[meas], vals[meas], equal_nan=True) for meas in ref)
+
+
+def test_texture_measure_param_change():
+    comat = np.random.randint(1, 20, size=[5, 5])
+    mytex = gentex.texmeas.Texmeas(comat, measure='Contrast', coordmom=1, probmom=1)
+    mytex.calc_measure('Contrast', coordmom=2)
+    assert np.isclose(mytex.val, gentex.texmeas.measures(comat, ['Contrast'], dict(coordmom=2, probmom=1))['Contrast'])
+    # attributes set directly also drop the stale value
+    mytex.probmom = 2
+    mytex.calc_measure('Contrast')
+    assert np.isclose(mytex.val, gentex.texmeas.measures(comat, ['Contrast'], dict(coordmom=2, probmom=2))['Contrast'])
+
+
+def test_texture_measure_sum_difference():
+    comat = np.random.randint(0, 20, size=[4, 4])
+    p = comat / np.sum(comat)
+    vals = gentex.texmeas.measures(comat, list(gentex.texmeas._SUMDIFF_MEASURES))
+
+    # Direct sums over the matrix, grey levels starting at 1
+    psum = np.zeros(9)
+    pdiff = np.zeros(4)
+    for i in range(4):
+        for j in range(4):
+            psum[i + j + 2] += p[i, j]
+            pdiff[abs(i - j)] += p[i, j]
+    ent = lambda x: -np.sum(x[x > 0] * np.log2(x[x > 0]))
+    sav = np.sum(np.arange(9) * psum)
+    assert np.isclose(vals['Sum Average'], sav)
+    assert np.isclose(vals['Sum Variance'], np.sum((np.arange(9) - sav) ** 2 * psum))
+    assert np.isclose(vals['Sum Entropy'], ent(psum))
+    assert np.isclose(vals['Difference Variance'], np.sum((np.arange(4) - np.sum(np.arange(4) * pdiff)) ** 2 * pdiff))
+    assert np.isclose(vals['Difference Entropy'], ent(pdiff))
+
+    px, py = np.sum(p, axis=1), np.sum(p, axis=0)
+    pxpy = np.outer(px, py)
+    hxy1 = -np.sum(p[p > 0] * np.log2(pxpy[p > 0]))
+    assert np.isclose(vals['Information Measure of Correlation 1'], (ent(p) - hxy1) / max(ent(px), ent(py)))
+    assert np.isclose(vals['Information Measure of Correlation 2'], np.sqrt(1 - 2.0 ** (-2 * (ent(pxpy) - ent(p)))))